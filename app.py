@@ -12,21 +12,62 @@ Responsibilities:
 
 from flask import (
     Flask, render_template, url_for, request,
-    redirect, flash, session, jsonify
+    redirect, flash, session, jsonify, Response, send_from_directory, abort
 )
-from werkzeug.utils import secure_filename
+from markupsafe import Markup
+from werkzeug.middleware.proxy_fix import ProxyFix
 import os
+import gzip
+import json
+import hashlib
+import math
 import secrets
 import cs304login as auth
 import wfresh_helper
+import wfresh_events
+import wfresh_feasts
+import wfresh_http
+import wfresh_metrics
+import wfresh_profiling
+import wfresh_trending
+import wfresh_images
+import wfresh_static
+import wfresh_uploads
+from wfresh_cache import LRUCache
+from wfresh_passwords import PasswordPoolBusy
+from wfresh_ratelimit import Budget, TokenBucketLimiter
 
 # -----------------------------------------------------------------------------
 # Flask app setup
 # -----------------------------------------------------------------------------
 app = Flask(__name__)
 
+# Optional Python config file, e.g. WFRESH_CONFIG=/etc/wfresh/config.py. Values
+# set there (SECRET_KEY, MAX_CONTENT_LENGTH, WRITE_BEHIND, ...) win over the
+# defaults below.
+app.config.from_envvar('WFRESH_CONFIG', silent=True)
+
+
+def load_secret_key():
+    """
+    Return (key, persistent) for signing session cookies.
+
+    Looked up in order: SECRET_KEY from WFRESH_CONFIG, the WFRESH_SECRET_KEY
+    environment variable, the file named by WFRESH_SECRET_KEY_FILE. Every worker
+    process (and every restart) must use the same key, or users get logged out;
+    without one a random per-process key is used (fine for the dev server only).
+    """
+    key = app.config.get('SECRET_KEY') or os.environ.get('WFRESH_SECRET_KEY')
+    if not key and os.environ.get('WFRESH_SECRET_KEY_FILE'):
+        with open(os.environ['WFRESH_SECRET_KEY_FILE']) as f:
+            key = f.read().strip()
+    if key:
+        return key, True
+    return secrets.token_hex(), False
+
+
 # Secret key enables sessions + flash messages.
-app.secret_key = secrets.token_hex()
+app.secret_key, app.config['SECRET_KEY_PERSISTENT'] = load_secret_key()
 
 # Better error messages for certain common request errors.
 app.config['TRAP_BAD_REQUEST_ERRORS'] = True
@@ -35,14 +76,146 @@ app.config['TRAP_BAD_REQUEST_ERRORS'] = True
 # Upload configuration (for dish pictures)
 # -----------------------------------------------------------------------------
 # Save images into static/uploads/
-app.config['UPLOAD_FOLDER'] = os.path.join(app.root_path, 'static', 'uploads')
+app.config.setdefault('UPLOAD_FOLDER', os.path.join(app.root_path, 'static', 'uploads'))
 
 # Limit uploads to 5MB
-app.config['MAX_CONTENT_LENGTH'] = 5 * 1024 * 1024
+if app.config['MAX_CONTENT_LENGTH'] is None:   # Flask's own default is None
+    app.config['MAX_CONTENT_LENGTH'] = 5 * 1024 * 1024
+
+# Chunk size the browser uploader uses for resumable uploads (well under the 5MB limit)
+UPLOAD_CHUNK_SIZE = 1024 * 1024
 
 # Ensure the upload folder exists at runtime.
 os.makedirs(app.config['UPLOAD_FOLDER'], exist_ok=True)
 
+# Optional group-commit mode for comments/messages/feasts (see wfresh_writeq.py).
+app.config.setdefault('WRITE_BEHIND', os.environ.get('WFRESH_WRITE_BEHIND') == '1')
+if app.config['WRITE_BEHIND']:
+    wfresh_helper.enable_write_behind()
+
+# Fingerprint static/ assets: url_for('static') yields content-hashed, immutable URLs.
+# Run `python wfresh_static.py build` at deploy time to precompress them.
+static_assets = wfresh_static.StaticAssets(app)
+
+# Conditional GET validators also cover the asset manifest, so pages that
+# reference old fingerprinted URLs are never revalidated after a deploy.
+app.config['ETAG_SALT'] = static_assets.manifest_digest()
+
+# gzip large text responses (precompressed/pre-encoded responses pass through).
+app.wsgi_app = wfresh_http.CompressionMiddleware(app.wsgi_app, min_size=1024)
+
+# Behind a reverse proxy, remote_addr is the proxy's address, which would put
+# every client in one per-IP rate-limit bucket. WFRESH_PROXY_HOPS = how many
+# trusted proxies append to X-Forwarded-For (0 = not proxied; never trust the
+# header then, since clients can set it themselves).
+app.config.setdefault('PROXY_HOPS', int(os.environ.get('WFRESH_PROXY_HOPS', 0)))
+if app.config['PROXY_HOPS']:
+    app.wsgi_app = ProxyFix(app.wsgi_app, x_for=app.config['PROXY_HOPS'], x_proto=app.config['PROXY_HOPS'])
+
+# Request/template timing for /metrics. Set WFRESH_METRICS_DIR to aggregate
+# every worker process into each scrape.
+wfresh_metrics.init_app(app)
+
+# Slow-query log + opt-in request sampling (WFRESH_PROFILE_RATE / WFRESH_PROFILE_SECRET).
+wfresh_profiling.init_app(app)
+
+# Who may scrape /metrics (comma-separated client addresses)
+app.config.setdefault('METRICS_ALLOW', set(os.environ.get('WFRESH_METRICS_ALLOW', '127.0.0.1,::1').split(',')))
+
+# Every open /events/ stream holds a request thread (gunicorn gthread: WFRESH_THREADS
+# per worker); keep most of them for pages. wfresh_async.AsgiApp resets this for its pool.
+wfresh_events.bus.max_subscribers = wfresh_events.stream_limit(int(os.environ.get('WFRESH_THREADS', 8)))
+
+# -----------------------------------------------------------------------------
+# Thread page HTML cache
+# -----------------------------------------------------------------------------
+# Cache fully rendered thread pages per (thid, viewer uid). Entries are tagged with
+# the thread version, so any insert/delete on the thread invalidates them.
+app.config.setdefault('THREAD_HTML_CACHE', True)
+_thread_html_cache = LRUCache(maxsize=512)
+
+# -----------------------------------------------------------------------------
+# Home page menu fragment cache
+# -----------------------------------------------------------------------------
+# The 7-day grid only changes when menu_cache.json or the dish stats do, so each
+# day's HTML is rendered once per (meal order, date, label) and tagged with
+# (cache file version, dish stats token); a menu refresh or a new count makes
+# every entry a miss.
+app.config.setdefault('MENU_FRAGMENT_CACHE', True)
+_menu_fragment_cache = LRUCache(maxsize=64)
+
+
+def render_menu_day(day: dict, meal_order: list, version, dish_stats: dict) -> Markup:
+    """
+    Render one day of the menu grid (templates/_menu_day.html), cached.
+
+    version None means the menus did not come from the cache file
+    (live fallback fetch), so the fragment is rendered but not cached.
+    dish_stats: did -> wfresh_helper.DishStats (see get_week_dish_stats)
+    """
+    use_cache = app.config['MENU_FRAGMENT_CACHE'] and version is not None
+    key = (tuple(meal_order), day['date'].isoformat(), day['label'])
+    if use_cache:
+        html = _menu_fragment_cache.get(key, version)
+        if html is not None:
+            return html
+
+    html = Markup(render_template('_menu_day.html', day=day, meal_order=meal_order,
+                                  dish_stats=dish_stats, no_stats=wfresh_helper.NO_DISH_STATS))
+    if use_cache:
+        _menu_fragment_cache.put(key, html, version)
+    return html
+
+# Serialized (and gzipped) /api/menu bodies, tagged with (menu version, stats token) like above.
+_menu_api_cache = LRUCache(maxsize=128)
+
+# Bodies smaller than this are not worth compressing
+MIN_GZIP_SIZE = 1024
+
+
+
+# -----------------------------------------------------------------------------
+# Rate limits for mutating routes
+# -----------------------------------------------------------------------------
+# endpoint -> (per-uid budget, per-IP budget). The IP budget is looser because
+# many students share a campus NAT address.
+RATE_LIMITS = {
+    'index': (Budget(per_minute=4, burst=3), Budget(per_minute=40, burst=20)),          # feasts
+    'dishdash': (Budget(per_minute=4, burst=3), Budget(per_minute=40, burst=20)),       # new threads
+    'view_thread': (Budget(per_minute=20, burst=10), Budget(per_minute=200, burst=60)), # replies
+    'get_dish': (Budget(per_minute=10, burst=5), Budget(per_minute=100, burst=30)),     # comments/uploads
+    'start_upload': (Budget(per_minute=10, burst=5), Budget(per_minute=100, burst=30)), # chunked uploads
+}
+_limiter = TokenBucketLimiter()
+
+
+def check_rate_limit(uid):
+    """
+    Spend one token from this endpoint's per-uid and per-IP buckets (from both,
+    or from neither when either is empty).
+
+    Returns:
+        None if the request may proceed, otherwise a small 429 response.
+    """
+    budgets = RATE_LIMITS.get(request.endpoint)
+    if budgets is None:
+        return None
+
+    uid_budget, ip_budget = budgets
+    wait = _limiter.allow_all((
+        ((request.endpoint, 'uid', uid), uid_budget),
+        ((request.endpoint, 'ip', request.remote_addr), ip_budget),
+    ))
+    if not wait:
+        return None
+
+    return Response(
+        'Too many requests - please slow down and try again shortly.\n',
+        status=429,
+        mimetype='text/plain',
+        headers={'Retry-After': str(math.ceil(wait))}
+    )
+
 
 # -----------------------------------------------------------------------------
 # Auth utilities
@@ -60,15 +233,21 @@ def require_login():
 
     If not logged in:
       - For normal routes, redirect to about page with a flash message.
+    If the user/IP is over the route's RATE_LIMITS budget:
+      - Return a 429 response (no DB or disk work is done).
 
     Returns:
         uid (int/str) if logged in,
-        otherwise a Flask redirect response that should be returned immediately.
+        otherwise a Flask response that should be returned immediately.
     """
     uid = current_uid()
     if uid is None:
         flash("Please log in to do that.")
         return redirect(url_for('about'))
+
+    limited = check_rate_limit(uid)
+    if limited is not None:
+        return limited
     return uid
 
 
@@ -103,8 +282,13 @@ def join():
 
     # db_connect returns (conn, cur). cs304login expects *conn* only.
     conn, _ = wfresh_helper.db_connect(dict_cursor=False)
-    (uid, is_dup, other_err) = auth.insert_user(conn, username, passwd1)
-    conn.close()
+    try:
+        (uid, is_dup, other_err) = auth.insert_user(conn, username, passwd1)
+    except PasswordPoolBusy:
+        flash('We are very busy right now; please try again in a moment.')
+        return redirect(url_for('about'))
+    finally:
+        conn.close()
 
     if other_err:
         raise other_err
@@ -134,8 +318,13 @@ def login():
 
     # db_connect returns (conn, cur). cs304login expects *conn* only.
     conn, _ = wfresh_helper.db_connect(dict_cursor=False)
-    (ok, uid) = auth.login_user(conn, username, passwd)
-    conn.close()
+    try:
+        (ok, uid) = auth.login_user(conn, username, passwd)
+    except PasswordPoolBusy:
+        flash('We are very busy right now; please try again in a moment.')
+        return redirect(url_for('about'))
+    finally:
+        conn.close()
 
     if not ok:
         flash('login incorrect, please try again or join')
@@ -166,14 +355,83 @@ def logout():
         return redirect(url_for('about'))
 
 
+# -----------------------------------------------------------------------------
+# Data prefetched by the async front end (wfresh_async)
+# -----------------------------------------------------------------------------
+def prefetched(key, load, *args):
+    """
+    Return the value wfresh_async already loaded for this request under key, or
+    load(*args) when it did not (plain WSGI, or a read it does not prefetch).
+    """
+    data = request.environ.get('wfresh.prefetch')
+    if data is not None and key in data:
+        return data[key]
+    return load(*args)
+
+
+# -----------------------------------------------------------------------------
+# "Trending now" panels (wfresh_trending keeps the counts in memory)
+# -----------------------------------------------------------------------------
+# How many entries a panel shows (the counters keep a few more, so deleted
+# threads / unknown dishes can be skipped)
+TRENDING_SHOWN = 5
+
+
+def trending_dishes():
+    """[(did, name, comments today)] for the most-commented dishes."""
+    top = wfresh_trending.dishes.top()
+    names = wfresh_helper.get_dish_names([did for did, _ in top]) if top else {}
+    return [(did, names[did], n) for did, n in top if did in names][:TRENDING_SHOWN]
+
+
+def trending_threads():
+    """[(thid, description, messages this hour)] for the most active threads."""
+    top = wfresh_trending.threads.top()
+    titles = wfresh_helper.get_thread_titles([thid for thid, _ in top]) if top else {}
+    return [(thid, titles[thid], n) for thid, n in top if thid in titles][:TRENDING_SHOWN]
+
+
+# -----------------------------------------------------------------------------
+# Conditional GET validators (see wfresh_http.conditional)
+# -----------------------------------------------------------------------------
+def home_validator():
+    """Menu cache version + date + dish stats token + active feasts + trending (all cached)."""
+    version = wfresh_helper.menu_cache_version()
+    if version is None:
+        return None
+    today = wfresh_helper.date.today()
+    week_menu = wfresh_helper.fetch_week_menu(today)
+    stats_token, _ = wfresh_helper.get_week_dish_stats(week_menu, version)
+    feasts = wfresh_helper.get_active_feast_events(limit=3)
+    return (version, today.isoformat(), stats_token, tuple(row[0] for row in feasts),
+            wfresh_trending.dishes.top(), wfresh_trending.threads.top())
+
+
+def dishdash_validator():
+    return wfresh_helper.get_dishdash_validator() + (wfresh_trending.threads.top(),)
+
+
+def thread_validator(thid):
+    return wfresh_helper.thread_versions.token(thid)
+
+
+def dish_validator(did):
+    return prefetched('dish_validator', wfresh_helper.get_dish_validator, did)
+
+
 @app.route('/home/', methods=['GET', 'POST'])
+@wfresh_http.conditional(home_validator)
 def index():
     """
     Home page.
 
     GET:
-      - Show 7-day dining hall menus (cached in wfresh_helper.py)
-      - Show most recent feast notifications (db)
+      - Show today's dining hall menus (cached in wfresh_helper.py); the other
+        six days are lazy-loaded from /api/menu (?days=all renders all seven)
+      - Each dish shows its yum/yuck/picture counts and newest thumbnail
+        (one batched query for the week, cached with the menu)
+      - Show feasts happening now / coming up (db, cached)
+      - Show the trending dishes (today) and threads (this hour)
 
     POST:
       - Create a new Wellesley Feast notification (requires login)
@@ -197,6 +455,7 @@ def index():
             flash('Please fill out food name, location, and time for Wellesley Feast.')
             return redirect(url_for('index'))
 
+        # Waits for the (group) commit, so a failed write is an error, not a false "posted".
         wfresh_helper.insert_feast_notification(
             owner_uid=uid,
             time_text=time_text,
@@ -215,45 +474,156 @@ def index():
     # You can also use wfresh_helper.get_meal_order(datetime.now()) if you want dynamic ordering.
     meal_order = ["Breakfast", "Lunch", "Dinner"]
 
+    # Only today is rendered here; the browser lazy-loads the other days from
+    # /api/menu. ?days=all renders the whole week (no-JS fallback).
+    render_days = 7 if request.args.get('days') == 'all' else 1
+
+    # Version first: a concurrent refresh can then only make it look older than the data.
+    menu_version = wfresh_helper.menu_cache_version()
     week_menu = wfresh_helper.fetch_week_menu(today)
+    stats_token, dish_stats = wfresh_helper.get_week_dish_stats(week_menu, menu_version)
 
-    days = []
-    for offset in range(7):
+    day_fragments = []
+    for offset in range(render_days):
         d = today + wfresh_helper.timedelta(days=offset)
         label = "Today" if offset == 0 else d.strftime("%A %b %-d")
         date_key = d.isoformat()
 
+        version = (menu_version, stats_token) if menu_version is not None else None
         menus = week_menu.get(date_key, {})
         if not menus:
-            # Fallback fetch (rare / defensive)
-            menus = {}
-            for meal in wfresh_helper.MEALS:
-                menus[meal] = {}
-                for dhall_id, info in wfresh_helper.DINING_HALLS.items():
-                    dishes = wfresh_helper.fetch_menu_for(d, dhall_id, meal)
-                    if dishes:
-                        menus[meal][info["name"]] = dishes
+            # Fallback fetch (the cache's last day, or a failed fetch)
+            version = None
+            menus = wfresh_helper.fetch_day_menu(d)
+
+        day = {"date": d, "label": label, "menus": menus}
+        day_fragments.append(render_menu_day(day, meal_order, version, dish_stats))
 
-        days.append({"date": d, "label": label, "menus": menus})
+    lazy_days = [today + wfresh_helper.timedelta(days=offset) for offset in range(render_days, 7)]
 
-    feast_events = wfresh_helper.get_recent_feast_events(limit=3)
+    feast_events = wfresh_helper.get_active_feast_events(limit=3)
 
     return render_template(
         "main.html",
-        days=days,
+        day_fragments=day_fragments,
+        lazy_days=lazy_days,
         meal_order=meal_order,
         feast_events=feast_events,
+        trending_dishes=trending_dishes(),
+        trending_threads=trending_threads(),
         page_title='Home'
     )
 
 
+@app.route('/api/menu')
+def api_menu():
+    """
+    Menu data as JSON (read-only, no login required).
+
+    Query (all optional):
+      - date: YYYY-MM-DD (default: every cached day)
+      - meal: Breakfast | Lunch | Dinner
+      - hall: dining hall name, e.g. Bates
+
+    The body also carries "stats": did -> [yum, yuck, pictures, thumbnail URL]
+    for the dishes in it (wfresh_helper.get_week_dish_stats).
+
+    Responses carry a strong ETag derived from the menu cache version and the
+    dish stats token, so If-None-Match revalidation returns 304 from cached
+    values without touching the menu data. Bodies are gzipped when the client
+    accepts it.
+
+    A date within the coming week that the cache lacks is fetched live, as on
+    the home page (no ETag then).
+    """
+    date_key = request.args.get('date') or None
+    meal = request.args.get('meal') or None
+    hall = request.args.get('hall') or None
+
+    if date_key is not None:
+        try:
+            date_key = wfresh_helper.date.fromisoformat(date_key).isoformat()
+        except ValueError:
+            return jsonify(error='date must be YYYY-MM-DD'), 400
+    if meal is not None:
+        meal = meal.capitalize()
+        if meal not in wfresh_helper.MEALS:
+            return jsonify(error=f'meal must be one of {", ".join(wfresh_helper.MEALS)}'), 400
+    if hall is not None:
+        halls = {info['name'].lower(): info['name'] for info in wfresh_helper.DINING_HALLS.values()}
+        hall = halls.get(hall.lower())
+        if hall is None:
+            return jsonify(error=f'hall must be one of {", ".join(halls.values())}'), 400
+
+    encoding = 'gzip' if request.accept_encodings['gzip'] else None
+    key = (date_key, meal, hall, encoding)
+
+    # Version first: a concurrent refresh can then only make it look older than the data.
+    menu_version = wfresh_helper.menu_cache_version()
+    week_menu = wfresh_helper.fetch_week_menu(wfresh_helper.date.today())
+    stats_token, dish_stats = wfresh_helper.get_week_dish_stats(week_menu, menu_version)
+    if date_key is not None and not week_menu.get(date_key):
+        d = wfresh_helper.date.fromisoformat(date_key)
+        if 0 <= (d - wfresh_helper.date.today()).days < 7:
+            week_menu = {date_key: wfresh_helper.fetch_day_menu(d)}
+            dish_stats = wfresh_helper.get_dish_stats(wfresh_helper.week_dish_ids(week_menu))
+            menu_version = None
+    version = (menu_version, stats_token)
+    etag = None
+    if menu_version is not None:
+        digest = hashlib.sha1(repr(version + key).encode()).hexdigest()[:20]
+        etag = digest + ('-gzip' if encoding else '')
+        if request.if_none_match.contains(etag):
+            return _menu_api_response(Response(status=304), etag)
+
+    cached = _menu_api_cache.get(key, version) if menu_version is not None else None
+    if cached is None:
+        data = wfresh_helper.slice_week_menu(week_menu, date_key, meal, hall)
+        stats = {}
+        for meals in data.values():
+            for halls in meals.values():
+                for dishes in halls.values():
+                    for dish in dishes:
+                        st = dish_stats.get(dish['did'])
+                        if st is not None:
+                            thumb = url_for('uploaded_file', filename=st.thumb) if st.thumb else None
+                            stats[dish['did']] = [st.yum, st.yuck, st.pictures, thumb]
+        body = json.dumps({'version': menu_version, 'days': data, 'stats': stats}, separators=(',', ':'),
+                          default=wfresh_helper.menu_json_default).encode()
+        content_encoding = None
+        if encoding and len(body) >= MIN_GZIP_SIZE:
+            body = gzip.compress(body, compresslevel=6)
+            content_encoding = encoding
+        cached = (body, content_encoding)
+        if menu_version is not None:
+            _menu_api_cache.put(key, cached, version)
+
+    body, content_encoding = cached
+    resp = Response(body, mimetype='application/json')
+    if content_encoding:
+        resp.content_encoding = content_encoding
+    return _menu_api_response(resp, etag)
+
+
+def _menu_api_response(resp, etag):
+    """Shared caching headers for /api/menu 200s and 304s."""
+    if etag is not None:
+        resp.set_etag(etag)
+    resp.cache_control.public = True
+    resp.cache_control.no_cache = True  # always revalidate; 304s are cheap
+    resp.vary.add('Accept-Encoding')
+    return resp
+
+
 @app.route('/dishdash/', methods=['GET', 'POST'])
+@wfresh_http.conditional(dishdash_validator)
 def dishdash():
     """
     DishDash forum landing page.
 
     GET:
       - List threads (most recent first)
+      - Show the most active threads this hour
 
     POST:
       - Create a new thread (requires login)
@@ -278,11 +648,13 @@ def dishdash():
         'dishdash.html',
         page_title='DishDash Forum',
         threads=threads,
+        trending_threads=trending_threads(),
         current_uid=current_uid()
     )
 
 
 @app.route('/dishdash/thread/<int:thid>', methods=['GET', 'POST'])
+@wfresh_http.conditional(thread_validator)
 def view_thread(thid):
     """
     View a single thread.
@@ -308,24 +680,85 @@ def view_thread(thid):
             flash('Message cannot be empty.')
             return redirect(url_for('view_thread', thid=thid))
 
-        wfresh_helper.insert_message(sender_uid=uid, thid=thid, content=content, replyto=replyto)
+        wfresh_helper.insert_message(
+            sender_uid=uid,
+            thid=thid,
+            content=content,
+            replyto=replyto,
+            sender_name=session.get('username')
+        )
         flash('Reply posted!')
         return redirect(url_for('view_thread', thid=thid))
 
-    thread = wfresh_helper.get_thread(thid)
+    # Pages with pending flash messages differ per request, so never cache those.
+    use_html_cache = app.config['THREAD_HTML_CACHE'] and '_flashes' not in session
+    html_key = (thid, current_uid())
+    version = wfresh_helper.thread_versions.get(thid)
+    if use_html_cache:
+        html = _thread_html_cache.get(html_key, version)
+        if html is not None:
+            return html
+
+    thread, messages = wfresh_helper.get_thread_view(thid)
     if not thread:
         flash('Thread not found.')
         return redirect(url_for('dishdash'))
 
-    rows = wfresh_helper.get_thread_messages(thid)
-    messages = wfresh_helper.build_message_tree(rows)
-
-    return render_template(
+    html = render_template(
         'thread.html',
         thread=thread,
         messages=messages,
         current_uid=current_uid()
     )
+    if use_html_cache:
+        _thread_html_cache.put(html_key, html, version)
+    return html
+
+
+@app.route('/metrics')
+def metrics():
+    """Prometheus scrape endpoint (restricted to METRICS_ALLOW addresses)."""
+    if request.remote_addr not in app.config['METRICS_ALLOW']:
+        return Response('Forbidden\n', status=403, mimetype='text/plain')
+    return Response(wfresh_metrics.render(), mimetype='text/plain; version=0.0.4')
+
+
+@app.route('/events/')
+def events():
+    """
+    Server-sent events stream for live updates (no login required; read-only).
+
+    Query:
+      - topics: comma-separated list of "feast" and/or "thread:<thid>"
+
+    At the subscriber limit (wfresh_events.stream_limit) the stream ends at
+    once with a retry delay, so EventSource reconnects later instead of
+    holding one of the few threads left for page requests.
+    """
+    topics = []
+    for topic in request.args.get('topics', '').split(','):
+        topic = topic.strip()
+        if topic == 'feast':
+            topics.append(topic)
+        elif topic.startswith('thread:') and topic[len('thread:'):].isdigit():
+            topics.append(topic)
+    if not topics:
+        return jsonify(error='no valid topics'), 400
+
+    try:
+        sub = wfresh_events.bus.subscribe(topics)
+    except wfresh_events.BusFull:
+        return Response(wfresh_events.busy_stream(), mimetype='text/event-stream',
+                        headers={'Cache-Control': 'no-cache', 'Retry-After': '30'})
+
+    return Response(
+        wfresh_events.sse_stream(sub),
+        mimetype='text/event-stream',
+        headers={
+            'Cache-Control': 'no-cache',
+            'X-Accel-Buffering': 'no',  # don't let a reverse proxy buffer the stream
+        }
+    )
 
 
 @app.route('/dishdash/thread/<int:thid>/delete_thread', methods=['POST'])
@@ -369,6 +802,7 @@ def delete_message(thid, mid):
 
 
 @app.route('/dish/<did>', methods=['GET', 'POST'])
+@wfresh_http.conditional(dish_validator)
 def get_dish(did):
     """
     Dish detail page.
@@ -401,11 +835,16 @@ def get_dish(did):
                 flash('Unsupported file type. Please upload png/jpg/jpeg/gif.')
                 return redirect(url_for('get_dish', did=did))
 
-            filename = secure_filename(file.filename)
-            filename = f"dish{did}_{filename}"
-            fullpath = os.path.join(app.config['UPLOAD_FOLDER'], filename)
-            file.save(fullpath)
-            filepath = filename
+            # Stored under the hash of its bytes (identical uploads share one file).
+            # Extension alone proves nothing: make sure it really is an image.
+            filepath = wfresh_uploads.store_upload(
+                file,
+                app.config['UPLOAD_FOLDER'],
+                validate=wfresh_images.validate_image
+            )
+            if filepath is None:
+                flash('That file is not a valid image.')
+                return redirect(url_for('get_dish', did=did))
 
         # Insert comment (owner = uid)
         if comment_text:
@@ -418,33 +857,152 @@ def get_dish(did):
 
         # Insert picture record (owner = uid)
         if filepath:
-            wfresh_helper.add_dish_picture(
+            pid = wfresh_helper.add_dish_picture(
                 did=did,
                 filename=filepath,
                 owner_uid=uid
             )
+            # Thumbnail/display variants are made off the request thread.
+            wfresh_images.schedule_variants(app.config['UPLOAD_FOLDER'], pid, filepath)
 
         flash('Comment/Picture added successfully!')
         return redirect(url_for('get_dish', did=did))
 
     # GET
-    dish = wfresh_helper.get_dish(did)
+    dish = prefetched('dish', wfresh_helper.get_dish, did)
     if dish is None:
         flash(f'No dish with id {did} found')
         return redirect(url_for('index'))
 
-    comments = wfresh_helper.get_dish_comments(did)
-    dish_pics = wfresh_helper.get_dish_pics(did)
+    comments = prefetched('dish_comments', wfresh_helper.get_dish_comments, did)
+    dish_pics = prefetched('dish_pics', wfresh_helper.get_dish_pics, did)
 
     return render_template(
         'dish.html',
         dish=dish,
         comments=comments,
         dish_pics=dish_pics,
+        serve_originals=not wfresh_images.available(),
         current_uid=current_uid()
     )
 
 
+# -----------------------------------------------------------------------------
+# Resumable chunked picture uploads (used by dish.html when the browser supports it)
+# -----------------------------------------------------------------------------
+def _upload_session_or_error(upload_id, uid):
+    """Load an upload session owned by uid, or return an error response."""
+    meta = wfresh_uploads.load_session(app.config['UPLOAD_FOLDER'], upload_id)
+    if meta is None or meta['owner'] != uid:
+        return None, (jsonify(error='No such upload.'), 404)
+    return meta, None
+
+
+def _upload_error(err):
+    body = {'error': str(err)}
+    if err.offset is not None:
+        body['offset'] = err.offset
+    return jsonify(body), err.status
+
+
+@app.route('/dish/<did>/uploads/', methods=['POST'])
+def start_upload(did):
+    """
+    Start a resumable picture upload for dish did (requires login).
+
+    JSON body: {"size": <total bytes>}
+    Returns: {"upload_id", "offset", "chunk_size"}
+    """
+    uid_or_resp = require_login()
+    if not isinstance(uid_or_resp, (int, str)):
+        return uid_or_resp
+    uid = uid_or_resp
+
+    data = request.get_json(silent=True) or {}
+    try:
+        size = int(data.get('size', 0))
+        upload_id = wfresh_uploads.start_session(
+            app.config['UPLOAD_FOLDER'], did, uid, size, app.config['MAX_CONTENT_LENGTH']
+        )
+    except ValueError:
+        return jsonify(error='size must be an integer'), 400
+    except wfresh_uploads.UploadError as err:
+        return _upload_error(err)
+
+    return jsonify(upload_id=upload_id, offset=0, chunk_size=UPLOAD_CHUNK_SIZE), 201
+
+
+@app.route('/upload-sessions/<upload_id>', methods=['GET', 'PUT'])
+def upload_chunk(upload_id):
+    """
+    GET: how many bytes the server has (resume point).
+    PUT ?offset=N: append the raw request body at offset N, streamed to disk.
+    """
+    uid_or_resp = require_login()
+    if not isinstance(uid_or_resp, (int, str)):
+        return uid_or_resp
+    meta, error = _upload_session_or_error(upload_id, uid_or_resp)
+    if error:
+        return error
+
+    folder = app.config['UPLOAD_FOLDER']
+    if request.method == 'GET':
+        return jsonify(offset=wfresh_uploads.session_offset(folder, upload_id), size=meta['size'])
+
+    try:
+        offset = int(request.args.get('offset', '-1'))
+        new_offset = wfresh_uploads.append_chunk(folder, upload_id, meta, offset, request.stream)
+    except ValueError:
+        return jsonify(error='offset must be an integer'), 400
+    except wfresh_uploads.UploadError as err:
+        return _upload_error(err)
+    return jsonify(offset=new_offset, size=meta['size'])
+
+
+@app.route('/upload-sessions/<upload_id>/finish', methods=['POST'])
+def finish_upload(upload_id):
+    """Validate a completed upload, store it, and attach it to its dish in one step."""
+    uid_or_resp = require_login()
+    if not isinstance(uid_or_resp, (int, str)):
+        return uid_or_resp
+    uid = uid_or_resp
+    meta, error = _upload_session_or_error(upload_id, uid)
+    if error:
+        return error
+
+    folder = app.config['UPLOAD_FOLDER']
+    try:
+        filepath = wfresh_uploads.finish_session(
+            folder, upload_id, meta, validate=wfresh_images.validate_image
+        )
+    except wfresh_uploads.UploadError as err:
+        return _upload_error(err)
+
+    pid = wfresh_helper.add_dish_picture(did=meta['did'], filename=filepath, owner_uid=uid)
+    wfresh_images.schedule_variants(folder, pid, filepath)
+    flash('Comment/Picture added successfully!')
+    return jsonify(pid=pid, redirect=url_for('get_dish', did=meta['did']))
+
+
+@app.route('/uploads/<path:filename>')
+def uploaded_file(filename):
+    """
+    Serve an uploaded picture.
+
+    With Pillow installed only the resized variants are public: originals still
+    carry the uploader's EXIF/GPS metadata. Content-addressed names never change content, so browsers may cache them
+    forever; legacy flat names can be overwritten and get a short lifetime.
+    """
+    if wfresh_images.available() and not wfresh_images.is_variant_filename(filename):
+        abort(404)
+    if wfresh_uploads.is_content_addressed(filename):
+        resp = send_from_directory(app.config['UPLOAD_FOLDER'], filename, max_age=365 * 24 * 3600)
+        resp.cache_control.immutable = True
+        resp.cache_control.public = True
+        return resp
+    return send_from_directory(app.config['UPLOAD_FOLDER'], filename, max_age=3600)
+
+
 @app.route('/dish/<did>/delete_pic/<int:pid>', methods=['POST'])
 def delete_dish_pic(did, pid):
     """
@@ -462,13 +1020,12 @@ def delete_dish_pic(did, pid):
         requester_uid=uid
     )
 
-    # If DB says file no longer referenced, delete file from disk
+    # If DB says file no longer referenced, delete it (and its variants) from disk
     if ok and filename_to_maybe_delete:
-        path = os.path.join(app.config['UPLOAD_FOLDER'], filename_to_maybe_delete)
-        try:
-            os.remove(path)
-        except FileNotFoundError:
-            pass
+        wfresh_uploads.delete_stored(
+            app.config['UPLOAD_FOLDER'],
+            [filename_to_maybe_delete] + wfresh_images.all_variant_filenames(filename_to_maybe_delete)
+        )
 
     flash(msg)
     return redirect(url_for('get_dish', did=did))
@@ -504,5 +1061,15 @@ if __name__ == '__main__':
     else:
         port = os.getuid()
 
-    app.debug = True
+    # Development server only; production runs wsgi.py under gunicorn
+    # (gunicorn -c gunicorn.conf.py).
+    app.debug = os.environ.get('WFRESH_DEBUG', '1') == '1'
+
+    # Background threads (feast archiving, trending checkpoints) are started by
+    # the server entry points, not on import. With the reloader, only in the
+    # child process that serves requests.
+    if not app.debug or os.environ.get('WERKZEUG_RUN_MAIN') == 'true':
+        wfresh_feasts.sweeper.start()
+        wfresh_trending.syncer.start()
+
     app.run('0.0.0.0', port)
@@ -0,0 +1,15 @@
+"""
+asgi.py
+
+Async serving mode entry point (see wfresh_async.py):
+    uvicorn asgi:application
+    WFRESH_ASGI=1 gunicorn -c gunicorn.conf.py
+
+Under gunicorn the same preload/post_fork hooks as wsgi.py apply; plain
+uvicorn starts the background threads at lifespan startup instead.
+"""
+
+import wfresh_async
+import wsgi
+
+application = wfresh_async.AsgiApp(wsgi.application, on_startup=wsgi.post_fork)
@@ -0,0 +1,184 @@
+"""
+bench/bench_db.py
+
+Time the wfresh_helper DB layer at several data sizes and write a comparison report.
+
+For each size the scratch database is reset and refilled by gen_dataset.py
+(same seed, so runs are comparable), then every helper is timed on hot,
+median and cold inputs. Each cell shows the median time plus how many queries
+and rows one call cost (from the wfresh_metrics instrumentation). The last
+column compares growth in time with growth in data, so a helper whose cost
+grows faster than the data - a scaling cliff - stands out.
+
+Usage:
+    WFRESH_DB_NAME=wfresh_bench python bench/bench_db.py --sizes tiny,small,medium
+    WFRESH_DB_NAME=wfresh_bench python bench/bench_db.py --report db_report.md --json db.json
+
+Destructive: deletes every row in the target database (see gen_dataset.py).
+"""
+
+import argparse
+import json
+import os
+import statistics
+import sys
+import time
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, BENCH_DIR)
+sys.path.insert(0, os.path.dirname(BENCH_DIR))
+
+import gen_dataset  # noqa: E402
+
+
+def _db_totals():
+    """(queries, rows) recorded so far by the instrumented cursors, over all functions."""
+    import wfresh_metrics
+    queries = sum(sum(value[0]) for _, value in wfresh_metrics.DB_QUERY_SECONDS.snapshot())
+    rows = sum(value for _, value in wfresh_metrics.DB_ROWS.snapshot())
+    return queries, rows
+
+
+def bench(fn, repeat: int, before=None) -> dict:
+    """
+    Call fn() repeat times (before() runs untimed ahead of each call).
+
+    Returns:
+        dict with median/max ms, queries and rows per call, or the error
+    """
+    samples = []
+    q0, r0 = _db_totals()
+    try:
+        for _ in range(repeat):
+            if before is not None:
+                before()
+            start = time.perf_counter()
+            fn()
+            samples.append(time.perf_counter() - start)
+    except Exception as err:  # a failure at some size is a result, not a crash
+        return {'error': f'{type(err).__name__}: {err}'[:120]}
+    q1, r1 = _db_totals()
+    return {
+        'median_ms': round(statistics.median(samples) * 1000, 3),
+        'max_ms': round(max(samples) * 1000, 3),
+        'queries': round((q1 - q0) / repeat, 1),
+        'rows': round((r1 - r0) / repeat, 1),
+    }
+
+
+def run_size(helper, info: dict, repeat: int) -> dict:
+    """Benchmark every helper against one generated dataset."""
+    hot, median, deep = info['hot_thread'], info['median_thread'], info['deep_thread']
+    results = {}
+
+    results['list_threads'] = bench(helper.list_threads, repeat)
+    results['get_dishdash_validator'] = bench(helper.get_dishdash_validator, repeat)
+
+    for label, thid in (('hot', hot), ('median', median), ('deep chain', deep)):
+        rows = helper.get_thread_messages(thid)
+        results[f'get_thread_messages ({label})'] = bench(lambda: helper.get_thread_messages(thid), repeat)
+        results[f'build_message_tree ({label})'] = bench(lambda: helper.build_message_tree(rows), repeat)
+        # A version bump before each call forces a thread-cache miss.
+        results[f'get_thread_view uncached ({label})'] = bench(
+            lambda: helper.get_thread_view(thid), repeat, before=lambda: helper.thread_versions.bump(thid))
+    results['get_thread_view cached (hot)'] = bench(lambda: helper.get_thread_view(hot), repeat)
+
+    for label in ('hot', 'median', 'cold'):
+        did = info[f'{label}_dish']
+        results[f'get_dish_comments ({label})'] = bench(lambda: helper.get_dish_comments(did), repeat)
+        results[f'get_dish_pics ({label})'] = bench(lambda: helper.get_dish_pics(did), repeat)
+        results[f'get_dish_validator ({label})'] = bench(lambda: helper.get_dish_validator(did), repeat)
+
+    results['get_active_feast_events uncached'] = bench(
+        helper.get_active_feast_events, repeat, before=helper.invalidate_feast_cache)
+
+    names = [f'{i:02x}/{i:02x}/{"0" * 64}.jpg' for i in range(500)]
+    results['find_referenced_uploads (500 names)'] = bench(lambda: helper.find_referenced_uploads(names), repeat)
+
+    # Destructive, so once each and last.
+    owners = info['thread_owners']
+    for label, thid in (('median', median), ('hot', hot), ('deep chain', deep)):
+        results[f'delete_thread ({label})'] = bench(lambda: helper.delete_thread(owners[thid], thid), 1)
+
+    return results
+
+
+def report(sizes: list, runs: dict, counts: dict) -> str:
+    """Markdown comparison table (one column per size + growth vs. data growth)."""
+    first, last = sizes[0], sizes[-1]
+    data_growth = counts[last]['messages'] / counts[first]['messages'] if len(sizes) > 1 else 1.0
+
+    lines = ['# wfresh_helper DB benchmarks', '']
+    lines.append('| data | ' + ' | '.join(sizes) + ' |')
+    lines.append('|---|' + '---|' * len(sizes))
+    for key in ('users', 'threads', 'messages', 'comments', 'pictures'):
+        lines.append(f'| {key} | ' + ' | '.join(f'{counts[s][key]:,}' for s in sizes) + ' |')
+    lines.append('')
+
+    lines.append('| helper | ' + ' | '.join(sizes) + f' | growth ({first}->{last}, data x{data_growth:g}) |')
+    lines.append('|---|' + '---|' * (len(sizes) + 1))
+    for name in runs[first]:
+        cells = []
+        for size in sizes:
+            r = runs[size].get(name, {})
+            if 'error' in r:
+                cells.append(f"**{r['error']}**")
+            else:
+                cells.append(f"{r['median_ms']} ms ({r['queries']:g}q/{r['rows']:g}r)")
+        a, b = runs[first].get(name, {}), runs[last].get(name, {})
+        if 'median_ms' in a and 'median_ms' in b and a['median_ms'] > 0 and len(sizes) > 1:
+            growth = b['median_ms'] / a['median_ms']
+            flag = ' **superlinear**' if growth > 2 * data_growth else ''
+            cells.append(f'x{growth:.1f}{flag}')
+        else:
+            cells.append('-')
+        lines.append(f'| {name} | ' + ' | '.join(cells) + ' |')
+    return '\n'.join(lines) + '\n'
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark wfresh_helper at several data sizes')
+    parser.add_argument('--sizes', default='tiny,small', help=f'comma-separated presets from {list(gen_dataset.SCALES)}')
+    parser.add_argument('--repeat', type=int, default=5)
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--deep-chain', type=int, default=2000)
+    parser.add_argument('--report', help='write the markdown report here too')
+    parser.add_argument('--json', help='write raw results here')
+    parser.add_argument('--allow-main-db', action='store_true')
+    args = parser.parse_args()
+
+    sizes = [s.strip() for s in args.sizes.split(',') if s.strip()]
+    unknown = [s for s in sizes if s not in gen_dataset.SCALES]
+    if unknown:
+        parser.error(f'unknown sizes: {unknown}')
+
+    gen_dataset.check_database(args.allow_main_db)
+    import wfresh_helper
+
+    runs, counts, infos = {}, {}, {}
+    for size in sizes:
+        print(f'== {size}: generating', flush=True)
+        conn = gen_dataset.connect()
+        try:
+            gen_dataset.reset(conn)
+            info = gen_dataset.generate(conn, gen_dataset.SCALES[size], seed=args.seed,
+                                        deep_chain=args.deep_chain, log=lambda msg: None)
+        finally:
+            conn.close()
+        print(f'== {size}: generated in {info["seconds"]}s, benchmarking', flush=True)
+        counts[size] = gen_dataset.SCALES[size]
+        infos[size] = {k: v for k, v in info.items() if k != 'thread_owners'}
+        runs[size] = run_size(wfresh_helper, info, args.repeat)
+
+    text = report(sizes, runs, counts)
+    print(text)
+    if args.report:
+        with open(args.report, 'w') as f:
+            f.write(text)
+    if args.json:
+        with open(args.json, 'w') as f:
+            json.dump({'datasets': infos, 'results': runs}, f, indent=2)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,194 @@
+"""
+bench/bench_menu.py
+
+Menu pipeline benchmarks against the local fake AVI server (bench/fake_avi.py).
+
+Measures:
+1) fetch_menu_for: latency of one AVI call + parse (p50/p95/max)
+2) fetch_week_menu, cold: no cache file -> full refresh (time, AVI requests,
+   bytes transferred, peak Python memory)
+3) fetch_week_menu, warm: served from the cache file
+4) parse_data.get_payload_df (only if pandas is installed)
+
+The app is pointed at the fake server and a throwaway cache file through
+WFRESH_AVI_API / WFRESH_MENU_CACHE, so nothing real is touched.
+
+Usage:
+    python bench/bench_menu.py
+    python bench/bench_menu.py --latency-ms 150 --repeat 20 --json results.json
+    python bench/bench_menu.py --source synthetic --dishes 60 --pad 400
+"""
+
+import argparse
+import gc
+import json
+import os
+import statistics
+import sys
+import tempfile
+import time
+import tracemalloc
+from datetime import date
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, BENCH_DIR)
+sys.path.insert(0, os.path.dirname(BENCH_DIR))
+
+import fake_avi  # noqa: E402
+
+
+def summarize(samples: list) -> dict:
+    """Latency summary in milliseconds."""
+    ms = sorted(s * 1000 for s in samples)
+    return {
+        'n': len(ms),
+        'p50_ms': round(statistics.median(ms), 3),
+        'p95_ms': round(ms[min(len(ms) - 1, int(len(ms) * 0.95))], 3),
+        'max_ms': round(ms[-1], 3),
+        'mean_ms': round(statistics.fmean(ms), 3),
+    }
+
+
+def timed(fn, *args):
+    """Run fn once; return (result, seconds)."""
+    start = time.perf_counter()
+    result = fn(*args)
+    return result, time.perf_counter() - start
+
+
+def peak_memory(fn, *args) -> int:
+    """Run fn once under tracemalloc (slow - never timed); return peak traced bytes."""
+    gc.collect()
+    tracemalloc.start()
+    try:
+        fn(*args)
+        return tracemalloc.get_traced_memory()[1]
+    finally:
+        tracemalloc.stop()
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark the menu pipeline against a fake AVI server')
+    fake_avi.add_arguments(parser)
+    parser.add_argument('--repeat', type=int, default=10, help='iterations for the repeated benchmarks')
+    parser.add_argument('--cold-repeat', type=int, default=3, help='cold week refreshes to run')
+    parser.add_argument('--avi-url', help='use an already running (fake) AVI server instead')
+    parser.add_argument('--json', help='also write results to this file')
+    args = parser.parse_args()
+
+    server = None
+    if args.avi_url:
+        avi_url = args.avi_url
+    else:
+        server = fake_avi.start_server(**fake_avi.server_kwargs(args))
+        avi_url = server.url
+
+    cache_dir = tempfile.mkdtemp(prefix='wfresh-bench-')
+    cache_file = os.path.join(cache_dir, 'menu_cache.json')
+
+    # Must be set before wfresh_helper is imported (module-level settings).
+    os.environ['WFRESH_AVI_API'] = avi_url
+    os.environ['WFRESH_MENU_CACHE'] = cache_file
+    import warnings
+    warnings.filterwarnings('ignore', message='Unverified HTTPS request')
+    import wfresh_helper
+
+    def avi_requests():
+        return server.stats()['requests'] if server else None
+
+    def avi_bytes():
+        return server.stats()['bytes_sent'] if server else None
+
+    today = date.today()
+    first_hall = next(iter(wfresh_helper.DINING_HALLS))
+    results = {'config': {k: v for k, v in vars(args).items() if k != 'json'}}
+
+    # 1) single AVI call
+    samples, failures = [], 0
+    for _ in range(args.repeat):
+        start = time.perf_counter()
+        try:
+            wfresh_helper.fetch_menu_for(today, first_hall, 'Lunch')
+        except Exception:
+            failures += 1
+        samples.append(time.perf_counter() - start)
+    results['fetch_menu_for'] = dict(summarize(samples), failed=failures)
+
+    def drop_cache():
+        if os.path.exists(cache_file):
+            os.remove(cache_file)
+
+    # 2) cold week refresh (a failed AVI call fails the whole refresh, as in production)
+    cold, counts, sizes, failures = [], [], [], 0
+    for _ in range(args.cold_repeat):
+        drop_cache()
+        before, before_bytes = avi_requests(), avi_bytes()
+        try:
+            _, elapsed = timed(wfresh_helper.fetch_week_menu, today)
+        except Exception:
+            failures += 1
+            continue
+        cold.append(elapsed)
+        if server:
+            counts.append(avi_requests() - before)
+            sizes.append(avi_bytes() - before_bytes)
+    if cold:
+        warm_cache = open(cache_file).read()
+        drop_cache()
+        try:
+            cold_peak = peak_memory(wfresh_helper.fetch_week_menu, today)
+        except Exception:
+            cold_peak = float('nan')
+            with open(cache_file, 'w') as f:  # keep a cache file for the warm runs
+                f.write(warm_cache)
+        results['fetch_week_menu_cold'] = dict(
+            summarize(cold),
+            failed=failures,
+            avi_requests=counts[-1] if counts else None,
+            avi_bytes=sizes[-1] if sizes else None,
+            peak_mem_kb=round(cold_peak / 1024, 1),
+            cache_file_kb=round(os.path.getsize(cache_file) / 1024, 1),
+        )
+    else:
+        results['fetch_week_menu_cold'] = {'failed': failures}
+        print('every cold refresh failed; warm benchmarks need a cache file', file=sys.stderr)
+        sys.exit(1)
+
+    # 3) warm week reads
+    warm = []
+    before = avi_requests()
+    for _ in range(args.repeat):
+        warm.append(timed(wfresh_helper.fetch_week_menu, today)[1])
+    results['fetch_week_menu_warm'] = dict(
+        summarize(warm),
+        avi_requests=(avi_requests() - before) if server else None,
+        peak_mem_kb=round(peak_memory(wfresh_helper.fetch_week_menu, today) / 1024, 1),
+    )
+
+    # 4) parse_data (pandas is optional)
+    try:
+        import parse_data
+    except ImportError as err:
+        results['get_payload_df'] = {'skipped': str(err)}
+    else:
+        meal_id = wfresh_helper.DINING_HALLS[first_hall]['meals']['Lunch']
+        samples = [timed(parse_data.get_payload_df, today, first_hall, meal_id)[1] for _ in range(args.repeat)]
+        peak = peak_memory(parse_data.get_payload_df, today, first_hall, meal_id)
+        results['get_payload_df'] = dict(summarize(samples), peak_mem_kb=round(peak / 1024, 1))
+
+    if server:
+        results['avi_server'] = server.stats()
+        server.shutdown()
+
+    for name, row in results.items():
+        if name == 'config':
+            continue
+        print(f'{name:>22}: ' + ', '.join(f'{k}={v}' for k, v in row.items()))
+
+    if args.json:
+        with open(args.json, 'w') as f:
+            json.dump(results, f, indent=2)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,263 @@
+"""
+bench/fake_avi.py
+
+Local stand-in for the AVI menu API (GET /api/menu-items/week), for benchmarks
+and offline development. Standard library only.
+
+Serves one week of dishes per (locationId, mealId), starting at ?date=, either
+replayed from a recorded menu_cache.json (dates shifted to the requested week)
+or generated synthetically. Latency, error rate and payload size are
+configurable so the menu pipeline can be measured under realistic conditions.
+
+Usage:
+    python bench/fake_avi.py --port 8765 --latency-ms 120 --error-rate 0.02
+    WFRESH_AVI_API=http://127.0.0.1:8765/api/menu-items/week python app.py
+
+Extra endpoints:
+    GET  /__stats   request/error counts (JSON)
+    POST /__reset   zero the counters
+"""
+
+import argparse
+import json
+import os
+import random
+import threading
+import time
+from datetime import date, datetime, timedelta
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlparse
+
+WEEK_PATH = '/api/menu-items/week'
+
+# Mirrors wfresh_helper.DINING_HALLS (locationId -> name, mealId -> meal name)
+HALLS = {95: 'Bates', 131: 'Stone D', 96: 'Lulu', 97: 'Tower'}
+MEAL_IDS = {
+    145: 'Breakfast', 146: 'Lunch', 311: 'Dinner',
+    261: 'Breakfast', 262: 'Lunch', 263: 'Dinner',
+    148: 'Breakfast', 149: 'Lunch', 312: 'Dinner',
+    153: 'Breakfast', 154: 'Lunch', 310: 'Dinner',
+}
+
+DEFAULT_RECORDING = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'menu_cache.json')
+
+_WORDS = ('Roasted', 'Grilled', 'Vegan', 'Spicy', 'Baked', 'Tofu', 'Chicken', 'Rice', 'Soup',
+          'Salad', 'Pasta', 'Curry', 'Squash', 'Eggs', 'Pancakes', 'Tacos', 'Noodles', 'Stew')
+_STATIONS = ('HOMESTYLE', 'GRILL', 'PIZZA', 'SALAD BAR', 'DELI', 'GLOBAL', 'DESSERT')
+_TAGS = ('Vegan', 'Vegetarian', 'Gluten Free', 'Halal')
+_ALLERGENS = ('Milk', 'Eggs', 'Wheat', 'Soy', 'Peanuts', 'Tree Nuts', 'Fish', 'Sesame')
+
+
+# ------------------------------------------------------------------------------------
+# Payloads
+# ------------------------------------------------------------------------------------
+def _item(rng, did: int, name: str, station: str, day: date, pad: int) -> dict:
+    """One dish in the AVI response shape (the fields parse_data.get_payload_df reads)."""
+    return {
+        'id': did,
+        'date': f'{day.isoformat()}T00:00:00',
+        'name': name,
+        'description': (f'{name} prepared fresh. ' + 'x' * pad).strip(),
+        'stationName': station,
+        'stationOrder': rng.randint(1, 12),
+        'nutritionals': {
+            'servingSize': rng.choice((4, 6, 8, 12)),
+            'servingSizeUOM': 'oz',
+            'calories': rng.randint(40, 900),
+            'fat': rng.randint(0, 40),
+            'caloriesFromFat': rng.randint(0, 300),
+            'saturatedFat': rng.randint(0, 15),
+            'transFat': 0,
+            'cholesterol': rng.randint(0, 200),
+            'sodium': rng.randint(0, 1800),
+            'carbohydrates': rng.randint(0, 120),
+            'dietaryFiber': rng.randint(0, 15),
+            'sugars': rng.randint(0, 40),
+            'addedSugar': rng.randint(0, 20),
+            'protein': rng.randint(0, 60),
+        },
+        'preferences': [{'name': t} for t in rng.sample(_TAGS, rng.randint(0, 2))],
+        'allergens': [{'name': a} for a in rng.sample(_ALLERGENS, rng.randint(0, 3))],
+    }
+
+
+class MenuSource:
+    """
+    Produces week payloads.
+
+    Args:
+        recording: path to a menu_cache.json to replay, or None for synthetic data
+        dishes: dishes per day for synthetic data (and the cap for recorded days)
+        pad: extra description characters per dish (payload size knob)
+    """
+
+    def __init__(self, recording: str = None, dishes: int = 20, pad: int = 0, seed: int = 0):
+        self.dishes = dishes
+        self.pad = pad
+        self.seed = seed
+        self.recorded_days = None
+        if recording:
+            with open(recording) as f:
+                menu = json.load(f)['menu_data']
+            self.recorded_days = [menu[k] for k in sorted(menu)]
+
+    def week(self, start: date, location_id: int, meal_id: int) -> list:
+        hall = HALLS.get(location_id)
+        meal = MEAL_IDS.get(meal_id)
+        if hall is None or meal is None:
+            return []
+
+        rng = random.Random(f'{self.seed}-{start.isoformat()}-{location_id}-{meal_id}')
+        items = []
+        for offset in range(7):
+            day = start + timedelta(days=offset)
+            if self.recorded_days is not None:
+                recorded = self.recorded_days[offset % len(self.recorded_days)]
+                dishes = recorded.get(meal, {}).get(hall, [])[:self.dishes]
+                for d in dishes:
+                    items.append(_item(rng, d['did'], d['name'], d.get('station') or '', day, self.pad))
+            else:
+                for i in range(self.dishes):
+                    did = 100000 + (location_id * 1000 + meal_id) * 100 + offset * self.dishes + i
+                    name = ' '.join(rng.sample(_WORDS, 2))
+                    items.append(_item(rng, did, name, rng.choice(_STATIONS), day, self.pad))
+        return items
+
+
+# ------------------------------------------------------------------------------------
+# Server
+# ------------------------------------------------------------------------------------
+class FakeAviServer(ThreadingHTTPServer):
+    daemon_threads = True
+
+    def __init__(self, address, source: MenuSource, latency_ms: float = 0.0,
+                 jitter_ms: float = 0.0, error_rate: float = 0.0):
+        super().__init__(address, _Handler)
+        self.source = source
+        self.latency_ms = latency_ms
+        self.jitter_ms = jitter_ms
+        self.error_rate = error_rate
+        self.lock = threading.Lock()
+        self.requests = 0
+        self.errors = 0
+        self.bytes_sent = 0
+
+    @property
+    def url(self) -> str:
+        host, port = self.server_address[:2]
+        return f'http://{host}:{port}{WEEK_PATH}'
+
+    def stats(self) -> dict:
+        with self.lock:
+            return {'requests': self.requests, 'errors': self.errors, 'bytes_sent': self.bytes_sent}
+
+    def reset(self):
+        with self.lock:
+            self.requests = self.errors = self.bytes_sent = 0
+
+
+class _Handler(BaseHTTPRequestHandler):
+    server: FakeAviServer
+
+    def log_message(self, fmt, *args):  # keep benchmark output clean
+        pass
+
+    def _send(self, status: int, body: bytes, content_type: str = 'application/json'):
+        self.send_response(status)
+        self.send_header('Content-Type', content_type)
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+        with self.server.lock:
+            self.server.bytes_sent += len(body)
+
+    def do_POST(self):
+        if self.path == '/__reset':
+            self.server.reset()
+            self._send(204, b'')
+        else:
+            self._send(404, b'{}')
+
+    def do_GET(self):
+        url = urlparse(self.path)
+        if url.path == '/__stats':
+            self._send(200, json.dumps(self.server.stats()).encode())
+            return
+        if url.path != WEEK_PATH:
+            self._send(404, b'{}')
+            return
+
+        server = self.server
+        with server.lock:
+            server.requests += 1
+
+        delay = server.latency_ms + random.uniform(-server.jitter_ms, server.jitter_ms)
+        if delay > 0:
+            time.sleep(delay / 1000.0)
+
+        if server.error_rate and random.random() < server.error_rate:
+            with server.lock:
+                server.errors += 1
+            self._send(503, b'{"message": "Service Unavailable"}')
+            return
+
+        query = parse_qs(url.query)
+        try:
+            start = datetime.strptime(query['date'][0], '%m/%d/%y').date()
+            location_id = int(query['locationId'][0])
+            meal_id = int(query['mealId'][0])
+        except (KeyError, ValueError):
+            self._send(400, b'{"message": "date, locationId and mealId are required"}')
+            return
+
+        items = server.source.week(start, location_id, meal_id)
+        self._send(200, json.dumps(items).encode())
+
+
+def start_server(port: int = 0, host: str = '127.0.0.1', recording: str = None, dishes: int = 20,
+                 pad: int = 0, latency_ms: float = 0.0, jitter_ms: float = 0.0,
+                 error_rate: float = 0.0) -> FakeAviServer:
+    """Start a fake AVI server on a background thread (port 0 = any free port)."""
+    source = MenuSource(recording=recording, dishes=dishes, pad=pad)
+    server = FakeAviServer((host, port), source, latency_ms, jitter_ms, error_rate)
+    threading.Thread(target=server.serve_forever, name='fake-avi', daemon=True).start()
+    return server
+
+
+def add_arguments(parser: argparse.ArgumentParser):
+    """Options shared with the benchmark scripts."""
+    parser.add_argument('--source', choices=['recorded', 'synthetic'], default='recorded')
+    parser.add_argument('--recording', default=DEFAULT_RECORDING, help='menu_cache.json to replay')
+    parser.add_argument('--dishes', type=int, default=20, help='dishes per day (synthetic) / cap (recorded)')
+    parser.add_argument('--pad', type=int, default=0, help='extra description bytes per dish')
+    parser.add_argument('--latency-ms', type=float, default=0.0)
+    parser.add_argument('--jitter-ms', type=float, default=0.0)
+    parser.add_argument('--error-rate', type=float, default=0.0)
+
+
+def server_kwargs(args) -> dict:
+    return {
+        'recording': args.recording if args.source == 'recorded' else None,
+        'dishes': args.dishes,
+        'pad': args.pad,
+        'latency_ms': args.latency_ms,
+        'jitter_ms': args.jitter_ms,
+        'error_rate': args.error_rate,
+    }
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Fake AVI menu API')
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=8765)
+    add_arguments(parser)
+    args = parser.parse_args()
+
+    srv = FakeAviServer((args.host, args.port),
+                        MenuSource(recording=server_kwargs(args)['recording'], dishes=args.dishes, pad=args.pad),
+                        args.latency_ms, args.jitter_ms, args.error_rate)
+    print(f'fake AVI listening on {srv.url}')
+    try:
+        srv.serve_forever()
+    except KeyboardInterrupt:
+        pass
@@ -0,0 +1,287 @@
+"""
+bench/gen_dataset.py
+
+Fill a (local, throwaway) database with realistic, skewed WFresh data.
+
+Shape of the data:
+- User activity, thread popularity and dish popularity follow Zipf-like
+  distributions: a few hot threads/dishes get most messages, comments and
+  pictures, and a long tail gets almost none
+- Replies mostly continue the latest branch of a conversation, so reply chains
+  get deep; one extra thread holds a single --deep-chain long chain to probe
+  recursive code paths
+- Feasts are spread over the past and next few days (some active right now)
+
+All rows get explicit ids, so reply links can be generated without reading
+ids back. Inserts are batched with executemany.
+
+Usage:
+    WFRESH_DB_NAME=wfresh_bench python bench/gen_dataset.py --scale small --reset
+
+Refuses to touch the real wfresh_db unless --allow-main-db is given.
+"""
+
+import argparse
+import itertools
+import os
+import random
+import sys
+import time
+from datetime import datetime, timedelta
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.dirname(BENCH_DIR))
+
+# Row counts per preset
+SCALES = {
+    'tiny':   dict(users=100,    dishes=100,   threads=50,     messages=1_000,   comments=1_000,   pictures=200,    feasts=50),
+    'small':  dict(users=1_000,  dishes=500,   threads=500,    messages=10_000,  comments=10_000,  pictures=2_000,  feasts=200),
+    'medium': dict(users=10_000, dishes=2_000, threads=5_000,  messages=100_000, comments=100_000, pictures=20_000, feasts=1_000),
+    'large':  dict(users=50_000, dishes=5_000, threads=20_000, messages=500_000, comments=500_000, pictures=80_000, feasts=5_000),
+}
+
+# Tables in delete order (children first)
+TABLES = ('notification_archive', 'notification', 'messages', 'threads', 'post', 'comments',
+          'dish_picture', 'dish_stats', 'trending_bucket', 'dish', 'users')
+
+BATCH = 1000
+
+# Never a valid bcrypt hash, so generated users cannot log in
+FAKE_HASH = '$2b$12$' + 'x' * 53
+
+_WORDS = ('tofu', 'pasta', 'curry', 'soup', 'salad', 'tacos', 'ramen', 'pizza', 'stir fry', 'cookies',
+          'good', 'bad', 'amazing', 'salty', 'bland', 'spicy', 'fresh', 'again', 'today', 'line',
+          'Bates', 'Tower', 'Lulu', 'Stone D', 'lunch', 'dinner', 'brunch', 'vegan', 'worth it', 'meh')
+_LOCATIONS = ('Science Center', 'Lulu lobby', 'Clapp Library', 'Pendleton', 'Founders', 'Tower Court')
+
+
+class Zipf:
+    """Draw indexes 0..n-1 with P(i) proportional to 1 / (i+1)^s (cheap repeated draws)."""
+
+    def __init__(self, rng: random.Random, n: int, s: float = 1.1):
+        self.rng = rng
+        self.population = range(n)
+        self.cum = list(itertools.accumulate(1.0 / (i + 1) ** s for i in range(n)))
+
+    def draw(self, k: int = 1) -> list:
+        return self.rng.choices(self.population, cum_weights=self.cum, k=k)
+
+
+def _text(rng: random.Random, lo: int, hi: int) -> str:
+    return ' '.join(rng.choices(_WORDS, k=rng.randint(lo, hi)))
+
+
+def _insert(cur, sql: str, rows):
+    batch = []
+    for row in rows:
+        batch.append(row)
+        if len(batch) == BATCH:
+            cur.executemany(sql, batch)
+            batch = []
+    if batch:
+        cur.executemany(sql, batch)
+
+
+def _next_id(cur, table: str, column: str) -> int:
+    cur.execute(f'SELECT COALESCE(MAX({column}), 0) + 1 FROM {table}')
+    return int(cur.fetchone()[0])
+
+
+def reset(conn):
+    """Delete every generated-table row (FK checks off for the duration)."""
+    cur = conn.cursor()
+    cur.execute('SET FOREIGN_KEY_CHECKS = 0')
+    try:
+        for table in TABLES:
+            try:
+                cur.execute(f'DELETE FROM {table}')
+            except Exception:
+                pass  # optional tables (e.g. notification_archive before feast_times.sql)
+        conn.commit()
+    finally:
+        cur.execute('SET FOREIGN_KEY_CHECKS = 1')
+
+
+def generate(conn, counts: dict, seed: int = 0, deep_chain: int = 2000, log=print) -> dict:
+    """
+    Insert one dataset of the given counts.
+
+    Returns:
+        dict of interesting ids for benchmarks: hot/median/cold thread and dish,
+        the deep-chain thread, the owner of each thread, row counts
+    """
+    rng = random.Random(seed)
+    cur = conn.cursor()
+    now = datetime.now().replace(microsecond=0)
+    started = time.perf_counter()
+
+    # --- users
+    uid0 = _next_id(cur, 'users', 'uid')
+    uids = list(range(uid0, uid0 + counts['users']))
+    _insert(cur, 'INSERT INTO users (uid, name, hashed) VALUES (%s, %s, %s)',
+            ((uid, f'bench_user_{uid}', FAKE_HASH) for uid in uids))
+    active_user = Zipf(rng, len(uids), s=0.9)
+    log(f'users: {len(uids)}')
+
+    # --- dishes (ids far above AVI ids to avoid collisions)
+    did0 = max(_next_id(cur, 'dish', 'did'), 9_000_000)
+    dids = list(range(did0, did0 + counts['dishes']))
+    _insert(cur, 'INSERT INTO dish (did, name, description) VALUES (%s, %s, %s)',
+            ((did, _text(rng, 2, 4).title(), _text(rng, 5, 20)) for did in dids))
+    hot_dish = Zipf(rng, len(dids), s=1.2)
+    log(f'dishes: {len(dids)}')
+
+    # --- comments
+    _insert(cur, 'INSERT INTO comments (owner, type, comment, dish) VALUES (%s, %s, %s, %s)',
+            ((uids[u], rng.choice(('yum', 'yuck')), _text(rng, 3, 40), dids[d])
+             for u, d in zip(active_user.draw(counts['comments']), hot_dish.draw(counts['comments']))))
+    log(f"comments: {counts['comments']}")
+
+    # --- pictures (content-addressed-looking names; no files on disk)
+    def picture(u, d):
+        digest = f'{rng.getrandbits(256):064x}'
+        name = f'{digest[:2]}/{digest[2:4]}/{digest}'
+        has_variants = rng.random() < 0.9
+        return (dids[d], f'{name}.jpg', uids[u],
+                f'{name}.thumb.webp' if has_variants else None,
+                f'{name}.display.webp' if has_variants else None)
+
+    _insert(cur, '''INSERT INTO dish_picture (did, filename, owner, thumb_filename, display_filename)
+                    VALUES (%s, %s, %s, %s, %s)''',
+            (picture(u, d) for u, d in zip(active_user.draw(counts['pictures']),
+                                            hot_dish.draw(counts['pictures']))))
+    log(f"pictures: {counts['pictures']}")
+
+    # --- per-dish aggregates (bulk inserts bypass the incremental updates)
+    import wfresh_helper
+    for sql in wfresh_helper.REBUILD_DISH_STATS_SQL:
+        cur.execute(sql)
+
+    # --- threads (+ posts); one extra thread for the deep chain
+    n_threads = counts['threads'] + 1
+    postid0 = _next_id(cur, 'post', 'postid')
+    thid0 = _next_id(cur, 'threads', 'thid')
+    owners = [uids[u] for u in active_user.draw(n_threads)]
+    _insert(cur, 'INSERT INTO post (postid, owner, description) VALUES (%s, %s, %s)',
+            ((postid0 + i, owners[i], _text(rng, 5, 60)) for i in range(n_threads)))
+    _insert(cur, 'INSERT INTO threads (thid, postid) VALUES (%s, %s)',
+            ((thid0 + i, postid0 + i) for i in range(n_threads)))
+    thids = [thid0 + i for i in range(n_threads)]
+    deep_thid = thids[-1]
+    log(f'threads: {n_threads}')
+
+    # --- messages: Zipf over threads, replies mostly continue the latest branch
+    mid = _next_id(cur, 'messages', 'mid')
+    per_thread = [0] * counts['threads']
+    for t in Zipf(rng, counts['threads'], s=1.05).draw(counts['messages']):
+        per_thread[t] += 1
+
+    def thread_messages():
+        nonlocal mid
+        start = now - timedelta(days=60)
+        for t, n in enumerate(per_thread):
+            in_thread = []
+            sent = start + timedelta(minutes=rng.randint(0, 60 * 24 * 50))
+            for _ in range(n):
+                r = rng.random()
+                if not in_thread or r < 0.25:
+                    replyto = None
+                elif r < 0.75:
+                    replyto = in_thread[-1]
+                else:
+                    replyto = rng.choice(in_thread)
+                sent += timedelta(seconds=rng.randint(5, 3600))
+                yield (mid, replyto, uids[active_user.draw()[0]], _text(rng, 2, 50), thids[t], sent)
+                in_thread.append(mid)
+                mid += 1
+        # one long single chain
+        replyto = None
+        sent = now - timedelta(days=1)
+        for _ in range(deep_chain):
+            yield (mid, replyto, uids[active_user.draw()[0]], _text(rng, 2, 10), deep_thid, sent)
+            replyto = mid
+            mid += 1
+            sent += timedelta(seconds=30)
+
+    _insert(cur, '''INSERT INTO messages (mid, replyto, sender, content, parentthread, sent_at)
+                    VALUES (%s, %s, %s, %s, %s, %s)''', thread_messages())
+    log(f"messages: {counts['messages']} + deep chain {deep_chain}")
+
+    # --- feasts around now (created over the last week, some active)
+    def feast():
+        created = now - timedelta(minutes=rng.randint(0, 60 * 24 * 7))
+        starts = created + timedelta(minutes=rng.randint(0, 60 * 48))
+        ends = starts + timedelta(hours=rng.choice((1, 2, 3)))
+        return (starts.strftime('%-I%p %a'), rng.choice(_LOCATIONS), _text(rng, 1, 3),
+                uids[active_user.draw()[0]], created, starts, ends)
+
+    _insert(cur, '''INSERT INTO notification (time, location, freefood, owner, created_at, starts_at, ends_at)
+                    VALUES (%s, %s, %s, %s, %s, %s, %s)''',
+            (feast() for _ in range(counts['feasts'])))
+    log(f"feasts: {counts['feasts']}")
+
+    conn.commit()
+
+    by_size = sorted(range(counts['threads']), key=per_thread.__getitem__, reverse=True)
+    dish_rank = 0, len(dids) // 2, len(dids) - 1   # Zipf rank order == id order
+    info = {
+        'counts': dict(counts, deep_chain=deep_chain),
+        'seconds': round(time.perf_counter() - started, 1),
+        'hot_thread': thids[by_size[0]],
+        'median_thread': thids[by_size[len(by_size) // 2]],
+        'deep_thread': deep_thid,
+        'hot_thread_messages': per_thread[by_size[0]],
+        'hot_dish': dids[dish_rank[0]],
+        'median_dish': dids[dish_rank[1]],
+        'cold_dish': dids[dish_rank[2]],
+        'thread_owners': {thids[by_size[0]]: owners[by_size[0]],
+                          thids[by_size[len(by_size) // 2]]: owners[by_size[len(by_size) // 2]],
+                          deep_thid: owners[-1]},
+    }
+    log(f"generated in {info['seconds']}s")
+    return info
+
+
+def connect():
+    import wfresh_helper
+    conn, _ = wfresh_helper.db_connect(dict_cursor=False)
+    return conn
+
+
+def check_database(allow_main_db: bool):
+    """Exit unless the target is a throwaway database (or the user insisted)."""
+    import wfresh_helper
+    if wfresh_helper.DB_NAME == 'wfresh_db' and not allow_main_db:
+        sys.exit('refusing to write to wfresh_db: set WFRESH_DB_NAME to a scratch database '
+                 '(or pass --allow-main-db)')
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Generate a skewed synthetic WFresh dataset')
+    parser.add_argument('--scale', choices=SCALES, default='small')
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--deep-chain', type=int, default=2000, help='length of the single long reply chain')
+    parser.add_argument('--reset', action='store_true', help='delete existing rows first')
+    parser.add_argument('--allow-main-db', action='store_true')
+    for key in SCALES['small']:
+        parser.add_argument(f'--{key}', type=int, help=f'override the preset {key} count')
+    args = parser.parse_args()
+
+    check_database(args.allow_main_db)
+    counts = dict(SCALES[args.scale])
+    for key in counts:
+        if getattr(args, key) is not None:
+            counts[key] = getattr(args, key)
+
+    conn = connect()
+    try:
+        if args.reset:
+            reset(conn)
+        info = generate(conn, counts, seed=args.seed, deep_chain=args.deep_chain)
+    finally:
+        conn.close()
+    print(info)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,437 @@
+"""
+bench/loadtest.py
+
+End-to-end HTTP load test for the Flask app.
+
+Virtual users (threads, each with its own cookie session) loop over a weighted
+mix of realistic actions with random think time:
+- home page views (/home/), sometimes followed by a lazy-loaded day (/api/menu)
+- dish page views, comments and picture uploads (/dish/<did>)
+- DishDash thread list, thread reads and replies
+- logins
+
+Dishes come from /api/menu and threads from /dishdash/, and popular ones are
+picked far more often (Zipf), like real traffic after a popular dish shows up.
+
+By default the app is started locally (python app.py in a subprocess) against a
+fake AVI (bench/fake_avi.py), a throwaway menu cache and the database named by
+WFRESH_DB_NAME, optionally refilled first with --generate (bench/gen_dataset.py).
+--url targets an app that is already running instead.
+
+The report lists throughput, latency percentiles and error rate per route.
+429s from the app's rate limits are counted separately ("limited"), not as
+errors - every virtual user shares one client IP, so per-IP budgets run out
+sooner than in production. --save-baseline stores the results as JSON, and
+--baseline compares a run with a stored one. Any route whose p95 or
+throughput worsens by more than --tolerance is flagged, and the exit status
+is 1.
+
+Usage:
+    WFRESH_DB_NAME=wfresh_bench python bench/loadtest.py --generate small --users 20 --duration 60
+    python bench/loadtest.py --url http://127.0.0.1:8080 --users 50 --save-baseline base.json
+    WFRESH_DB_NAME=wfresh_bench python bench/loadtest.py --baseline base.json
+"""
+
+import argparse
+import io
+import json
+import os
+import random
+import re
+import socket
+import statistics
+import struct
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+import zlib
+from collections import defaultdict
+from datetime import date
+
+import requests
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+ROOT_DIR = os.path.dirname(BENCH_DIR)
+sys.path.insert(0, BENCH_DIR)
+sys.path.insert(0, ROOT_DIR)
+
+import fake_avi  # noqa: E402
+
+# Relative weights of each action in the user mix
+MIX = {
+    'home': 30,
+    'menu_day': 8,
+    'dish': 20,
+    'comment': 4,
+    'upload': 2,
+    'dishdash': 10,
+    'thread': 20,
+    'reply': 4,
+    'login': 2,
+}
+
+PASSWORD = 'loadtest-password'
+
+_THREAD_RE = re.compile(r'/dishdash/thread/(\d+)')
+_DID_RE = re.compile(r'"did":\s*(\d+)')
+
+
+# ------------------------------------------------------------------------------------
+# Results
+# ------------------------------------------------------------------------------------
+class Stats:
+    """Per-route latencies and outcome counts, shared by all virtual users."""
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.reset()
+
+    def reset(self):
+        with self.lock:
+            self.latencies = defaultdict(list)
+            self.errors = defaultdict(int)
+            self.limited = defaultdict(int)
+            self.error_samples = defaultdict(list)
+
+    def record(self, route: str, seconds: float, status, error: str = None):
+        with self.lock:
+            self.latencies[route].append(seconds)
+            if status == 429:
+                self.limited[route] += 1
+            elif error is not None or status is None or status >= 500:
+                self.errors[route] += 1
+                if len(self.error_samples[route]) < 3:
+                    self.error_samples[route].append(error or f'HTTP {status}')
+
+    def summary(self, elapsed: float) -> dict:
+        def pct(ms, p):
+            return round(ms[min(len(ms) - 1, int(len(ms) * p))], 2)
+
+        routes = {}
+        with self.lock:
+            for route, samples in sorted(self.latencies.items()):
+                ms = sorted(s * 1000 for s in samples)
+                routes[route] = {
+                    'requests': len(ms),
+                    'rps': round(len(ms) / elapsed, 2),
+                    'p50_ms': round(statistics.median(ms), 2),
+                    'p95_ms': pct(ms, 0.95),
+                    'p99_ms': pct(ms, 0.99),
+                    'max_ms': round(ms[-1], 2),
+                    'errors': self.errors[route],
+                    'error_rate': round(self.errors[route] / len(ms), 4),
+                    'limited': self.limited[route],
+                    'error_samples': self.error_samples[route],
+                }
+        total = sum(r['requests'] for r in routes.values())
+        errors = sum(r['errors'] for r in routes.values())
+        return {
+            'elapsed_s': round(elapsed, 1),
+            'requests': total,
+            'rps': round(total / elapsed, 2) if elapsed else 0.0,
+            'error_rate': round(errors / total, 4) if total else 0.0,
+            'routes': routes,
+        }
+
+
+# ------------------------------------------------------------------------------------
+# Test data
+# ------------------------------------------------------------------------------------
+def tiny_png(rng: random.Random) -> bytes:
+    """A valid 8x8 PNG with random pixels (so content-addressed uploads don't all dedupe)."""
+    def chunk(kind, data):
+        return struct.pack('>I', len(data)) + kind + data + struct.pack('>I', zlib.crc32(kind + data))
+
+    raw = b''.join(b'\x00' + bytes(rng.getrandbits(8) for _ in range(8 * 3)) for _ in range(8))
+    return (b'\x89PNG\r\n\x1a\n' + chunk(b'IHDR', struct.pack('>IIBBBBB', 8, 8, 8, 2, 0, 0, 0))
+            + chunk(b'IDAT', zlib.compress(raw)) + chunk(b'IEND', b''))
+
+
+class Targets:
+    """Dish and thread ids to hit, popular-first, discovered over HTTP."""
+
+    def __init__(self, base_url: str):
+        self.base_url = base_url
+        self.dids = []
+        self.thids = []
+        self.lazy_dates = []
+
+    def discover(self, session: requests.Session):
+        today = date.today()
+        resp = session.get(f'{self.base_url}/api/menu', timeout=60)
+        resp.raise_for_status()
+        days = resp.json().get('days', {})
+        self.lazy_dates = sorted(d for d in days if d != today.isoformat())
+        self.dids = list(dict.fromkeys(int(d) for d in _DID_RE.findall(resp.text)))
+
+        resp = session.get(f'{self.base_url}/dishdash/', timeout=60)
+        resp.raise_for_status()
+        self.thids = list(dict.fromkeys(int(t) for t in _THREAD_RE.findall(resp.text)))
+
+    @staticmethod
+    def pick(rng: random.Random, ids: list, s: float = 1.1):
+        """Zipf-like pick: the first ids (as listed by the app) are the popular ones."""
+        if not ids:
+            return None
+        weights = [1.0 / (i + 1) ** s for i in range(len(ids))]
+        return rng.choices(ids, weights=weights)[0]
+
+
+# ------------------------------------------------------------------------------------
+# Virtual users
+# ------------------------------------------------------------------------------------
+class VirtualUser(threading.Thread):
+    def __init__(self, n: int, base_url: str, targets: Targets, stats: Stats, stop: threading.Event,
+                 think_ms: float, seed: int):
+        super().__init__(name=f'vu-{n}', daemon=True)
+        self.username = f'loadtest_{n}'
+        self.base_url = base_url
+        self.targets = targets
+        self.stats = stats
+        self.stop = stop
+        self.think = think_ms / 1000.0
+        self.rng = random.Random(seed * 100003 + n)
+        self.session = requests.Session()
+        self.actions = list(MIX)
+        self.weights = [MIX[a] for a in self.actions]
+
+    def request(self, route: str, method: str, path: str, **kwargs):
+        kwargs.setdefault('allow_redirects', False)
+        kwargs.setdefault('timeout', 30)
+        start = time.perf_counter()
+        try:
+            resp = self.session.request(method, self.base_url + path, **kwargs)
+            resp.content  # include body transfer in the timing
+        except requests.RequestException as err:
+            self.stats.record(route, time.perf_counter() - start, None, type(err).__name__)
+            return None
+        self.stats.record(route, time.perf_counter() - start, resp.status_code)
+        return resp
+
+    def sign_in(self):
+        """Join (a no-op after the first run against a database), then log in."""
+        form = {'username': self.username, 'password1': PASSWORD, 'password2': PASSWORD}
+        self.request('POST /join/', 'POST', '/join/', data=form)
+        self.login()
+
+    def login(self):
+        self.session.cookies.clear()
+        self.request('POST /login/', 'POST', '/login/',
+                     data={'username': self.username, 'password': PASSWORD})
+
+    def run(self):
+        self.sign_in()
+        while not self.stop.is_set():
+            action = self.rng.choices(self.actions, weights=self.weights)[0]
+            getattr(self, f'do_{action}')()
+            if self.think:
+                self.stop.wait(self.rng.expovariate(1.0 / self.think))
+
+    # --- actions
+    def do_home(self):
+        self.request('GET /home/', 'GET', '/home/')
+
+    def do_menu_day(self):
+        if self.targets.lazy_dates:
+            day = self.rng.choice(self.targets.lazy_dates)
+            self.request('GET /api/menu', 'GET', '/api/menu', params={'date': day})
+
+    def do_dish(self):
+        did = Targets.pick(self.rng, self.targets.dids)
+        if did is not None:
+            self.request('GET /dish/<did>', 'GET', f'/dish/{did}')
+
+    def do_comment(self):
+        did = Targets.pick(self.rng, self.targets.dids)
+        if did is not None:
+            self.request('POST /dish/<did> comment', 'POST', f'/dish/{did}',
+                         data={'comment': f'load test comment {self.rng.getrandbits(32):08x}',
+                               'type': self.rng.choice(('yum', 'yuck'))})
+
+    def do_upload(self):
+        did = Targets.pick(self.rng, self.targets.dids)
+        if did is not None:
+            files = {'picture': ('loadtest.png', io.BytesIO(tiny_png(self.rng)), 'image/png')}
+            self.request('POST /dish/<did> upload', 'POST', f'/dish/{did}', files=files)
+
+    def do_dishdash(self):
+        self.request('GET /dishdash/', 'GET', '/dishdash/')
+
+    def do_thread(self):
+        thid = Targets.pick(self.rng, self.targets.thids)
+        if thid is not None:
+            self.request('GET /dishdash/thread/<thid>', 'GET', f'/dishdash/thread/{thid}')
+
+    def do_reply(self):
+        thid = Targets.pick(self.rng, self.targets.thids)
+        if thid is not None:
+            self.request('POST /dishdash/thread/<thid>', 'POST', f'/dishdash/thread/{thid}',
+                         data={'content': f'load test reply {self.rng.getrandbits(32):08x}'})
+
+    def do_login(self):
+        self.login()
+
+
+# ------------------------------------------------------------------------------------
+# Local app
+# ------------------------------------------------------------------------------------
+def _free_port() -> int:
+    with socket.socket() as s:
+        s.bind(('127.0.0.1', 0))
+        return s.getsockname()[1]
+
+
+def start_local_app(avi_url: str, cache_file: str, log_file):
+    """Start app.py (threaded, no reloader) in a subprocess; return (process, base_url)."""
+    port = _free_port()
+    env = dict(os.environ, WFRESH_AVI_API=avi_url, WFRESH_MENU_CACHE=cache_file)
+    code = f"import app; app.app.run('127.0.0.1', {port}, threaded=True)"
+    proc = subprocess.Popen([sys.executable, '-c', code], cwd=ROOT_DIR, env=env,
+                            stdout=log_file, stderr=subprocess.STDOUT)
+    base_url = f'http://127.0.0.1:{port}'
+    deadline = time.monotonic() + 30
+    while time.monotonic() < deadline:
+        if proc.poll() is not None:
+            sys.exit(f'app exited during startup (status {proc.returncode}); see {log_file.name}')
+        try:
+            requests.get(base_url + '/', timeout=1)
+            return proc, base_url
+        except requests.RequestException:
+            time.sleep(0.2)
+    proc.terminate()
+    sys.exit(f'app did not start within 30s; see {log_file.name}')
+
+
+def generate_data(scale: str, seed: int):
+    import gen_dataset
+    gen_dataset.check_database(allow_main_db=False)
+    conn = gen_dataset.connect()
+    try:
+        gen_dataset.reset(conn)
+        info = gen_dataset.generate(conn, gen_dataset.SCALES[scale], seed=seed, log=lambda msg: None)
+    finally:
+        conn.close()
+    print(f'generated {scale} dataset in {info["seconds"]}s')
+
+
+# ------------------------------------------------------------------------------------
+# Reporting
+# ------------------------------------------------------------------------------------
+def print_report(summary: dict):
+    print(f"\n{summary['requests']} requests in {summary['elapsed_s']}s: "
+          f"{summary['rps']} req/s, error rate {summary['error_rate']:.2%}\n")
+    header = f"{'route':<32}{'reqs':>7}{'rps':>8}{'p50':>9}{'p95':>9}{'p99':>9}{'max':>9}{'err%':>7}{'429':>6}"
+    print(header)
+    print('-' * len(header))
+    for route, r in summary['routes'].items():
+        print(f"{route:<32}{r['requests']:>7}{r['rps']:>8}{r['p50_ms']:>9}{r['p95_ms']:>9}"
+              f"{r['p99_ms']:>9}{r['max_ms']:>9}{r['error_rate'] * 100:>7.1f}{r['limited']:>6}")
+        for sample in r['error_samples']:
+            print(f"{'':<4}e.g. {sample}")
+
+
+def compare(summary: dict, baseline: dict, tolerance: float) -> list:
+    """Print per-route changes vs. baseline; return the regressions."""
+    regressions = []
+    print(f'\nvs. baseline (tolerance {tolerance:.0%}):')
+    print(f"{'route':<32}{'p95 then':>10}{'p95 now':>10}{'rps then':>10}{'rps now':>10}")
+    for route, now in summary['routes'].items():
+        then = baseline.get('routes', {}).get(route)
+        if then is None:
+            print(f'{route:<32}  (new)')
+            continue
+        flags = []
+        if then['p95_ms'] and now['p95_ms'] > then['p95_ms'] * (1 + tolerance):
+            flags.append('p95')
+        if then['rps'] and now['rps'] < then['rps'] * (1 - tolerance):
+            flags.append('rps')
+        if now['error_rate'] > then['error_rate'] + 0.01:
+            flags.append('errors')
+        mark = f"  REGRESSION ({', '.join(flags)})" if flags else ''
+        print(f"{route:<32}{then['p95_ms']:>10}{now['p95_ms']:>10}{then['rps']:>10}{now['rps']:>10}{mark}")
+        if flags:
+            regressions.append((route, flags))
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Load test the WFresh Flask app')
+    parser.add_argument('--url', help='base URL of a running app (default: start one locally)')
+    parser.add_argument('--users', type=int, default=10, help='concurrent virtual users')
+    parser.add_argument('--duration', type=float, default=30.0, help='seconds of measured load')
+    parser.add_argument('--ramp-up', type=float, default=5.0, help='seconds to start all users over')
+    parser.add_argument('--think-ms', type=float, default=500.0, help='mean think time between actions')
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--generate', choices=['tiny', 'small', 'medium', 'large'],
+                        help='refill the WFRESH_DB_NAME database with gen_dataset first')
+    parser.add_argument('--json', help='write the results here')
+    parser.add_argument('--save-baseline', help='store the results as a baseline file')
+    parser.add_argument('--baseline', help='compare with this baseline file')
+    parser.add_argument('--tolerance', type=float, default=0.2, help='allowed regression (fraction)')
+    fake_avi.add_arguments(parser)
+    args = parser.parse_args()
+
+    if args.generate:
+        if args.url:
+            parser.error('--generate only applies to a locally started app')
+        generate_data(args.generate, args.seed)
+
+    proc = avi = None
+    if args.url:
+        base_url = args.url.rstrip('/')
+    else:
+        avi = fake_avi.start_server(**fake_avi.server_kwargs(args))
+        workdir = tempfile.mkdtemp(prefix='wfresh-load-')
+        log_file = open(os.path.join(workdir, 'app.log'), 'w')
+        proc, base_url = start_local_app(avi.url, os.path.join(workdir, 'menu_cache.json'), log_file)
+        print(f'app at {base_url} (log: {log_file.name})')
+
+    try:
+        targets = Targets(base_url)
+        targets.discover(requests.Session())
+        print(f'{len(targets.dids)} dishes, {len(targets.thids)} threads, {args.users} users')
+
+        stats = Stats()
+        stop = threading.Event()
+        users = [VirtualUser(n, base_url, targets, stats, stop, args.think_ms, args.seed)
+                 for n in range(args.users)]
+        for user in users:
+            user.start()
+            time.sleep(args.ramp_up / max(1, args.users))
+
+        # Measure only at full concurrency (ramp-up traffic is dropped).
+        stats.reset()
+        started = time.perf_counter()
+        stop.wait(args.duration)
+        stop.set()
+        elapsed = time.perf_counter() - started
+        for user in users:
+            user.join(timeout=35)
+    finally:
+        if proc is not None:
+            proc.terminate()
+            proc.wait(timeout=10)
+        if avi is not None:
+            avi.shutdown()
+
+    summary = stats.summary(elapsed)
+    summary['config'] = {k: v for k, v in vars(args).items()
+                         if k not in ('json', 'save_baseline', 'baseline')}
+    print_report(summary)
+
+    for path in (args.json, args.save_baseline):
+        if path:
+            with open(path, 'w') as f:
+                json.dump(summary, f, indent=2)
+
+    if args.baseline:
+        with open(args.baseline) as f:
+            baseline = json.load(f)
+        if compare(summary, baseline, args.tolerance):
+            sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
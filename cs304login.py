@@ -1,19 +1,19 @@
 import cs304dbi as dbi
 import pymysql
-import bcrypt
+import wfresh_passwords as pw
 
 def insert_user(conn, name, password, verbose=False):
     '''inserts given name & password into the users table.  
 Returns three values: the uid, whether there was a duplicate key error, 
 and either false or an exception object.
+Hashing runs in the wfresh_passwords pool and may raise PasswordPoolBusy.
     '''
-    hashed = bcrypt.hashpw(password.encode('utf-8'),
-                           bcrypt.gensalt())
+    hashed = pw.hash_password(password)
     curs = dbi.cursor(conn)
     try: 
         curs.execute('''INSERT INTO users(name, hashed) 
                         VALUES(%s, %s)''',
-                     [name, hashed.decode('utf-8')])
+                     [name, hashed])
         conn.commit()
         curs.execute('select last_insert_id()')
         row = curs.fetchone()
@@ -34,7 +34,10 @@ and either false or an exception object.
 def login_user(conn, name, password):
     '''tries to log the user in given name & password. 
 Returns True if success and returns the uid as the second value.
-Otherwise, False, False.'''
+Otherwise, False, False.
+Rehashes the stored password if it was made with a different bcrypt cost
+(skipped when the hashing pool is busy).
+May raise PasswordPoolBusy when the hashing pool is saturated.'''
     curs = dbi.cursor(conn)
     curs.execute('''SELECT uid, hashed FROM users 
                     WHERE name = %s''',
@@ -44,14 +47,21 @@ Otherwise, False, False.'''
         # no such user
         return (False, False)
     uid, hashed = row
-    hashed2_bytes = bcrypt.hashpw(password.encode('utf-8'),
-                                  hashed.encode('utf-8'))
-    hashed2 = hashed2_bytes.decode('utf-8')
-    if hashed == hashed2:
-        return (True, uid)
-    else:
+    if not pw.check_password(password, hashed):
         # password incorrect
         return (False, False)
+    if pw.needs_rehash(hashed):
+        # work factor changed since this hash was made: upgrade it now
+        # that we have the plaintext (best effort: a busy pool must not
+        # turn a correct password into a failed login; next login retries)
+        try:
+            new_hash = pw.hash_password(password)
+        except pw.PasswordPoolBusy:
+            return (True, uid)
+        curs.execute('''UPDATE users SET hashed = %s WHERE uid = %s''',
+                     [new_hash, uid])
+        conn.commit()
+    return (True, uid)
 
 def delete_user(conn, name):
     curs = dbi.cursor(conn)
@@ -0,0 +1,31 @@
+-- Per-dish aggregates for the home menu grid (yum/yuck/picture counts + newest thumbnail).
+-- Run once against an existing database (after image_variants.sql).
+-- wfresh_helper keeps the rows up to date as comments and pictures are added or
+-- deleted; the same rebuild as step 2 is wfresh_helper.rebuild_dish_stats().
+use wfresh_db;
+
+-- 1) One row per dish that has any comment or picture. thumb_pid is the picture
+--    the thumbnail belongs to, so a newer picture can replace it.
+CREATE TABLE dish_stats (
+  `did`       INT PRIMARY KEY,
+  `yum`       INT NOT NULL DEFAULT 0,
+  `yuck`      INT NOT NULL DEFAULT 0,
+  `pictures`  INT NOT NULL DEFAULT 0,
+  `thumb_pid` INT NULL,
+  `thumb`     VARCHAR(120) NULL
+);
+
+-- 2) Backfill from the existing rows.
+INSERT INTO dish_stats (did, yum, yuck, pictures, thumb_pid, thumb)
+SELECT d.did,
+       (SELECT COUNT(*) FROM comments c WHERE c.dish = d.did AND c.type = 'yum'),
+       (SELECT COUNT(*) FROM comments c WHERE c.dish = d.did AND c.type = 'yuck'),
+       (SELECT COUNT(*) FROM dish_picture p WHERE p.did = d.did),
+       (SELECT MAX(p.pid) FROM dish_picture p WHERE p.did = d.did AND p.thumb_filename IS NOT NULL),
+       (SELECT p.thumb_filename FROM dish_picture p
+        WHERE p.did = d.did AND p.thumb_filename IS NOT NULL ORDER BY p.pid DESC LIMIT 1)
+FROM (SELECT dish AS did FROM comments UNION SELECT did FROM dish_picture) d
+WHERE d.did IS NOT NULL;
+
+-- 3) The rebuild and the dish page's comment queries look comments up by dish.
+CREATE INDEX comments_dish ON comments (dish, type);
@@ -0,0 +1,21 @@
+-- Structured feast times + archive for expired notifications.
+-- Run once against an existing database (after create_table.sql / update_table.sql).
+use wfresh_db;
+
+-- 1) Parsed start/end times. `time` keeps what the user typed for display.
+ALTER TABLE notification
+  ADD COLUMN created_at DATETIME NOT NULL DEFAULT CURRENT_TIMESTAMP,
+  ADD COLUMN starts_at  DATETIME NULL,
+  ADD COLUMN ends_at    DATETIME NULL;
+
+-- 2) Existing rows have no parsed time: keep them live for 6 hours, like new
+--    unparseable feasts, then let the sweeper archive them.
+UPDATE notification
+SET ends_at = created_at + INTERVAL 6 HOUR
+WHERE ends_at IS NULL;
+
+-- 3) The active-feast query is a range scan on ends_at.
+CREATE INDEX notification_ends_at ON notification (ends_at, starts_at);
+
+-- 4) Expired feasts are moved here in batches (same columns as notification).
+CREATE TABLE IF NOT EXISTS notification_archive LIKE notification;
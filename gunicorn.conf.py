@@ -0,0 +1,75 @@
+"""
+gunicorn.conf.py
+
+Production server settings: gunicorn -c gunicorn.conf.py
+
+Preforking workers with a thread pool each (gthread). The app is loaded once in
+the master (wsgi.preload) and workers are forked from it, sharing its memory.
+Workers are recycled after a jittered number of requests and finish in-flight
+requests before exiting.
+
+Settings (environment):
+    WFRESH_BIND                 address to listen on (default 0.0.0.0:8000)
+    WFRESH_WORKERS              worker processes (default: CPU count)
+    WFRESH_THREADS              threads per worker (default 8)
+    WFRESH_ASGI                 1 = serve asgi.py with uvicorn workers instead
+                                (threads: WFRESH_ASGI_THREADS, see wfresh_async)
+    WFRESH_MAX_REQUESTS         recycle a worker after this many requests (default 2000, 0 = never)
+    WFRESH_GRACEFUL_TIMEOUT     seconds a stopping worker gets to finish requests (default 30)
+    WFRESH_SECRET_KEY(_FILE)    required; see app.load_secret_key
+    WFRESH_PROXY_HOPS           trusted reverse proxies in front (X-Forwarded-For; default 0)
+
+Notes:
+- Each open /events/ stream holds one worker thread, so a worker accepts at
+  most half its threads as streams (WFRESH_SSE_STREAMS overrides; see
+  wfresh_events.stream_limit). Events only reach clients connected to the
+  worker that published them (wfresh_events is in-process); clients reload
+  what they missed on reconnect
+- With WFRESH_METRICS_DIR set, /metrics sums the snapshots of every worker
+"""
+
+import multiprocessing
+import os
+
+bind = os.environ.get('WFRESH_BIND', '0.0.0.0:8000')
+workers = int(os.environ.get('WFRESH_WORKERS', multiprocessing.cpu_count()))
+# The app sizes per-process pools (wfresh_passwords) by the worker count.
+os.environ['WFRESH_WORKERS'] = str(workers)
+
+if os.environ.get('WFRESH_ASGI') == '1':
+    # Async front end (wfresh_async); the Flask app runs on its thread pool.
+    wsgi_app = 'asgi:application'
+    worker_class = 'uvicorn.workers.UvicornWorker'
+else:
+    wsgi_app = 'wsgi:application'
+    worker_class = 'gthread'
+    threads = int(os.environ.get('WFRESH_THREADS', 8))
+
+preload_app = True
+
+max_requests = int(os.environ.get('WFRESH_MAX_REQUESTS', 2000))
+max_requests_jitter = max_requests // 10
+graceful_timeout = int(os.environ.get('WFRESH_GRACEFUL_TIMEOUT', 30))
+timeout = 60
+keepalive = 5
+
+accesslog = '-'
+
+
+def on_starting(server):
+    # Snapshots left by a previous run's workers would be summed into /metrics.
+    metrics_dir = os.environ.get('WFRESH_METRICS_DIR')
+    if metrics_dir and os.path.isdir(metrics_dir):
+        for name in os.listdir(metrics_dir):
+            if name.endswith('.json'):
+                os.remove(os.path.join(metrics_dir, name))
+
+
+def when_ready(server):
+    import wsgi
+    wsgi.preload()
+
+
+def post_fork(server, worker):
+    import wsgi
+    wsgi.post_fork()
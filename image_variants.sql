@@ -0,0 +1,7 @@
+-- Resized variants for dish pictures (filled in by wfresh_images.py).
+-- Run once, then backfill existing uploads with: python wfresh_images.py backfill
+use wfresh_db;
+
+ALTER TABLE dish_picture
+  ADD COLUMN thumb_filename   VARCHAR(120) NULL,
+  ADD COLUMN display_filename VARCHAR(120) NULL;
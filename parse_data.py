@@ -2,8 +2,11 @@ import pandas as pd
 import json
 import requests
 import cs304dbi as dbi
+import os
 from datetime import date
 
+AVI_API = os.environ.get("WFRESH_AVI_API", "https://dish.avifoodsystems.com/api/menu-items/week")
+
 def _to_int(x):
     try:
         if x is None or x == "": 
@@ -25,7 +28,6 @@ def get_payload_df(date, dhall: int, meal: int):
     Fetches menu data from the AVI Foodsystems API for a given date, dining hall, and meal,
     and returns it as a pandas DataFrame.
     """
-    AVI_API = "https://dish.avifoodsystems.com/api/menu-items/week"
     response = requests.get(
             AVI_API,
             params={
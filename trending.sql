@@ -0,0 +1,24 @@
+-- Trending panel: comment timestamps + checkpoints of the in-memory counters (wfresh_trending.py).
+-- Run once against an existing database (after dish_stats.sql).
+use wfresh_db;
+
+-- 1) When each comment was posted. Existing comments keep NULL (time unknown),
+--    so they never count as trending; new rows get the insert time.
+ALTER TABLE comments ADD COLUMN created_at DATETIME NULL;
+ALTER TABLE comments MODIFY created_at DATETIME NULL DEFAULT CURRENT_TIMESTAMP;
+
+-- 2) Rebuilding the counters from history reads the last day of comments and
+--    the last hour of messages.
+CREATE INDEX comments_created_at ON comments (created_at);
+CREATE INDEX messages_sent_at    ON messages (sent_at);
+
+-- 3) Checkpointed counts: one row per (counter, time bucket, dish/thread id),
+--    summed over every worker process. Rows older than the window are deleted
+--    by the checkpoints themselves.
+CREATE TABLE trending_bucket (
+  `kind`         VARCHAR(16) NOT NULL,
+  `bucket_start` DATETIME NOT NULL,
+  `item`         INT NOT NULL,
+  `n`            INT NOT NULL,
+  PRIMARY KEY (`kind`, `bucket_start`, `item`)
+);
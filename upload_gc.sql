@@ -0,0 +1,8 @@
+-- Indexes used by upload reference checks:
+--   - delete_dish_picture's COUNT(*) ... WHERE filename = %s
+--   - the orphan GC's batched IN queries (python wfresh_uploads.py gc)
+use wfresh_db;
+
+CREATE INDEX dish_picture_filename ON dish_picture (filename);
+CREATE INDEX dish_picture_thumb    ON dish_picture (thumb_filename);
+CREATE INDEX dish_picture_display  ON dish_picture (display_filename);
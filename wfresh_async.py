@@ -0,0 +1,574 @@
+"""
+wfresh_async.py
+
+Async (ASGI) serving mode: gather each page's independent reads concurrently on
+an event loop, then let the Flask app render the page.
+
+Contains:
+1) Async data layer
+   - AVI: fetch_menu_for / fetch_week_menu over one shared httpx.AsyncClient;
+     a cold week refresh runs its 84 calls concurrently (AVI_CONCURRENCY at a time)
+   - MySQL: an aiomysql pool per event loop; get_dish, get_dish_validator,
+     get_dish_comments, get_dish_pics, get_active_feast_events,
+     get_week_dish_stats run the same SQL as their wfresh_helper counterparts
+     and share the same caches
+2) Prefetchers: per-endpoint coroutines that load a page's data concurrently
+3) AsgiApp: the ASGI application
+   - for a GET to an endpoint with a prefetcher, runs the prefetcher first and
+     hands its result to the view in environ['wfresh.prefetch'] (or just warms
+     the menu file / dish stats / feast caches the view reads anyway)
+   - every request is then served by the unchanged Flask app on a thread pool,
+     so sessions, flashes, conditional GETs, metrics and all writes behave
+     exactly as under WSGI; a page holds its thread only while the view
+     renders, not while the prefetcher waits on AVI or MySQL. /events/ streams
+     are the exception: each holds a thread while open, so their number is
+     capped (wfresh_events.stream_limit)
+   - request bodies are streamed to the app as it reads them, never buffered
+     whole, and are bounded by the app's MAX_CONTENT_LENGTH (413)
+
+Optional dependencies: httpx and aiomysql. Without one of them the
+corresponding reads still run concurrently, on threads (asyncio.to_thread) with
+the synchronous helpers.
+
+Run:
+    uvicorn asgi:application
+    WFRESH_ASGI=1 gunicorn -c gunicorn.conf.py    (preforked uvicorn workers)
+
+Settings (environment):
+    WFRESH_AVI_CONCURRENCY   concurrent AVI calls per worker (default 12)
+    WFRESH_ASYNC_DB_POOL     aiomysql connections per worker (default 10)
+    WFRESH_MYSQL_CNF         MySQL option file with the credentials (default ~/.my.cnf)
+    WFRESH_ASGI_THREADS      threads running the Flask app per worker (default 16)
+"""
+
+import asyncio
+import io
+import logging
+import os
+import sys
+import threading
+import time
+import weakref
+from concurrent.futures import ThreadPoolExecutor
+from datetime import date, datetime, timedelta
+
+from werkzeug.exceptions import HTTPException, RequestEntityTooLarge
+
+import wfresh_events
+import wfresh_helper as helper
+import wfresh_metrics as metrics
+
+try:
+    import httpx
+except ImportError:  # reads fall back to the sync helpers on threads
+    httpx = None
+
+try:
+    import aiomysql
+except ImportError:
+    aiomysql = None
+
+log = logging.getLogger(__name__)
+
+AVI_CONCURRENCY = int(os.environ.get('WFRESH_AVI_CONCURRENCY', 12))
+DB_POOL_SIZE = int(os.environ.get('WFRESH_ASYNC_DB_POOL', 10))
+MYSQL_CNF = os.path.expanduser(os.environ.get('WFRESH_MYSQL_CNF', '~/.my.cnf'))
+ASGI_THREADS = int(os.environ.get('WFRESH_ASGI_THREADS', 16))
+
+# Key under which prefetched data reaches the Flask view (see app.prefetched)
+PREFETCH_ENVIRON_KEY = 'wfresh.prefetch'
+
+
+# ------------------------------------------------------------------------------------
+# Per-event-loop resources
+# ------------------------------------------------------------------------------------
+class _LoopResources:
+    """Connection pool, HTTP client and limits of one event loop (one per worker)."""
+
+    def __init__(self):
+        self.pool = None
+        self.http = None
+        self.lock = asyncio.Lock()
+        self.avi_limit = asyncio.Semaphore(AVI_CONCURRENCY)
+        self.week_refreshes = {}
+
+    async def close(self):
+        if self.http is not None:
+            await self.http.aclose()
+            self.http = None
+        if self.pool is not None:
+            self.pool.close()
+            await self.pool.wait_closed()
+            self.pool = None
+
+
+_resources = weakref.WeakKeyDictionary()
+
+
+def _loop_resources() -> _LoopResources:
+    loop = asyncio.get_running_loop()
+    res = _resources.get(loop)
+    if res is None:
+        res = _resources[loop] = _LoopResources()
+    return res
+
+
+async def _http_client():
+    res = _loop_resources()
+    if res.http is None:
+        # verify=False like the sync client (wfresh_helper.fetch_menu_for)
+        res.http = httpx.AsyncClient(verify=False, timeout=helper.AVI_TIMEOUT,
+                                     limits=httpx.Limits(max_connections=AVI_CONCURRENCY))
+    return res.http
+
+
+async def _db_pool():
+    res = _loop_resources()
+    if res.pool is None:
+        async with res.lock:
+            if res.pool is None:
+                start = time.perf_counter()
+                res.pool = await aiomysql.create_pool(
+                    minsize=1, maxsize=DB_POOL_SIZE, read_default_file=MYSQL_CNF,
+                    db=helper.DB_NAME, autocommit=True,
+                )
+                metrics.DB_CONNECT_SECONDS.observe(time.perf_counter() - start)
+    return res.pool
+
+
+async def _fetchall(function: str, sql: str, args) -> list:
+    """Run one read on a pooled connection; recorded under function like the sync cursors."""
+    pool = await _db_pool()
+    async with pool.acquire() as conn:
+        async with conn.cursor() as cur:
+            start = time.perf_counter()
+            try:
+                await cur.execute(sql, args)
+            finally:
+                metrics.observe_query(function, sql, args, time.perf_counter() - start)
+            rows = await cur.fetchall()
+    metrics.DB_ROWS.inc(function, amount=len(rows))
+    return rows
+
+
+# ------------------------------------------------------------------------------------
+# Async helpers (same results as their wfresh_helper namesakes)
+# ------------------------------------------------------------------------------------
+async def fetch_menu_for(d: date, dhall_id: int, meal_name: str) -> list[dict]:
+    if httpx is None:
+        return await asyncio.to_thread(helper.fetch_menu_for, d, dhall_id, meal_name)
+
+    client = await _http_client()
+    async with _loop_resources().avi_limit:
+        start = time.perf_counter()
+        status = 'error'
+        try:
+            resp = await client.get(helper.AVI_API, params=helper.avi_params(d, dhall_id, meal_name))
+            status = str(resp.status_code)
+        finally:
+            metrics.AVI_SECONDS.observe(time.perf_counter() - start, status)
+    resp.raise_for_status()
+    return helper.parse_menu_items(resp.json() or [], d)
+
+
+async def fetch_week_menu(start_date: date = None) -> dict:
+    """
+    Like wfresh_helper.fetch_week_menu, but a cache miss fetches all days, meals
+    and halls concurrently. Concurrent misses in this worker share one refresh.
+    """
+    if start_date is None:
+        start_date = date.today()
+
+    cached = await asyncio.to_thread(helper.load_menu_cache)
+    if cached is not None:
+        metrics.MENU_CACHE.inc('hit')
+        return cached
+    metrics.MENU_CACHE.inc('miss')
+
+    refreshes = _loop_resources().week_refreshes
+    task = refreshes.get(start_date)
+    if task is None:
+        task = refreshes[start_date] = asyncio.ensure_future(_refresh_week_menu(start_date))
+        task.add_done_callback(lambda _: refreshes.pop(start_date, None))
+    return await asyncio.shield(task)
+
+
+async def _refresh_week_menu(start_date: date) -> dict:
+    slots = []
+    for offset in range(7):
+        d = start_date + timedelta(days=offset)
+        for meal in helper.MEALS:
+            for dhall_id, info in helper.DINING_HALLS.items():
+                slots.append((d, meal, dhall_id, info["name"]))
+
+    results = await asyncio.gather(*(fetch_menu_for(d, dhall_id, meal) for d, meal, dhall_id, _ in slots))
+
+    # Same shape (and key order) as wfresh_helper.fetch_week_menu
+    week_menu = {}
+    for (d, meal, _, hall), dishes in zip(slots, results):
+        meals = week_menu.setdefault(d.isoformat(), {})
+        halls = meals.setdefault(meal, {})
+        if dishes:
+            halls[hall] = dishes
+
+    await asyncio.to_thread(helper.save_menu_cache, week_menu)
+    return helper.load_menu_cache() or helper.compact_week_menu(week_menu)
+
+
+async def get_active_feast_events(limit: int = 3):
+    """Banner feasts through the same TTL cache as wfresh_helper.get_active_feast_events."""
+    if aiomysql is None:
+        return await asyncio.to_thread(helper.get_active_feast_events, limit)
+
+    rows = helper.feast_cache.get(limit)
+    if rows is None:
+        generation = helper.feast_cache.generation
+        now = datetime.now()
+        rows = tuple(await _fetchall('get_active_feast_events', helper.ACTIVE_FEASTS_SQL,
+                                     (now, now + helper.FEAST_HORIZON, limit)))
+        helper.feast_cache.set(limit, rows, generation)
+    return rows
+
+
+async def get_dish(did):
+    if aiomysql is None:
+        return await asyncio.to_thread(helper.get_dish, did)
+    rows = await _fetchall('get_dish', helper.DISH_SQL, (did,))
+    if not rows:
+        return None
+    row = rows[0]
+    return {'did': row[0], 'name': row[1], 'description': row[2]}
+
+
+async def get_dish_validator(did):
+    if aiomysql is None:
+        return await asyncio.to_thread(helper.get_dish_validator, did)
+    rows = await _fetchall('get_dish_validator', helper.DISH_VALIDATOR_SQL, (did,) * 5)
+    return tuple(rows[0])
+
+
+async def get_dish_comments(did):
+    if aiomysql is None:
+        return await asyncio.to_thread(helper.get_dish_comments, did)
+    return await _fetchall('get_dish_comments', helper.DISH_COMMENTS_SQL, (did,))
+
+
+async def get_dish_pics(did):
+    if aiomysql is None:
+        return await asyncio.to_thread(helper.get_dish_pics, did)
+    return await _fetchall('get_dish_pics', helper.DISH_PICS_SQL, (did,))
+
+
+async def get_week_dish_stats(week_menu: dict, menu_version):
+    """Home grid stats through the same cache as wfresh_helper.get_week_dish_stats."""
+    if aiomysql is None:
+        return await asyncio.to_thread(helper.get_week_dish_stats, week_menu, menu_version)
+
+    entry = helper.dish_stats_cache.get('week')
+    if entry is not None and entry[0] == menu_version:
+        return entry[1], entry[2]
+    generation = helper.dish_stats_cache.generation
+    dids = helper.week_dish_ids(week_menu)
+    rows = []
+    if dids:
+        sql = helper.DISH_STATS_SQL.format(placeholders=', '.join(['%s'] * len(dids)))
+        rows = await _fetchall('get_dish_stats', sql, dids)
+    stats = {row[0]: helper.DishStats(*row[1:]) for row in rows}
+    token = helper.dish_stats_token(stats)
+    if menu_version is not None:
+        helper.dish_stats_cache.set('week', (menu_version, token, stats), generation)
+    return token, stats
+
+
+async def _week_menu_and_stats():
+    # Version first, as in the views.
+    menu_version = helper.menu_cache_version()
+    await get_week_dish_stats(await fetch_week_menu(), menu_version)
+
+
+# ------------------------------------------------------------------------------------
+# Prefetchers: endpoint -> coroutine(view_args, headers) -> dict for the view, or None
+# ------------------------------------------------------------------------------------
+async def prefetch_index(view_args: dict, headers: dict):
+    # Both land in caches the view (and its validator) read, so nothing to pass on.
+    await asyncio.gather(_week_menu_and_stats(), get_active_feast_events(limit=3))
+    return None
+
+
+async def prefetch_api_menu(view_args: dict, headers: dict):
+    await _week_menu_and_stats()
+    return None
+
+
+async def prefetch_get_dish(view_args: dict, headers: dict):
+    did = view_args['did']
+    if 'if-none-match' in headers:
+        # Likely a 304: only the validator is needed.
+        return {'dish_validator': await get_dish_validator(did)}
+    validator, dish, comments, pics = await asyncio.gather(
+        get_dish_validator(did), get_dish(did), get_dish_comments(did), get_dish_pics(did))
+    return {'dish_validator': validator, 'dish': dish, 'dish_comments': comments, 'dish_pics': pics}
+
+
+PREFETCHERS = {
+    'index': prefetch_index,
+    'api_menu': prefetch_api_menu,
+    'get_dish': prefetch_get_dish,
+}
+
+
+# ------------------------------------------------------------------------------------
+# ASGI application
+# ------------------------------------------------------------------------------------
+class _RequestBody(io.RawIOBase):
+    """
+    wsgi.input for one request, filled from ASGI receive() as the app reads it.
+
+    _pump_body puts http.request chunks on a small queue on the event loop, so
+    only a few chunks are ever buffered; reads on the worker thread wait on
+    that queue. An exception put on the queue (413, disconnect) is raised by
+    this and every later read.
+    """
+
+    def __init__(self, loop, maxsize: int = 4):
+        self._loop = loop
+        self.queue = asyncio.Queue(maxsize=maxsize)
+        self._pending = b''
+        self._eof = False
+        self._error = None
+
+    def readable(self) -> bool:
+        return True
+
+    def readinto(self, buf) -> int:
+        while not self._pending and not self._eof:
+            if self._error is not None:
+                raise self._error
+            item = asyncio.run_coroutine_threadsafe(self.queue.get(), self._loop).result()
+            if item is None:
+                self._eof = True
+            elif isinstance(item, BaseException):
+                self._error = item
+            else:
+                self._pending = item
+        n = min(len(buf), len(self._pending))
+        buf[:n] = self._pending[:n]
+        self._pending = self._pending[n:]
+        return n
+
+
+async def _pump_body(receive, body: _RequestBody, limit, disconnected: threading.Event):
+    """Feed the request body to `body` (at most `limit` bytes), then watch for a disconnect."""
+    total = 0
+    more = True
+    while more:
+        message = await receive()
+        if message['type'] == 'http.disconnect':
+            disconnected.set()
+            await body.queue.put(ConnectionResetError('client disconnected'))
+            return
+        chunk = message.get('body', b'')
+        more = message.get('more_body', False)
+        total += len(chunk)
+        if limit is not None and total > limit:
+            await body.queue.put(RequestEntityTooLarge())
+            break
+        if chunk:
+            await body.queue.put(chunk)
+    else:
+        await body.queue.put(None)
+
+    while (await receive())['type'] != 'http.disconnect':
+        pass
+    disconnected.set()
+
+
+def _content_length(scope: dict):
+    """Declared Content-Length of an ASGI HTTP scope (None if absent or invalid)."""
+    for name, value in scope.get('headers', ()):
+        if name.lower() == b'content-length':
+            try:
+                return int(value)
+            except ValueError:
+                return None
+    return None
+
+
+def build_environ(scope: dict, stream) -> dict:
+    """PEP 3333 environ for an ASGI HTTP scope."""
+    root_path = scope.get('root_path', '')
+    path = scope['path']
+    if root_path and path.startswith(root_path):
+        path = path[len(root_path):]
+    server = scope.get('server') or ('localhost', 80)
+    client = scope.get('client') or ('', 0)
+    environ = {
+        'REQUEST_METHOD': scope['method'],
+        'SCRIPT_NAME': root_path.encode('utf-8').decode('latin-1'),
+        'PATH_INFO': path.encode('utf-8').decode('latin-1'),
+        'QUERY_STRING': scope.get('query_string', b'').decode('latin-1'),
+        'SERVER_NAME': server[0],
+        'SERVER_PORT': str(server[1]),
+        'SERVER_PROTOCOL': f"HTTP/{scope.get('http_version', '1.1')}",
+        'REMOTE_ADDR': client[0],
+        'REMOTE_PORT': str(client[1]),
+        'wsgi.version': (1, 0),
+        'wsgi.url_scheme': scope.get('scheme', 'http'),
+        'wsgi.input': stream,
+        'wsgi.input_terminated': True,  # the stream ends with the body, chunked or not
+        'wsgi.errors': sys.stderr,
+        'wsgi.multithread': True,
+        'wsgi.multiprocess': True,
+        'wsgi.run_once': False,
+    }
+    for name, value in scope.get('headers', ()):
+        name = name.decode('latin-1').upper().replace('-', '_')
+        value = value.decode('latin-1')
+        if name == 'CONTENT_TYPE' or name == 'CONTENT_LENGTH':
+            environ[name] = value
+            continue
+        key = f'HTTP_{name}'
+        environ[key] = f'{environ[key]},{value}' if key in environ else value
+    return environ
+
+
+class AsgiApp:
+    """
+    ASGI front end for a Flask app (see the module docstring).
+
+    Args:
+        flask_app: the Flask application (its wsgi_app middleware stack is kept)
+        threads: size of the pool running the WSGI app
+        on_startup: optional zero-arg callable run at lifespan startup
+    """
+
+    def __init__(self, flask_app, threads: int = ASGI_THREADS, prefetchers: dict = None, on_startup=None):
+        self.flask_app = flask_app
+        self.prefetchers = PREFETCHERS if prefetchers is None else prefetchers
+        self.on_startup = on_startup
+        self.executor = ThreadPoolExecutor(max_workers=threads, thread_name_prefix='wsgi')
+        # /events/ streams run on this pool too; leave most of it for pages.
+        wfresh_events.bus.max_subscribers = wfresh_events.stream_limit(threads)
+        self._urls = flask_app.url_map.bind('localhost')
+
+    async def __call__(self, scope, receive, send):
+        if scope['type'] == 'lifespan':
+            await self._lifespan(receive, send)
+            return
+        if scope['type'] != 'http':
+            return  # no websockets
+
+        # Refuse a declared oversize body before reading any of it.
+        limit = self.flask_app.config.get('MAX_CONTENT_LENGTH')
+        length = _content_length(scope)
+        if limit is not None and length is not None and length > limit:
+            await send({'type': 'http.response.start', 'status': 413,
+                        'headers': [(b'content-type', b'text/plain; charset=utf-8'), (b'connection', b'close')]})
+            await send({'type': 'http.response.body', 'body': b'Request body too large.'})
+            return
+
+        prefetch = None
+        if scope['method'] == 'GET':
+            prefetch = await self._prefetch(scope)
+
+        body = _RequestBody(asyncio.get_running_loop())
+        environ = build_environ(scope, io.BufferedReader(body))
+        environ[PREFETCH_ENVIRON_KEY] = prefetch
+        await self._run_wsgi(environ, body, limit, receive, send)
+
+    async def _prefetch(self, scope):
+        try:
+            endpoint, view_args = self._urls.match(scope['path'], method='GET')
+        except HTTPException:
+            return None
+        prefetcher = self.prefetchers.get(endpoint)
+        if prefetcher is None:
+            return None
+        headers = {k.decode('latin-1').lower(): v.decode('latin-1') for k, v in scope.get('headers', ())}
+        try:
+            return await prefetcher(view_args, headers)
+        except Exception:
+            # The view loads whatever is missing itself (and reports errors as usual).
+            log.exception('prefetch for %s failed', endpoint)
+            return None
+
+    async def _run_wsgi(self, environ, body, limit, receive, send):
+        """
+        Run the WSGI app on the pool and stream its response.
+
+        The request body reaches the app through `body` (see _pump_body). The
+        worker thread hands response messages over a small queue, so a slow
+        client applies backpressure; after a disconnect the app's iterator is
+        closed at its next chunk (e.g. an SSE heartbeat).
+        """
+        loop = asyncio.get_running_loop()
+        queue = asyncio.Queue(maxsize=8)
+        disconnected = threading.Event()
+        response = {}
+
+        def put(item):
+            asyncio.run_coroutine_threadsafe(queue.put(item), loop).result()
+
+        def start_response(status, headers, exc_info=None):
+            if exc_info and response.get('sent'):
+                raise exc_info[1].with_traceback(exc_info[2])
+            response['status'] = int(status.split(' ', 1)[0])
+            response['headers'] = [(k.lower().encode('latin-1'), v.encode('latin-1')) for k, v in headers]
+            return lambda data: put(('body', data))
+
+        def run():
+            try:
+                result = self.flask_app(environ, start_response)
+                try:
+                    for chunk in result:
+                        if disconnected.is_set():
+                            break
+                        if chunk:
+                            put(('body', chunk))
+                finally:
+                    if hasattr(result, 'close'):
+                        result.close()
+                put(('end', None))
+            except BaseException as err:
+                put(('error', err))
+
+        watcher = asyncio.ensure_future(_pump_body(receive, body, limit, disconnected))
+        worker = loop.run_in_executor(self.executor, run)
+        try:
+            while True:
+                kind, value = await queue.get()
+                if kind == 'error':
+                    raise value
+                if disconnected.is_set():
+                    break
+                if not response.get('sent'):
+                    response['sent'] = True
+                    await send({'type': 'http.response.start', 'status': response['status'],
+                                'headers': response['headers']})
+                if kind == 'end':
+                    await send({'type': 'http.response.body', 'body': b''})
+                    break
+                await send({'type': 'http.response.body', 'body': value, 'more_body': True})
+        finally:
+            watcher.cancel()
+            disconnected.set()
+            # Unblock the worker thread if it is waiting on a full queue.
+            while not worker.done():
+                getter = asyncio.ensure_future(queue.get())
+                await asyncio.wait({getter, worker}, return_when=asyncio.FIRST_COMPLETED)
+                getter.cancel()
+
+    async def _lifespan(self, receive, send):
+        while True:
+            message = await receive()
+            if message['type'] == 'lifespan.startup':
+                if self.on_startup is not None:
+                    self.on_startup()
+                await send({'type': 'lifespan.startup.complete'})
+            elif message['type'] == 'lifespan.shutdown':
+                res = _resources.pop(asyncio.get_running_loop(), None)
+                if res is not None:
+                    await res.close()
+                self.executor.shutdown(wait=False)
+                await send({'type': 'lifespan.shutdown.complete'})
+                return
@@ -0,0 +1,235 @@
+"""
+wfresh_cache.py
+
+Small in-process caching primitives shared by WFresh helpers and routes.
+
+Contains:
+1) VersionTable: per-key version counters that writers bump to invalidate readers
+   (optionally backed by shared memory so preforked workers see each other's bumps)
+2) LRUCache: bounded, thread-safe LRU whose entries are tagged with the version
+   they were built from, with hit/miss/eviction counters
+3) TTLCache: tiny key/value cache with per-entry expiry, for data that writers in
+   this process invalidate on write and other workers pick up after the TTL
+"""
+
+import threading
+import time
+import multiprocessing
+import secrets
+from collections import OrderedDict
+
+
+# ------------------------------------------------------------------------------------
+# Version counters
+# ------------------------------------------------------------------------------------
+class VersionTable:
+    """
+    Per-key version numbers used to invalidate cached reads.
+
+    Readers take token(key) BEFORE loading from the DB and store the result under
+    that token; writers call bump(key) AFTER committing. A cached entry whose token
+    no longer matches is treated as a miss, so a write that races a load can never
+    leave stale data behind.
+
+    Local mode (default):
+    - Versions live in a dict guarded by a lock
+    - Tokens include a random per-process epoch, so tokens from two different
+      workers never compare equal by accident (safe to use in ETags)
+
+    Shared mode (enable_shared, call BEFORE forking workers):
+    - Versions live in a fixed-size shared-memory array indexed by hash(key) % slots
+    - A bump in any worker is visible to all workers on their next read
+    - Two keys that share a slot just invalidate each other (never serve stale data)
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._local = {}
+        self._shared = None
+        self._epoch = secrets.token_hex(4)
+
+    def enable_shared(self, slots: int = 4096):
+        """
+        Switch to a shared-memory version array.
+
+        Must be called in the parent process before workers are forked; the
+        array is inherited by every child.
+        """
+        with self._lock:
+            self._shared = multiprocessing.Array('Q', slots)
+            self._local.clear()
+
+    @property
+    def shared(self) -> bool:
+        return self._shared is not None
+
+    def _slot(self, key) -> int:
+        return hash(key) % len(self._shared)
+
+    def get(self, key) -> int:
+        """Return the current version number for key (0 if never bumped)."""
+        if self._shared is not None:
+            return self._shared[self._slot(key)]
+        with self._lock:
+            return self._local.get(key, 0)
+
+    def bump(self, key) -> int:
+        """Advance the version for key (call after the write has committed)."""
+        if self._shared is not None:
+            arr = self._shared
+            with arr.get_lock():
+                slot = self._slot(key)
+                arr[slot] += 1
+                return arr[slot]
+        with self._lock:
+            v = self._local.get(key, 0) + 1
+            self._local[key] = v
+            return v
+
+    def token(self, key) -> str:
+        """
+        Return an opaque version token for key.
+
+        Safe to compare across processes and to embed in HTTP validators.
+        """
+        return f"{self._epoch}-{self.get(key)}"
+
+
+# ------------------------------------------------------------------------------------
+# LRU cache
+# ------------------------------------------------------------------------------------
+class LRUCache:
+    """
+    Bounded least-recently-used cache with version-tagged entries.
+
+    Thread safe:
+    - All reads/writes happen under one lock (operations are O(1))
+    - Values are shared between requests, so callers must treat them as read-only
+    """
+
+    def __init__(self, maxsize: int = 256):
+        self.maxsize = maxsize
+        self._lock = threading.Lock()
+        self._data = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def get(self, key, version=None):
+        """
+        Return the cached value for key, or None on a miss.
+
+        If version is given, an entry stored under a different version counts as a miss
+        (and is dropped).
+        """
+        with self._lock:
+            entry = self._data.get(key)
+            if entry is None:
+                self.misses += 1
+                return None
+
+            entry_version, value = entry
+            if version is not None and entry_version != version:
+                del self._data[key]
+                self.misses += 1
+                return None
+
+            self._data.move_to_end(key)
+            self.hits += 1
+            return value
+
+    def put(self, key, value, version=None):
+        """Store value for key (tagged with version), evicting the LRU entry if full."""
+        with self._lock:
+            self._data[key] = (version, value)
+            self._data.move_to_end(key)
+            while len(self._data) > self.maxsize:
+                self._data.popitem(last=False)
+                self.evictions += 1
+
+    def invalidate(self, key):
+        """Drop key if present."""
+        with self._lock:
+            self._data.pop(key, None)
+
+    def clear(self):
+        """Drop every entry (counters are kept)."""
+        with self._lock:
+            self._data.clear()
+
+    def stats(self) -> dict:
+        """Return a snapshot of size and hit/miss/eviction counters."""
+        with self._lock:
+            return {
+                'size': len(self._data),
+                'maxsize': self.maxsize,
+                'hits': self.hits,
+                'misses': self.misses,
+                'evictions': self.evictions,
+            }
+
+
+# ------------------------------------------------------------------------------------
+# TTL cache
+# ------------------------------------------------------------------------------------
+class TTLCache:
+    """
+    Small key/value cache whose entries expire ttl seconds after they were stored.
+
+    Intended for a handful of keys (e.g. the feast banner): writers in this process
+    invalidate entries directly, and the TTL bounds how long another worker's
+    write can go unseen.
+
+    Thread safe: every operation takes one lock.
+    """
+
+    def __init__(self, ttl: float = 30.0):
+        self.ttl = ttl
+        self._lock = threading.Lock()
+        self._data = {}
+        self._generation = 0
+        self.hits = 0
+        self.misses = 0
+
+    @property
+    def generation(self) -> int:
+        """
+        Counter advanced by every invalidate.
+
+        Read it before loading from the source, and pass it to set(): a load that
+        raced a write is then discarded instead of overwriting the newer value.
+        """
+        return self._generation
+
+    def get(self, key):
+        """Return the live value for key, or None if missing/expired."""
+        now = time.monotonic()
+        with self._lock:
+            entry = self._data.get(key)
+            if entry is None or entry[0] <= now:
+                self._data.pop(key, None)
+                self.misses += 1
+                return None
+            self.hits += 1
+            return entry[1]
+
+    def set(self, key, value, generation=None):
+        """Store value for key with a fresh TTL (skipped if generation is stale)."""
+        with self._lock:
+            if generation is not None and generation != self._generation:
+                return
+            self._data[key] = (time.monotonic() + self.ttl, value)
+
+    def invalidate(self, key=None):
+        """Drop one key, or every key if key is None."""
+        with self._lock:
+            self._generation += 1
+            if key is None:
+                self._data.clear()
+            else:
+                self._data.pop(key, None)
+
+    def stats(self) -> dict:
+        """Return a snapshot of size and hit/miss counters."""
+        with self._lock:
+            return {'size': len(self._data), 'hits': self.hits, 'misses': self.misses}
@@ -0,0 +1,203 @@
+"""
+wfresh_events.py
+
+In-process publish/subscribe bus behind the /events/ server-sent events (SSE) stream.
+
+Contains:
+1) EventBus: per-topic fan-out of small JSON events to subscribers
+2) Subscription: one connected client's bounded event queue
+3) sse_stream: generator that turns a Subscription into an SSE byte stream
+   with heartbeats
+4) stream_limit: how many streams a process may hold open for its thread count
+
+Topics used by WFresh:
+- "feast"          new Wellesley Feast notifications
+- "thread:<thid>"  new replies in a DishDash thread
+
+Backpressure:
+- Each subscriber has a bounded queue. When a slow client falls behind, the
+  oldest events are dropped; after too many drops the subscription is closed
+  and the browser's EventSource reconnects (and reloads what it missed).
+- The bus caps the number of concurrent subscribers, since every open stream
+  holds a worker thread: at most half of the request threads (stream_limit),
+  so page requests are never starved by open tabs.
+
+Settings (environment):
+    WFRESH_SSE_STREAMS    open streams per process (default: half the request threads)
+"""
+
+import json
+import os
+import threading
+import time
+from collections import deque
+from itertools import count
+
+
+class BusFull(Exception):
+    """Raised by EventBus.subscribe when the subscriber limit is reached."""
+
+
+class Subscription:
+    """
+    One client's view of the bus: a bounded queue of (id, topic, data) events.
+
+    Thread safe: publishers push from request threads while the SSE generator
+    waits on the condition variable.
+    """
+
+    def __init__(self, bus, topics, maxlen: int, max_dropped: int):
+        self.bus = bus
+        self.topics = frozenset(topics)
+        self.max_dropped = max_dropped
+        self.dropped = 0
+        self.closed = False
+        self._queue = deque(maxlen=maxlen)
+        self._cond = threading.Condition()
+
+    def push(self, event) -> None:
+        """Queue an event, dropping the oldest one if the client is behind."""
+        with self._cond:
+            if self.closed:
+                return
+            if len(self._queue) == self._queue.maxlen:
+                self.dropped += 1
+                if self.dropped > self.max_dropped:
+                    self.closed = True
+            self._queue.append(event)
+            self._cond.notify()
+
+    def next(self, timeout: float):
+        """
+        Wait up to timeout seconds for the next event.
+
+        Returns:
+            (id, topic, data) tuple, or None on timeout / close
+        """
+        with self._cond:
+            if not self._queue and not self.closed:
+                self._cond.wait(timeout)
+            if self.closed or not self._queue:
+                return None
+            return self._queue.popleft()
+
+    def close(self) -> None:
+        """Stop receiving events and detach from the bus."""
+        with self._cond:
+            self.closed = True
+            self._cond.notify()
+        self.bus.unsubscribe(self)
+
+
+class EventBus:
+    """
+    Per-topic fan-out of events to in-process subscribers.
+
+    Events only reach clients connected to the same worker process; other workers'
+    clients still see the change on their next page load.
+    """
+
+    def __init__(self, max_subscribers: int = 200, queue_size: int = 64, max_dropped: int = 256):
+        self.max_subscribers = max_subscribers
+        self.queue_size = queue_size
+        self.max_dropped = max_dropped
+        self._lock = threading.Lock()
+        self._by_topic = {}
+        self._count = 0
+        self._ids = count(1)
+        self.published = 0
+
+    def subscribe(self, topics) -> Subscription:
+        """Register a subscriber for the given topics (raises BusFull at capacity)."""
+        sub = Subscription(self, topics, self.queue_size, self.max_dropped)
+        with self._lock:
+            if self._count >= self.max_subscribers:
+                raise BusFull()
+            self._count += 1
+            for topic in sub.topics:
+                self._by_topic.setdefault(topic, set()).add(sub)
+        return sub
+
+    def unsubscribe(self, sub: Subscription) -> None:
+        """Remove a subscriber (safe to call more than once)."""
+        with self._lock:
+            removed = False
+            for topic in sub.topics:
+                subs = self._by_topic.get(topic)
+                if subs and sub in subs:
+                    subs.discard(sub)
+                    removed = True
+                    if not subs:
+                        del self._by_topic[topic]
+            if removed:
+                self._count -= 1
+
+    def publish(self, topic: str, data: dict) -> int:
+        """
+        Fan an event out to every subscriber of topic.
+
+        Never blocks on slow clients (see Subscription.push).
+
+        Returns:
+            number of subscribers the event was queued for
+        """
+        event = (next(self._ids), topic, json.dumps(data, default=str))
+        with self._lock:
+            subs = list(self._by_topic.get(topic, ()))
+            self.published += 1
+        for sub in subs:
+            sub.push(event)
+        return len(subs)
+
+    def stats(self) -> dict:
+        """Subscriber/topic counts for monitoring."""
+        with self._lock:
+            return {
+                'subscribers': self._count,
+                'topics': len(self._by_topic),
+                'published': self.published,
+            }
+
+
+def stream_limit(threads: int) -> int:
+    """Subscriber cap for a process serving requests on threads threads."""
+    return int(os.environ.get('WFRESH_SSE_STREAMS', max(1, threads // 2)))
+
+
+def busy_stream(retry: float = 30.0):
+    """
+    Body for a stream refused at capacity: just a reconnect delay.
+
+    Sent as a normal 200 event stream because EventSource gives up for good
+    on an error status, but reconnects after retry seconds when a stream ends.
+    """
+    yield f'retry: {int(retry * 1000)}\n: busy\n\n'
+
+
+def sse_stream(sub: Subscription, heartbeat: float = 15.0, max_age: float = 600.0):
+    """
+    Yield a Subscription as a text/event-stream body.
+
+    - A comment line is sent every heartbeat seconds so proxies keep the
+      connection open and dead clients are noticed
+    - The stream ends after max_age seconds (or when the subscription is closed
+      for falling behind); EventSource reconnects automatically
+    """
+    deadline = time.monotonic() + max_age
+    try:
+        yield 'retry: 5000\n\n'
+        while not sub.closed and time.monotonic() < deadline:
+            event = sub.next(timeout=heartbeat)
+            if event is None:
+                yield ': ping\n\n'
+                continue
+            eid, topic, data = event
+            event_name = topic.split(':', 1)[0]
+            yield f'id: {eid}\nevent: {event_name}\ndata: {data}\n\n'
+    finally:
+        sub.close()
+
+
+# Process-wide bus used by wfresh_helper (publishers) and app.py (/events/).
+# The servers set max_subscribers from their thread count (see stream_limit).
+bus = EventBus()
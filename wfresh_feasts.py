@@ -0,0 +1,296 @@
+"""
+wfresh_feasts.py
+
+Wellesley Feast timing support.
+
+Contains:
+1) parse_feast_time: best-effort parser that turns the free-text "When" field
+   ("5-7pm", "tomorrow at noon", "Fri 12/12 6:30pm", ...) into start/end datetimes
+2) FeastSweeper: background thread that moves expired notifications into
+   notification_archive in small batches, so the active-feast query only ever
+   scans live rows
+
+Requires the columns/table added by feast_times.sql.
+"""
+
+import os
+import re
+import threading
+import logging
+from datetime import date, datetime, timedelta
+
+import wfresh_helper
+
+log = logging.getLogger(__name__)
+
+# How long a feast lasts when only a start time was given
+DEFAULT_DURATION = timedelta(hours=2)
+
+# How long an unparseable feast stays on the banner after it was posted
+UNPARSED_TTL = timedelta(hours=6)
+
+# ------------------------------------------------------------------------------------
+# Free-text time parsing
+# ------------------------------------------------------------------------------------
+_WEEKDAYS = {
+    'mon': 0, 'monday': 0, 'tue': 1, 'tues': 1, 'tuesday': 1, 'wed': 2, 'wednesday': 2,
+    'thu': 3, 'thur': 3, 'thurs': 3, 'thursday': 3, 'fri': 4, 'friday': 4,
+    'sat': 5, 'saturday': 5, 'sun': 6, 'sunday': 6,
+}
+_MONTHS = {m: i + 1 for i, m in enumerate(
+    ['jan', 'feb', 'mar', 'apr', 'may', 'jun', 'jul', 'aug', 'sep', 'oct', 'nov', 'dec']
+)}
+
+# 5, 5pm, 5:30, 5:30 p.m., 17:00, noon, midnight. Hours must start a number and
+# am/pm must end a word: in "5 at Tower" the "a" is not am, and "Room 413" has no hour.
+_HOUR = r'(?<![\d:])(\d{1,2})'
+_TIME = (r'(?:' + _HOUR + r'(?::(\d{2}))?\s*([ap])\.?\s*m?\.?(?![a-z])'
+         r'|' + _HOUR + r':(\d{2})'
+         r'|' + _HOUR + r'(?![\d/:])'
+         r'|\b(noon|midnight)\b)')
+_TIME_RE = re.compile(_TIME)
+_RANGE_RE = re.compile(_TIME + r'\s*(?:-|–|to|until|till|til)\s*' + _TIME)
+_UNTIL_RE = re.compile(r'(?:until|till|til|before)\s+' + _TIME)
+_NUMERIC_DATE_RE = re.compile(r'\b(\d{1,2})/(\d{1,2})(?:/(\d{2,4}))?\b')
+_MONTH_DATE_RE = re.compile(r'\b(' + '|'.join(_MONTHS) + r')[a-z]*\.?\s+(\d{1,2})(?:st|nd|rd|th)?\b')
+
+
+def _time_parts(groups):
+    """
+    Convert one _TIME match's 7 groups into (hour, minute, meridiem).
+
+    meridiem is 'a', 'p' or None when the text did not say.
+    """
+    h1, m1, ampm, h2, m2, h3, word = groups
+    if word == 'noon':
+        return 12, 0, 'p'
+    if word == 'midnight':
+        return 0, 0, 'a'
+    if h1 is not None:
+        return int(h1), int(m1 or 0), ampm
+    if h2 is not None:
+        hour = int(h2)
+        # 24-hour clock ("17:00") is unambiguous
+        return hour, int(m2), ('p' if hour >= 12 else None)
+    return int(h3), 0, None
+
+
+def _to_24h(hour: int, meridiem) -> int:
+    """
+    Resolve an hour to 0-23.
+
+    Without am/pm, assume campus-event hours: 8-11 are morning, 12-7 afternoon/evening.
+    """
+    if hour > 12 or hour < 0:
+        return hour if hour < 24 else -1
+    if meridiem == 'a':
+        return 0 if hour == 12 else hour
+    if meridiem == 'p':
+        return 12 if hour == 12 else hour + 12
+    if 8 <= hour <= 11:
+        return hour
+    return 12 if hour == 12 else hour + 12
+
+
+def _parse_day(text: str, today: date):
+    """Return the calendar day mentioned in text (defaults to today)."""
+    if 'tomorrow' in text:
+        return today + timedelta(days=1)
+
+    m = _NUMERIC_DATE_RE.search(text)
+    if m:
+        month, day, year = int(m.group(1)), int(m.group(2)), m.group(3)
+        year = today.year if year is None else int(year) + (2000 if len(year) == 2 else 0)
+        try:
+            return date(year, month, day)
+        except ValueError:
+            return None
+
+    m = _MONTH_DATE_RE.search(text)
+    if m:
+        try:
+            return date(today.year, _MONTHS[m.group(1)], int(m.group(2)))
+        except ValueError:
+            return None
+
+    for word in re.findall(r'[a-z]+', text):
+        if word in _WEEKDAYS:
+            return today + timedelta(days=(_WEEKDAYS[word] - today.weekday()) % 7)
+
+    return today
+
+
+def parse_feast_time(text: str, now: datetime = None):
+    """
+    Best-effort parse of a feast's free-text time.
+
+    Args:
+        text: what the user typed into "When"
+        now: reference time (defaults to datetime.now())
+
+    Returns:
+        (starts_at, ends_at): datetimes, or (None, None) if nothing usable was found.
+        A start without an end lasts DEFAULT_DURATION.
+    """
+    if now is None:
+        now = datetime.now()
+    text = (text or '').lower().strip()
+    if not text:
+        return None, None
+
+    if re.search(r'\b(now|asap|right now)\b', text) and not _TIME_RE.search(
+            _NUMERIC_DATE_RE.sub(' ', text)):
+        return now.replace(microsecond=0), now.replace(microsecond=0) + DEFAULT_DURATION
+
+    day = _parse_day(text, now.date())
+    if day is None:
+        return None, None
+
+    # Dates would otherwise be read as times ("12/10" -> 12 o'clock)
+    time_text = _MONTH_DATE_RE.sub(' ', _NUMERIC_DATE_RE.sub(' ', text))
+
+    start = end = None
+    m = _RANGE_RE.search(time_text)
+    if m:
+        sh, sm, smer = _time_parts(m.groups()[:7])
+        eh, em, emer = _time_parts(m.groups()[7:])
+        if smer is None and emer is not None:
+            # "5-7pm": the start inherits the end's meridiem unless that puts it after the end
+            smer = emer if _to_24h(sh, emer) <= _to_24h(eh, emer) else ('a' if emer == 'p' else 'p')
+        start = (_to_24h(sh, smer), sm)
+        end = (_to_24h(eh, emer), em)
+    else:
+        m = _UNTIL_RE.search(time_text)
+        if m:
+            eh, em, emer = _time_parts(m.groups())
+            end = (_to_24h(eh, emer), em)
+        else:
+            m = _TIME_RE.search(time_text)
+            if m:
+                sh, sm, smer = _time_parts(m.groups())
+                start = (_to_24h(sh, smer), sm)
+
+    if start is None and end is None:
+        return None, None
+    if (start and not (0 <= start[0] < 24 and 0 <= start[1] < 60)) or \
+            (end and not (0 <= end[0] < 24 and 0 <= end[1] < 60)):
+        return None, None
+
+    if start is None:
+        # "until 7pm": running from now (or the start of that day)
+        starts_at = max(now.replace(second=0, microsecond=0), datetime.combine(day, datetime.min.time()))
+    else:
+        starts_at = datetime.combine(day, datetime.min.time()).replace(hour=start[0], minute=start[1])
+
+    if end is None:
+        ends_at = starts_at + DEFAULT_DURATION
+    else:
+        ends_at = datetime.combine(day, datetime.min.time()).replace(hour=end[0], minute=end[1])
+        if ends_at <= starts_at:
+            # Runs past midnight
+            ends_at += timedelta(days=1)
+
+    return starts_at, ends_at
+
+
+# ------------------------------------------------------------------------------------
+# Expired-feast sweeper
+# ------------------------------------------------------------------------------------
+class FeastSweeper:
+    """
+    Background thread that archives expired feast notifications.
+
+    Each pass moves up to batch_size rows per transaction (copy into
+    notification_archive, then delete), repeating until no expired rows remain,
+    so it never holds long locks on notification.
+
+    Thread/process safe:
+    - One sweeper per process (start() is idempotent and fork-aware)
+    - Concurrent sweepers in other workers just find fewer rows (FOR UPDATE
+      serializes them)
+    """
+
+    def __init__(self, interval: float = 300, batch_size: int = 200, grace: timedelta = timedelta(hours=1)):
+        self.interval = interval
+        self.batch_size = batch_size
+        self.grace = grace
+        self.archived = 0
+        self._pid = None
+        self._stop = threading.Event()
+        self._lock = threading.Lock()
+
+    def start(self):
+        """Start the sweeper thread in this process if it is not already running."""
+        with self._lock:
+            if self._pid == os.getpid():
+                return
+            self._pid = os.getpid()
+            self._stop = threading.Event()
+            t = threading.Thread(target=self._run, name='feast-sweeper', daemon=True)
+            t.start()
+
+    def stop(self):
+        """Ask the sweeper thread to exit after its current pass."""
+        self._stop.set()
+
+    def _run(self):
+        while not self._stop.wait(self.interval):
+            try:
+                self.sweep()
+            except Exception:
+                log.exception('feast sweep failed')
+
+    def sweep(self) -> int:
+        """
+        Archive every notification that ended more than grace ago.
+
+        Returns:
+            number of rows archived
+        """
+        total = 0
+        while True:
+            moved = self._sweep_batch()
+            total += moved
+            if moved < self.batch_size:
+                break
+        if total:
+            self.archived += total
+            wfresh_helper.invalidate_feast_cache()
+        return total
+
+    def _sweep_batch(self) -> int:
+        conn, cur = wfresh_helper.db_connect(dict_cursor=False)
+        try:
+            cur.execute(
+                '''
+                SELECT nid
+                FROM notification
+                WHERE ends_at < %s
+                ORDER BY ends_at
+                LIMIT %s
+                FOR UPDATE
+                ''',
+                (datetime.now() - self.grace, self.batch_size)
+            )
+            nids = [row[0] for row in cur.fetchall()]
+            if not nids:
+                conn.rollback()
+                return 0
+
+            placeholders = ', '.join(['%s'] * len(nids))
+            cur.execute(
+                f'INSERT IGNORE INTO notification_archive SELECT * FROM notification WHERE nid IN ({placeholders})',
+                nids
+            )
+            cur.execute(f'DELETE FROM notification WHERE nid IN ({placeholders})', nids)
+            conn.commit()
+            return len(nids)
+        except Exception:
+            conn.rollback()
+            raise
+        finally:
+            conn.close()
+
+
+# Process-wide sweeper (started by app.py)
+sweeper = FeastSweeper()
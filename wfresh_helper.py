@@ -10,23 +10,36 @@ Contains:
    - Feast notifications
    - DishDash forum (threads/messages)
    - Dish pages (comments/pictures)
+   - Dish stats (per-dish aggregates for the home menu grid)
+   - Names for the trending panel (wfresh_trending)
 """
 
 import threading
 import os
+import sys
 import json
+import time
+import hashlib
+from collections import namedtuple
 from datetime import date, datetime, timedelta
 import requests
 import cs304dbi as dbi
+import wfresh_metrics as metrics
+from wfresh_cache import VersionTable, LRUCache, TTLCache
+from wfresh_events import bus as event_bus
+import wfresh_feasts
+import wfresh_trending
+from wfresh_writeq import GroupCommitQueue, WriteSpec, WriteQueueFull
 
-DB_NAME = "wfresh_db"
+DB_NAME = os.environ.get("WFRESH_DB_NAME", "wfresh_db")
 
 # Lock for anything that touches global-ish config or shared files
 _dbi_lock = threading.Lock()
 _cache_lock = threading.Lock()
 
-# Wellesley Fresh API
-AVI_API = "https://dish.avifoodsystems.com/api/menu-items/week"
+# Wellesley Fresh API (WFRESH_AVI_API points it elsewhere, e.g. bench/fake_avi.py)
+AVI_API = os.environ.get("WFRESH_AVI_API", "https://dish.avifoodsystems.com/api/menu-items/week")
+AVI_TIMEOUT = 5
 
 # ------------------------------------------------------------------------------------
 # Menu API + caching (AVI)
@@ -80,21 +93,38 @@ def fetch_menu_for(d: date, dhall_id: int, meal_name: str) -> list[dict]:
     Returns:
         List of dish dicts: {did, name, station}
     """
-    meal_id = DINING_HALLS[dhall_id]["meals"][meal_name]
-
-    resp = requests.get(
-        AVI_API,
-        params={
-            "date": d.strftime("%-m/%-d/%y"),  # e.g. '11/15/25'
-            "locationId": dhall_id,
-            "mealId": meal_id,
-        },
-        verify=False,
-        timeout=5,
-    )
+    start = time.perf_counter()
+    status = 'error'
+    try:
+        resp = requests.get(
+            AVI_API,
+            params=avi_params(d, dhall_id, meal_name),
+            verify=False,
+            timeout=AVI_TIMEOUT,
+        )
+        status = str(resp.status_code)
+    finally:
+        metrics.AVI_SECONDS.observe(time.perf_counter() - start, status)
     resp.raise_for_status()
-    data = resp.json() or []
+    return parse_menu_items(resp.json() or [], d)
+
+
+def avi_params(d: date, dhall_id: int, meal_name: str) -> dict:
+    """Query parameters of the AVI week request for one dining hall and meal."""
+    return {
+        "date": d.strftime("%-m/%-d/%y"),  # e.g. '11/15/25'
+        "locationId": dhall_id,
+        "mealId": DINING_HALLS[dhall_id]["meals"][meal_name],
+    }
+
+
+def parse_menu_items(data: list, d: date) -> list[dict]:
+    """
+    Reduce an AVI week response to the dishes served on d.
 
+    Returns:
+        List of dish dicts: {did, name, station}
+    """
     target_iso = d.isoformat()
     dishes: list[dict] = []
 
@@ -115,11 +145,102 @@ def fetch_menu_for(d: date, dhall_id: int, meal_name: str) -> list[dict]:
     return dishes
 
 
+class Dish:
+    """
+    One menu entry (read-only).
+
+    Menus repeat the same dishes across days, so the in-memory week holds one
+    shared Dish per (did, name, station), with interned strings. Supports both
+    dish.name and dish['name'], like the dicts it replaces.
+    """
+
+    __slots__ = ('did', 'name', 'station')
+
+    def __init__(self, did, name, station):
+        self.did = did
+        self.name = name
+        self.station = station
+
+    def __getitem__(self, key):
+        if key not in self.__slots__:
+            raise KeyError(key)
+        return getattr(self, key)
+
+    def get(self, key, default=None):
+        return getattr(self, key) if key in self.__slots__ else default
+
+    def keys(self):
+        return self.__slots__
+
+    def as_dict(self) -> dict:
+        return {'did': self.did, 'name': self.name, 'station': self.station}
+
+    def __repr__(self):
+        return f'Dish({self.did!r}, {self.name!r}, {self.station!r})'
+
+
+def _intern(value):
+    return sys.intern(value) if isinstance(value, str) else value
+
+
+def compact_week_menu(week_menu: dict) -> dict:
+    """
+    Convert fetch_week_menu data (dish dicts) to the shared in-memory form.
+
+    Same nesting; each hall's dishes become a tuple of Dish records, and equal
+    dishes, names, stations and keys are stored once.
+    """
+    dishes = {}
+    compact = {}
+    for date_key, meals in week_menu.items():
+        day = compact[_intern(date_key)] = {}
+        for meal, halls in meals.items():
+            by_hall = day[_intern(meal)] = {}
+            for hall, items in halls.items():
+                records = []
+                for item in items:
+                    key = (item.get('did'), item.get('name'), item.get('station'))
+                    dish = dishes.get(key)
+                    if dish is None:
+                        dish = dishes[key] = Dish(key[0], _intern(key[1]), _intern(key[2]))
+                    records.append(dish)
+                by_hall[_intern(hall)] = tuple(records)
+    return compact
+
+
+def menu_json_default(obj):
+    """json.dumps(default=...) hook for compact menu data."""
+    if isinstance(obj, Dish):
+        return obj.as_dict()
+    raise TypeError(f'{type(obj).__name__} is not JSON serializable')
+
+
 def get_cache_filepath():
-    """Return the absolute path to the menu cache file."""
+    """Return the absolute path to the menu cache file (WFRESH_MENU_CACHE overrides it)."""
+    override = os.environ.get('WFRESH_MENU_CACHE')
+    if override:
+        return os.path.abspath(override)
     return os.path.join(os.path.dirname(os.path.abspath(__file__)), 'menu_cache.json')
 
 
+def menu_cache_version():
+    """
+    Cheap version token for the menu cache file (one stat, no read).
+
+    save_menu_cache replaces the file atomically, so (mtime, size) changes
+    whenever the menu does. Call this BEFORE fetch_week_menu so a concurrent
+    refresh can only make the token older than the data, never newer.
+
+    Returns:
+        str token, or None if there is no cache file
+    """
+    try:
+        st = os.stat(get_cache_filepath())
+    except OSError:
+        return None
+    return f'{st.st_mtime_ns}-{st.st_size}'
+
+
 
 def is_cache_valid(cache_data: dict) -> bool:
     """
@@ -139,22 +260,40 @@ def is_cache_valid(cache_data: dict) -> bool:
         return False
 
 
+# (file version, cached_date, compact week) of the last cache file read or written
+_menu_memo = None
+
+
 def load_menu_cache():
-    """Thread-safe cache read."""
+    """
+    Thread-safe cache read.
+
+    The file is parsed and compacted once per version (menu_cache_version); all
+    requests in this process then share that one structure, so callers must
+    treat it as read-only.
+    """
+    global _menu_memo
     cache_file = get_cache_filepath()
 
     with _cache_lock:
-        if not os.path.exists(cache_file):
+        version = menu_cache_version()
+        if version is None:
             return None
-        try:
-            with open(cache_file, 'r') as f:
-                cache_data = json.load(f)
 
-            if is_cache_valid(cache_data):
-                return cache_data.get('menu_data', None)
-            return None
-        except (json.JSONDecodeError, IOError, KeyError):
-            return None
+        memo = _menu_memo
+        if memo is None or memo[0] != version:
+            try:
+                with open(cache_file, 'r') as f:
+                    cache_data = json.load(f)
+                memo = (version, cache_data.get('cached_date'),
+                        compact_week_menu(cache_data.get('menu_data') or {}))
+            except (json.JSONDecodeError, IOError, KeyError, AttributeError):
+                return None
+            _menu_memo = memo
+
+        if is_cache_valid({'cached_date': memo[1]}):
+            return memo[2]
+        return None
 
 
 
@@ -163,7 +302,9 @@ def save_menu_cache(menu_data: dict):
     Thread-safe cache write:
     - lock to prevent concurrent writers
     - write to temp, then atomic replace
+    - the file keeps plain dicts; the compact form is memoized for load_menu_cache
     """
+    global _menu_memo
     cache_file = get_cache_filepath()
     tmp_file = cache_file + ".tmp"
 
@@ -177,6 +318,7 @@ def save_menu_cache(menu_data: dict):
             with open(tmp_file, 'w') as f:
                 json.dump(cache_data, f, indent=2, default=str)
             os.replace(tmp_file, cache_file)  # atomic on POSIX
+            _menu_memo = (menu_cache_version(), cache_data['cached_date'], compact_week_menu(menu_data))
         except IOError:
             # If we can't write the cache, continue without it
             try:
@@ -192,15 +334,17 @@ def fetch_week_menu(start_date: date = None):
     Uses cache when available.
 
     Returns:
-        dict:
-          { "YYYY-MM-DD": { "Breakfast": {"Bates": [...], ...}, "Lunch": {...}, ... }, ... }
+        dict (shared between requests - read-only, see compact_week_menu):
+          { "YYYY-MM-DD": { "Breakfast": {"Bates": (Dish, ...), ...}, "Lunch": {...}, ... }, ... }
     """
     if start_date is None:
         start_date = date.today()
 
     cached_data = load_menu_cache()
     if cached_data is not None:
+        metrics.MENU_CACHE.inc('hit')
         return cached_data
+    metrics.MENU_CACHE.inc('miss')
 
     # Cache miss: fetch fresh.
     week_menu = {}
@@ -217,12 +361,58 @@ def fetch_week_menu(start_date: date = None):
                     week_menu[date_key][meal][info["name"]] = dishes
 
     save_menu_cache(week_menu)
-    return week_menu
+    return load_menu_cache() or compact_week_menu(week_menu)
+
+def slice_week_menu(week_menu: dict, date_key: str = None, meal: str = None, hall: str = None) -> dict:
+    """
+    Filter fetch_week_menu() data down to one date / meal / hall (any may be None = all).
+
+    Returns:
+        dict with the same nesting: { date: { meal: { hall: [dishes] } } }
+    """
+    days = week_menu if date_key is None else {date_key: week_menu.get(date_key, {})}
+    out = {}
+    for day, meals in days.items():
+        out[day] = {}
+        for meal_name, halls in meals.items():
+            if meal is not None and meal_name != meal:
+                continue
+            if hall is not None:
+                halls = {hall: halls[hall]} if hall in halls else {}
+            out[day][meal_name] = halls
+    return out
+
+
+# A cache stays valid for a day after it was written, so its last day can be
+# missing; such days are fetched live and kept briefly (fetch_day_menu).
+DAY_MENU_TTL = 10 * 60
+day_menu_cache = TTLCache(ttl=DAY_MENU_TTL)
+
+
+def fetch_day_menu(d: date) -> dict:
+    """
+    Fetch one day's menus straight from AVI, for a day the week cache lacks.
+
+    Returns:
+        { "Breakfast": {"Bates": [dishes], ...}, "Lunch": {...}, ... }
+    """
+    date_key = d.isoformat()
+    menus = day_menu_cache.get(date_key)
+    if menus is None:
+        menus = {}
+        for meal in MEALS:
+            menus[meal] = {}
+            for dhall_id, info in DINING_HALLS.items():
+                dishes = fetch_menu_for(d, dhall_id, meal)
+                if dishes:
+                    menus[meal][info["name"]] = dishes
+        day_menu_cache.set(date_key, menus)
+    return menus
 
 # ------------------------------------------------------------------------------------
 # Database helpers (thread-safe)
 # ------------------------------------------------------------------------------------
-DB_NAME = "wfresh_db"
+DB_NAME = os.environ.get("WFRESH_DB_NAME", "wfresh_db")
 
 # Lock to protect dbi.conf() (may mutate global state inside cs304dbi)
 _dbi_lock = threading.Lock()
@@ -245,7 +435,7 @@ def db_connect(dict_cursor: bool = False):
     with _dbi_lock:
         dbi.conf(DB_NAME)
 
-    conn = dbi.connect()
+    conn = metrics.instrumented_connect(dbi.connect)
     if dict_cursor:
         return conn, dbi.dict_cursor(conn)
     return conn, conn.cursor()
@@ -254,24 +444,54 @@ def db_connect(dict_cursor: bool = False):
 # ------------------------------------------------------------------------------------
 # Feast notifications (thread-safe)
 # ------------------------------------------------------------------------------------
-def insert_feast_notification(owner_uid, time_text: str, location: str, freefood: str):
+# limit -> tuple of active/upcoming feast rows. TTL is the cross-worker safety net
+# (and also how often feasts that just ended drop off the banner). Shared with
+# the async front end (wfresh_async).
+FEAST_CACHE_TTL = 30
+feast_cache = TTLCache(ttl=FEAST_CACHE_TTL)
+
+# Upcoming feasts further out than this are not shown on the banner yet
+FEAST_HORIZON = timedelta(hours=24)
+
+
+def insert_feast_notification(owner_uid, time_text: str, location: str, freefood: str, wait: bool = True):
     """
     Insert a new feast notification.
 
+    The free-text time is parsed into starts_at/ends_at where possible; feasts
+    whose time can't be parsed stay live for wfresh_feasts.UNPARSED_TTL.
+
+    In write-behind mode (enable_write_behind) the row is queued for the next group
+    commit; pass wait=False to return a PendingWrite instead of blocking.
+
     Thread safe:
     - New connection per call
     - Transaction with commit/rollback
     - Always closes connection
+
+    Returns:
+        nid (or a PendingWrite when wait=False in write-behind mode)
     """
+    now = datetime.now().replace(microsecond=0)
+    starts_at, ends_at = wfresh_feasts.parse_feast_time(time_text, now)
+    if ends_at is None:
+        ends_at = now + wfresh_feasts.UNPARSED_TTL
+    params = (time_text, location, freefood, owner_uid, now, starts_at, ends_at)
+
+    pending = _submit_write(_FEAST_WRITE, params)
+    if pending is not None:
+        return pending.wait() if wait else pending
+
     conn, cur = db_connect(dict_cursor=False)
     try:
         cur.execute(
             '''
-            INSERT INTO notification (time, location, freefood, owner)
-            VALUES (%s, %s, %s, %s)
+            INSERT INTO notification (time, location, freefood, owner, created_at, starts_at, ends_at)
+            VALUES (%s, %s, %s, %s, %s, %s, %s)
             ''',
-            (time_text, location, freefood, owner_uid)
+            params
         )
+        nid = cur.lastrowid
         conn.commit()
     except Exception:
         conn.rollback()
@@ -279,10 +499,74 @@ def insert_feast_notification(owner_uid, time_text: str, location: str, freefood
     finally:
         conn.close()
 
+    _after_feast_insert(nid, params)
+    return nid
+
+
+def _after_feast_insert(nid, params):
+    """Post-commit work for a new feast: refresh the banner, push to live clients."""
+    time_text, location, freefood = params[:3]
+
+    # The banner is ordered by start time, so just drop the cached lists.
+    invalidate_feast_cache()
+
+    event_bus.publish('feast', {
+        'nid': nid, 'time': time_text, 'location': location, 'freefood': freefood
+    })
+
+
+def invalidate_feast_cache():
+    """Drop cached banner lists (after inserts and archive sweeps)."""
+    feast_cache.invalidate()
+
+
+def get_active_feast_events(limit: int = 3):
+    """
+    Fetch feasts happening now, then upcoming ones (within FEAST_HORIZON).
+
+    Served from feast_cache; writes in this process invalidate it, and the short
+    TTL picks up feasts posted by other workers.
+
+    Returns:
+        tuple of tuples: (nid, time, location, freefood)
+    """
+    rows = feast_cache.get(limit)
+    if rows is None:
+        generation = feast_cache.generation
+        rows = tuple(_query_active_feast_events(limit))
+        feast_cache.set(limit, rows, generation)
+    return rows
+
+
+ACTIVE_FEASTS_SQL = '''
+    SELECT nid, time, location, freefood
+    FROM notification
+    WHERE ends_at >= %s
+      AND (starts_at IS NULL OR starts_at <= %s)
+    ORDER BY COALESCE(starts_at, created_at) ASC, nid ASC
+    LIMIT %s
+'''
+
+
+def _query_active_feast_events(limit: int):
+    """
+    Uncached query behind get_active_feast_events.
+
+    Uses the ends_at index: expired rows are archived by wfresh_feasts.FeastSweeper,
+    so the range scan only touches live feasts.
+    """
+    now = datetime.now()
+    conn, cur = db_connect(dict_cursor=False)
+    try:
+        cur.execute(ACTIVE_FEASTS_SQL, (now, now + FEAST_HORIZON, limit))
+        return cur.fetchall()
+    finally:
+        conn.close()
+
 
 def get_recent_feast_events(limit: int = 3):
     """
-    Fetch the most recent feast notifications.
+    Fetch the most recently posted feast notifications (including ended ones).
 
     Returns:
         list of tuples: (nid, time, location, freefood)
@@ -369,6 +653,26 @@ def list_threads():
         conn.close()
 
 
+def get_dishdash_validator():
+    """
+    Cheap change token for the DishDash thread list.
+
+    Thread count and newest thid come from the (small) threads table; message
+    counts are covered by the THREAD_LIST version, which every message insert
+    and delete bumps, so the messages table is never scanned.
+
+    Returns:
+        tuple
+    """
+    version = thread_versions.token(THREAD_LIST)
+    conn, cur = db_connect(dict_cursor=False)
+    try:
+        cur.execute('SELECT COUNT(*), MAX(thid) FROM threads')
+        return tuple(cur.fetchone()) + (version,)
+    finally:
+        conn.close()
+
+
 def get_thread(thid: int):
     """
     Get a single thread row.
@@ -423,14 +727,28 @@ def get_thread_messages(thid: int):
         conn.close()
 
 
-def insert_message(sender_uid, thid: int, content: str, replyto=None):
+def insert_message(sender_uid, thid: int, content: str, replyto=None, sender_name=None, wait: bool = True):
     """
     Insert a new message into a thread.
 
+    After commit, invalidates the cached thread page and pushes the reply to
+    "thread:<thid>" subscribers (sender_name is only used for that event).
+    In write-behind mode the row goes through the group-commit queue; wait=True
+    (the default) still blocks until it is durable, for read-your-writes.
+
     Thread safe:
     - New connection per call
     - commit/rollback
+
+    Returns:
+        mid (or a PendingWrite when wait=False in write-behind mode)
     """
+    params = (replyto, sender_uid, content, thid)
+
+    pending = _submit_write(_MESSAGE_WRITE, params, context=sender_name)
+    if pending is not None:
+        return pending.wait() if wait else pending
+
     conn, cur = db_connect(dict_cursor=True)
     try:
         cur.execute(
@@ -438,8 +756,9 @@ def insert_message(sender_uid, thid: int, content: str, replyto=None):
             INSERT INTO messages (replyto, sender, content, parentthread, sent_at)
             VALUES (%s, %s, %s, %s, NOW())
             ''',
-            (replyto, sender_uid, content, thid)
+            params
         )
+        mid = cur.lastrowid
         conn.commit()
     except Exception:
         conn.rollback()
@@ -447,6 +766,23 @@ def insert_message(sender_uid, thid: int, content: str, replyto=None):
     finally:
         conn.close()
 
+    _after_message_insert(mid, params, sender_name)
+    return mid
+
+
+def _after_message_insert(mid, params, sender_name):
+    """Post-commit work for a new message: invalidate the thread page, push the reply, count it as activity."""
+    replyto, sender_uid, content, thid = params
+
+    thread_versions.bump(thid)
+    thread_versions.bump(THREAD_LIST)
+    wfresh_trending.threads.record(thid)
+    event_bus.publish(f'thread:{thid}', {
+        'mid': mid, 'replyto': replyto, 'sender': sender_uid,
+        'sender_name': sender_name, 'content': content,
+        'sent_at': datetime.now().replace(microsecond=0),
+    })
+
 
 def delete_message_recursive(cur, mid: int):
     """
@@ -514,6 +850,8 @@ def delete_thread(owner_uid, thid: int):
         cur.execute('DELETE FROM post WHERE postid = %s', (postid,))
 
         conn.commit()
+        thread_versions.bump(thid)
+        thread_versions.bump(THREAD_LIST)
         return True, "Thread deleted."
     except Exception:
         conn.rollback()
@@ -560,6 +898,8 @@ def delete_message(sender_uid, thid: int, mid: int):
 
         delete_message_recursive(cur, mid)
         conn.commit()
+        thread_versions.bump(thid)
+        thread_versions.bump(THREAD_LIST)
         return True, "Message and its replies have been deleted."
     except Exception:
         conn.rollback()
@@ -604,14 +944,89 @@ def build_message_tree(rows):
     return roots
 
 
+# ------------------------------------------------------------------------------------
+# Thread page cache (read-through, invalidated by version bumps)
+# ------------------------------------------------------------------------------------
+# Bumped by insert_message / delete_message / delete_thread after they commit.
+thread_versions = VersionTable()
+
+# Key bumped alongside any thread's version: the DishDash list's message counts
+THREAD_LIST = 'thread-list'
+
+# thid -> (thread row, built message tree)
+_thread_cache = LRUCache(maxsize=256)
+
+
+def get_thread_view(thid: int):
+    """
+    Return (thread, messages) for a thread page, where messages is the nested tree
+    from build_message_tree. Returns (None, None) if the thread does not exist.
+
+    Read-through cache:
+    - Version is read BEFORE querying, so a write that commits mid-load makes this
+      entry stale on the next read instead of serving old data
+    - Cached values are shared across requests; treat them as read-only
+    """
+    version = thread_versions.get(thid)
+    cached = _thread_cache.get(thid, version)
+    if cached is not None:
+        return cached
+
+    thread = get_thread(thid)
+    if not thread:
+        return None, None
+
+    messages = build_message_tree(get_thread_messages(thid))
+    view = (thread, messages)
+    _thread_cache.put(thid, view, version)
+    return view
+
+
+def thread_cache_stats() -> dict:
+    """Hit/miss/eviction counters for the thread page cache."""
+    stats = _thread_cache.stats()
+    stats['shared_versions'] = thread_versions.shared
+    return stats
+
+
 # ------------------------------------------------------------------------------------
 # Dish: comments/pictures (thread-safe)
 # ------------------------------------------------------------------------------------
+# Dish page reads (also run by the async front end, wfresh_async)
+DISH_SQL = 'SELECT did, name, description FROM dish WHERE did = %s'
+
+DISH_VALIDATOR_SQL = '''
+    SELECT (SELECT COUNT(*) FROM comments WHERE dish = %s),
+           (SELECT MAX(commentid) FROM comments WHERE dish = %s),
+           (SELECT COUNT(*) FROM dish_picture WHERE did = %s),
+           (SELECT MAX(pid) FROM dish_picture WHERE did = %s),
+           (SELECT COUNT(thumb_filename) FROM dish_picture WHERE did = %s)
+'''
+
+DISH_COMMENTS_SQL = '''
+    SELECT c.commentid, c.owner, c.type, c.comment,
+           u.name as owner_name
+    FROM comments c
+    LEFT JOIN users u ON c.owner = u.uid
+    WHERE c.dish = %s
+    ORDER BY c.commentid DESC
+'''
+
+DISH_PICS_SQL = '''
+    SELECT dp.pid, dp.filename, dp.owner, u.name,
+           dp.thumb_filename, dp.display_filename
+    FROM dish_picture dp
+    LEFT JOIN users u ON dp.owner = u.uid
+    WHERE dp.did = %s
+    ORDER BY dp.pid DESC
+'''
+
+
 def get_dish(did):
     """Fetch dish info as dict or None."""
     conn, cur = db_connect(dict_cursor=False)
     try:
-        cur.execute('SELECT did, name, description FROM dish WHERE did = %s', (did,))
+        cur.execute(DISH_SQL, (did,))
         row = cur.fetchone()
         if row is None:
             return None
@@ -620,6 +1035,22 @@ def get_dish(did):
         conn.close()
 
 
+def get_dish_validator(did):
+    """
+    Cheap change token for a dish page: counts and newest ids of its comments and
+    pictures, plus how many pictures have variants (the gallery markup uses them).
+
+    Returns:
+        tuple
+    """
+    conn, cur = db_connect(dict_cursor=False)
+    try:
+        cur.execute(DISH_VALIDATOR_SQL, (did,) * 5)
+        return tuple(cur.fetchone())
+    finally:
+        conn.close()
+
+
 def get_dish_comments(did):
     """
     Fetch comments for dish with owner info.
@@ -628,17 +1059,7 @@ def get_dish_comments(did):
     """
     conn, cur = db_connect(dict_cursor=False)
     try:
-        cur.execute(
-            '''
-            SELECT c.commentid, c.owner, c.type, c.comment,
-                   u.name as owner_name
-            FROM comments c
-            LEFT JOIN users u ON c.owner = u.uid
-            WHERE c.dish = %s
-            ORDER BY c.commentid DESC
-            ''',
-            (did,)
-        )
+        cur.execute(DISH_COMMENTS_SQL, (did,))
         return cur.fetchall()
     finally:
         conn.close()
@@ -648,29 +1069,35 @@ def get_dish_pics(did):
     """
     Fetch pictures for dish with owner info.
     Returns rows:
-      (pid, filename, owner_uid, owner_name)
+      (pid, filename, owner_uid, owner_name, thumb_filename, display_filename)
 
-    NOTE: requires dish_picture.owner column.
+    The variant filenames are NULL until wfresh_images has processed the upload.
+
+    NOTE: requires dish_picture.owner column and image_variants.sql.
     """
     conn, cur = db_connect(dict_cursor=False)
     try:
-        cur.execute(
-            '''
-            SELECT dp.pid, dp.filename, dp.owner, u.name
-            FROM dish_picture dp
-            LEFT JOIN users u ON dp.owner = u.uid
-            WHERE dp.did = %s
-            ORDER BY dp.pid DESC
-            ''',
-            (did,)
-        )
+        cur.execute(DISH_PICS_SQL, (did,))
         return cur.fetchall()
     finally:
         conn.close()
 
 
-def add_dish_comment(uid, did, comment_type: str, comment_text: str):
-    """Insert a dish comment owned by uid (transaction safe)."""
+def add_dish_comment(uid, did, comment_type: str, comment_text: str, wait: bool = True):
+    """
+    Insert a dish comment owned by uid (transaction safe).
+
+    In write-behind mode the row goes through the group-commit queue.
+
+    Returns:
+        commentid (or a PendingWrite when wait=False in write-behind mode)
+    """
+    params = (did, uid, comment_type, comment_text)
+
+    pending = _submit_write(_COMMENT_WRITE, params)
+    if pending is not None:
+        return pending.wait() if wait else pending
+
     conn, cur = db_connect(dict_cursor=False)
     try:
         cur.execute(
@@ -678,20 +1105,33 @@ def add_dish_comment(uid, did, comment_type: str, comment_text: str):
             INSERT INTO comments (dish, owner, type, comment)
             VALUES (%s, %s, %s, %s)
             ''',
-            (did, uid, comment_type, comment_text)
+            params
         )
+        commentid = cur.lastrowid
+        _add_comment_stats(cur, [params])
         conn.commit()
     except Exception:
         conn.rollback()
         raise
     finally:
         conn.close()
+    _after_comment_insert(params)
+    return commentid
+
+
+def _after_comment_insert(params):
+    """Post-commit work for a new comment: refresh the grid stats, count it for trending."""
+    invalidate_dish_stats()
+    wfresh_trending.dishes.record(params[0])
 
 
 def add_dish_picture(did, filename: str, owner_uid):
     """
     Insert a dish picture record owned by owner_uid.
     Requires dish_picture.owner column.
+
+    Returns:
+        pid of the new row
     """
     conn, cur = db_connect(dict_cursor=False)
     try:
@@ -702,12 +1142,84 @@ def add_dish_picture(did, filename: str, owner_uid):
             ''',
             (did, filename, owner_uid)
         )
+        pid = cur.lastrowid
+        cur.execute(
+            '''
+            INSERT INTO dish_stats (did, pictures) VALUES (%s, 1)
+            ON DUPLICATE KEY UPDATE pictures = pictures + 1
+            ''',
+            (did,)
+        )
         conn.commit()
     except Exception:
         conn.rollback()
         raise
     finally:
         conn.close()
+    invalidate_dish_stats()
+    return pid
+
+
+def set_dish_picture_variants(pid: int, thumb_filename: str, display_filename: str) -> bool:
+    """
+    Record the resized variants produced by wfresh_images for picture pid.
+
+    Returns:
+        False if the picture row no longer exists (deleted while processing)
+    """
+    conn, cur = db_connect(dict_cursor=False)
+    try:
+        cur.execute(
+            '''
+            UPDATE dish_picture
+            SET thumb_filename = %s, display_filename = %s
+            WHERE pid = %s
+            ''',
+            (thumb_filename, display_filename, pid)
+        )
+        if cur.rowcount == 0:
+            conn.rollback()
+            return False
+        # Newest thumbnail wins; variants can finish out of upload order.
+        cur.execute(
+            '''
+            UPDATE dish_stats s
+            JOIN dish_picture p ON p.did = s.did
+            SET s.thumb_pid = p.pid, s.thumb = p.thumb_filename
+            WHERE p.pid = %s AND (s.thumb_pid IS NULL OR s.thumb_pid <= p.pid)
+            ''',
+            (pid,)
+        )
+        conn.commit()
+    except Exception:
+        conn.rollback()
+        raise
+    finally:
+        conn.close()
+    invalidate_dish_stats()
+    return True
+
+
+def get_pictures_without_variants():
+    """
+    List pictures that have no resized variants yet (for backfilling).
+
+    Returns rows:
+      (pid, filename)
+    """
+    conn, cur = db_connect(dict_cursor=False)
+    try:
+        cur.execute(
+            '''
+            SELECT pid, filename
+            FROM dish_picture
+            WHERE thumb_filename IS NULL
+            ORDER BY pid
+            '''
+        )
+        return cur.fetchall()
+    finally:
+        conn.close()
 
 
 def delete_dish_picture(did, pid: int, requester_uid):
@@ -741,12 +1253,14 @@ def delete_dish_picture(did, pid: int, requester_uid):
             return False, "You can only delete pictures you uploaded.", None
 
         cur.execute('DELETE FROM dish_picture WHERE pid = %s', (pid,))
+        _remove_picture_stats(cur, did, pid)
 
         # Check if any other DB row references same filename BEFORE commit
         cur.execute('SELECT COUNT(*) FROM dish_picture WHERE filename = %s', (filename,))
         count = cur.fetchone()[0]
 
         conn.commit()
+        invalidate_dish_stats()
 
         if count == 0:
             return True, "Picture deleted.", filename
@@ -758,6 +1272,35 @@ def delete_dish_picture(did, pid: int, requester_uid):
         conn.close()
 
 
+def find_referenced_uploads(filenames) -> set:
+    """
+    Return the subset of filenames that some dish_picture row still references
+    (as the original or as a resized variant). One batched IN query per call.
+
+    NOTE: relies on the indexes from upload_gc.sql to stay cheap.
+    """
+    filenames = list(filenames)
+    if not filenames:
+        return set()
+
+    placeholders = ', '.join(['%s'] * len(filenames))
+    conn, cur = db_connect(dict_cursor=False)
+    try:
+        cur.execute(
+            f'''
+            SELECT filename FROM dish_picture WHERE filename IN ({placeholders})
+            UNION
+            SELECT thumb_filename FROM dish_picture WHERE thumb_filename IN ({placeholders})
+            UNION
+            SELECT display_filename FROM dish_picture WHERE display_filename IN ({placeholders})
+            ''',
+            filenames * 3
+        )
+        return {row[0] for row in cur.fetchall()}
+    finally:
+        conn.close()
+
+
 def delete_dish_comment(did, commentid: int, requester_uid):
     """
     Delete a dish comment only if requester_uid owns it.
@@ -770,7 +1313,7 @@ def delete_dish_comment(did, commentid: int, requester_uid):
     try:
         cur.execute(
             '''
-            SELECT owner
+            SELECT owner, type
             FROM comments
             WHERE commentid = %s AND dish = %s
             FOR UPDATE
@@ -788,10 +1331,301 @@ def delete_dish_comment(did, commentid: int, requester_uid):
             return False, "You can only delete your own comments."
 
         cur.execute('DELETE FROM comments WHERE commentid = %s', (commentid,))
+        if row[1] in ('yum', 'yuck'):
+            cur.execute(
+                f'UPDATE dish_stats SET {row[1]} = GREATEST({row[1]} - 1, 0) WHERE did = %s',
+                (did,)
+            )
         conn.commit()
+        invalidate_dish_stats()
         return True, "Comment deleted."
     except Exception:
         conn.rollback()
         raise
     finally:
         conn.close()
+
+
+# ------------------------------------------------------------------------------------
+# Dish stats: yum/yuck/picture counts + newest thumbnail (dish_stats.sql)
+# ------------------------------------------------------------------------------------
+# Materialized so the home grid can show them for hundreds of dishes with one
+# query instead of get_dish_comments/get_dish_pics per dish. The comment and
+# picture writers above update the row in the same transaction.
+DishStats = namedtuple('DishStats', 'yum yuck pictures thumb')
+
+NO_DISH_STATS = DishStats(0, 0, 0, None)
+
+# 'week' -> (menu version, token, {did: DishStats}) for every dish in the cached
+# week menu. Writes in this process invalidate it; the TTL picks up other workers'.
+DISH_STATS_TTL = 30
+dish_stats_cache = TTLCache(ttl=DISH_STATS_TTL)
+
+# Batched read (also run by the async front end, wfresh_async)
+DISH_STATS_SQL = 'SELECT did, yum, yuck, pictures, thumb FROM dish_stats WHERE did IN ({placeholders})'
+
+REBUILD_DISH_STATS_SQL = (
+    'DELETE FROM dish_stats',
+    '''
+    INSERT INTO dish_stats (did, yum, yuck, pictures, thumb_pid, thumb)
+    SELECT d.did,
+           (SELECT COUNT(*) FROM comments c WHERE c.dish = d.did AND c.type = 'yum'),
+           (SELECT COUNT(*) FROM comments c WHERE c.dish = d.did AND c.type = 'yuck'),
+           (SELECT COUNT(*) FROM dish_picture p WHERE p.did = d.did),
+           (SELECT MAX(p.pid) FROM dish_picture p WHERE p.did = d.did AND p.thumb_filename IS NOT NULL),
+           (SELECT p.thumb_filename FROM dish_picture p
+            WHERE p.did = d.did AND p.thumb_filename IS NOT NULL ORDER BY p.pid DESC LIMIT 1)
+    FROM (SELECT dish AS did FROM comments UNION SELECT did FROM dish_picture) d
+    WHERE d.did IS NOT NULL
+    ''',
+)
+
+
+def _add_comment_stats(cur, params_list):
+    """
+    Count new comments into dish_stats, inside the inserting transaction.
+
+    params_list holds add_dish_comment params (did, uid, type, text); a whole
+    write-behind batch becomes one multi-row upsert. Rows go in did order so
+    concurrent batches lock dish_stats rows in the same order (no deadlocks).
+    """
+    counts = {}
+    for did, _, comment_type, _ in params_list:
+        did = int(did)
+        yum, yuck = counts.get(did, (0, 0))
+        if comment_type == 'yum':
+            yum += 1
+        elif comment_type == 'yuck':
+            yuck += 1
+        counts[did] = (yum, yuck)
+    if not counts:
+        return
+    cur.execute(
+        'INSERT INTO dish_stats (did, yum, yuck) VALUES '
+        + ', '.join(['(%s, %s, %s)'] * len(counts))
+        + ' ON DUPLICATE KEY UPDATE yum = yum + VALUES(yum), yuck = yuck + VALUES(yuck)',
+        [value for did, (yum, yuck) in sorted(counts.items()) for value in (did, yum, yuck)]
+    )
+
+
+def _remove_picture_stats(cur, did, pid: int):
+    """Uncount deleted picture pid; if it supplied the thumbnail, fall back to the next newest."""
+    cur.execute('SELECT thumb_pid FROM dish_stats WHERE did = %s FOR UPDATE', (did,))
+    row = cur.fetchone()
+    if row is None:
+        return
+    if row[0] is not None and int(row[0]) == int(pid):
+        cur.execute(
+            '''
+            SELECT pid, thumb_filename
+            FROM dish_picture
+            WHERE did = %s AND thumb_filename IS NOT NULL
+            ORDER BY pid DESC
+            LIMIT 1
+            ''',
+            (did,)
+        )
+        newest = cur.fetchone() or (None, None)
+        cur.execute(
+            'UPDATE dish_stats SET pictures = GREATEST(pictures - 1, 0), thumb_pid = %s, thumb = %s WHERE did = %s',
+            (newest[0], newest[1], did)
+        )
+    else:
+        cur.execute('UPDATE dish_stats SET pictures = GREATEST(pictures - 1, 0) WHERE did = %s', (did,))
+
+
+def invalidate_dish_stats():
+    """Drop the cached week stats (after comment/picture writes in this process)."""
+    dish_stats_cache.invalidate()
+
+
+def rebuild_dish_stats():
+    """Recompute every dish_stats row from comments and dish_picture (repair / bulk loads)."""
+    conn, cur = db_connect(dict_cursor=False)
+    try:
+        for sql in REBUILD_DISH_STATS_SQL:
+            cur.execute(sql)
+        conn.commit()
+    except Exception:
+        conn.rollback()
+        raise
+    finally:
+        conn.close()
+    invalidate_dish_stats()
+
+
+def get_dish_stats(dids) -> dict:
+    """
+    Aggregates for many dishes in one batched IN query.
+
+    Returns:
+        dict did -> DishStats (dishes without comments or pictures are absent)
+    """
+    dids = list(dids)
+    if not dids:
+        return {}
+
+    conn, cur = db_connect(dict_cursor=False)
+    try:
+        cur.execute(DISH_STATS_SQL.format(placeholders=', '.join(['%s'] * len(dids))), dids)
+        return {row[0]: DishStats(*row[1:]) for row in cur.fetchall()}
+    finally:
+        conn.close()
+
+
+def week_dish_ids(week_menu: dict) -> list:
+    """Sorted distinct dids in a fetch_week_menu() structure."""
+    return sorted({dish['did'] for meals in week_menu.values() for halls in meals.values()
+                   for dishes in halls.values() for dish in dishes if dish['did'] is not None})
+
+
+def dish_stats_token(stats: dict) -> str:
+    """Short digest of a get_dish_stats() result (same in every worker)."""
+    return hashlib.sha1(repr(sorted(stats.items())).encode()).hexdigest()[:12]
+
+
+def get_week_dish_stats(week_menu: dict, menu_version):
+    """
+    Stats for every dish in the cached week menu (fetch_week_menu), cached with it.
+
+    Returns:
+        (token, {did: DishStats}); token is a short digest of the stats, so it
+        is the same in every worker and only changes when some count does
+        (callers fold it into cache keys and ETags)
+    """
+    entry = dish_stats_cache.get('week')
+    if entry is not None and entry[0] == menu_version:
+        return entry[1], entry[2]
+
+    generation = dish_stats_cache.generation
+    stats = get_dish_stats(week_dish_ids(week_menu))
+    token = dish_stats_token(stats)
+    if menu_version is not None:
+        dish_stats_cache.set('week', (menu_version, token, stats), generation)
+    return token, stats
+
+
+# ------------------------------------------------------------------------------------
+# Names for the trending panel (wfresh_trending counts ids only)
+# ------------------------------------------------------------------------------------
+# did -> name and thid -> description. Both are immutable once written; thread
+# titles are tagged with thread_versions so a delete in any worker drops them.
+_dish_name_cache = LRUCache(maxsize=1024)
+_thread_title_cache = LRUCache(maxsize=1024)
+
+
+def _lookup_names(cache: LRUCache, sql: str, keys, versions: VersionTable = None) -> dict:
+    """
+    Cached batched lookup: key -> name for the keys that exist (one IN query for the misses).
+
+    With versions, entries are tagged with versions.get(key), read before the
+    query, so a later bump makes them misses.
+    """
+    names, missing = {}, {}
+    for key in keys:
+        version = versions.get(key) if versions is not None else None
+        name = cache.get(key, version)
+        if name is None:
+            missing[key] = version
+        else:
+            names[key] = name
+    if missing:
+        conn, cur = db_connect(dict_cursor=False)
+        try:
+            cur.execute(sql.format(placeholders=', '.join(['%s'] * len(missing))), list(missing))
+            for key, name in cur.fetchall():
+                cache.put(key, name, missing.get(key))
+                names[key] = name
+        finally:
+            conn.close()
+    return names
+
+
+def get_dish_names(dids) -> dict:
+    """did -> dish name (unknown dids are absent)."""
+    return _lookup_names(_dish_name_cache, 'SELECT did, name FROM dish WHERE did IN ({placeholders})', dids)
+
+
+def get_thread_titles(thids) -> dict:
+    """thid -> thread description (deleted threads are absent)."""
+    return _lookup_names(
+        _thread_title_cache,
+        '''
+        SELECT t.thid, p.description
+        FROM threads t
+        JOIN post p ON t.postid = p.postid
+        WHERE t.thid IN ({placeholders})
+        ''',
+        thids,
+        versions=thread_versions,
+    )
+
+
+# ------------------------------------------------------------------------------------
+# Optional write-behind mode (group commit)
+# ------------------------------------------------------------------------------------
+_FEAST_WRITE = WriteSpec(
+    'notification',
+    'INSERT INTO notification (time, location, freefood, owner, created_at, starts_at, ends_at) VALUES',
+    '(%s, %s, %s, %s, %s, %s, %s)',
+    on_commit=lambda p: _after_feast_insert(p.rowid, p.params),
+)
+_MESSAGE_WRITE = WriteSpec(
+    'messages',
+    'INSERT INTO messages (replyto, sender, content, parentthread, sent_at) VALUES',
+    '(%s, %s, %s, %s, NOW())',
+    on_commit=lambda p: _after_message_insert(p.rowid, p.params, p.context),
+)
+_COMMENT_WRITE = WriteSpec(
+    'comments',
+    'INSERT INTO comments (dish, owner, type, comment) VALUES',
+    '(%s, %s, %s, %s)',
+    on_commit=lambda p: _after_comment_insert(p.params),
+    after_insert=lambda cur, params_list: _add_comment_stats(cur, params_list),
+)
+
+# None = every write commits on its own connection (default)
+_write_queue = None
+
+
+def enable_write_behind(maxsize: int = 1000, max_batch: int = 100, max_delay: float = 0.005):
+    """
+    Route add_dish_comment / insert_message / insert_feast_notification through a
+    bounded group-commit queue (see wfresh_writeq.GroupCommitQueue).
+    """
+    global _write_queue
+
+    def connect():
+        conn, _ = db_connect(dict_cursor=False)
+        return conn
+
+    _write_queue = GroupCommitQueue(connect, maxsize=maxsize, max_batch=max_batch, max_delay=max_delay)
+    return _write_queue
+
+
+def _submit_write(spec: WriteSpec, params: tuple, context=None):
+    """
+    Queue a write if write-behind mode is on.
+
+    Returns:
+        PendingWrite, or None if the caller should write synchronously (mode off,
+        or the queue is saturated - the request thread then absorbs the cost itself)
+    """
+    if _write_queue is None:
+        return None
+    try:
+        return _write_queue.submit(spec, params, context=context)
+    except WriteQueueFull:
+        return None
+
+
+def write_queue_stats():
+    """Queue depth / batch-size metrics, or None when write-behind is off."""
+    return None if _write_queue is None else _write_queue.stats()
+
+
+# Per-function timing + SQL attribution for /metrics (see wfresh_metrics.py).
+# Must stay last so every helper above is wrapped.
+metrics.instrument_functions(globals(), __name__,
+                             exclude=('db_connect', 'avi_params', 'parse_menu_items', 'menu_json_default',
+                                      'week_dish_ids', 'dish_stats_token'))
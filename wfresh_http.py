@@ -0,0 +1,196 @@
+"""
+wfresh_http.py
+
+HTTP-level response optimizations shared by all routes.
+
+Contains:
+1) CompressionMiddleware: WSGI middleware that gzips large text responses
+   (size threshold, streaming-friendly, leaves already-encoded responses alone)
+2) conditional: view decorator that lets a route declare a cheap validator
+   (thread version, comment counts, menu cache version, ...). When the client's
+   ETag still matches, the view is not called at all and a 304 is returned.
+"""
+
+import functools
+import hashlib
+import zlib
+
+from flask import current_app, make_response, request, session
+from werkzeug.http import parse_accept_header
+
+# Content types worth compressing (images/video are compressed already)
+COMPRESSIBLE_TYPES = {
+    'text/html', 'text/plain', 'text/css', 'text/javascript', 'text/xml',
+    'application/json', 'application/javascript', 'application/xml', 'image/svg+xml',
+}
+
+
+# ------------------------------------------------------------------------------------
+# Compression
+# ------------------------------------------------------------------------------------
+class CompressionMiddleware:
+    """
+    gzip text responses of at least min_size bytes for clients that accept it.
+
+    - Responses with a Content-Encoding (precompressed static files, /api/menu),
+      non-200 statuses, HEAD requests, Cache-Control: no-transform and
+      text/event-stream (SSE must not be buffered) pass through untouched
+    - Bodies without a Content-Length are buffered only until min_size bytes
+      have arrived; after that every upstream chunk is compressed and flushed
+      immediately, so streamed pages keep streaming
+    - A strong ETag is weakened on the compressed variant (as nginx does), so it
+      never names two different byte sequences
+
+    Usage:
+        app.wsgi_app = CompressionMiddleware(app.wsgi_app)
+    """
+
+    def __init__(self, app, min_size: int = 1024, level: int = 6):
+        self.app = app
+        self.min_size = min_size
+        self.level = level
+
+    def __call__(self, environ, start_response):
+        accepted = parse_accept_header(environ.get('HTTP_ACCEPT_ENCODING', ''))
+        if environ.get('REQUEST_METHOD') == 'HEAD' or not accepted['gzip']:
+            return self.app(environ, start_response)
+
+        captured = []
+        buffered_writes = []
+
+        def capture(status, headers, exc_info=None):
+            captured[:] = [status, headers, exc_info]
+            return buffered_writes.append  # legacy write() callable
+
+        body = self.app(environ, capture)
+        return self._respond(body, captured, buffered_writes, start_response)
+
+    def _should_compress(self, status: str, headers) -> bool:
+        if not status.startswith('200'):
+            return False
+        content_type = ''
+        for name, value in headers:
+            lname = name.lower()
+            if lname == 'content-encoding':
+                return False
+            if lname == 'cache-control' and 'no-transform' in value.lower():
+                return False
+            if lname == 'content-length' and value.isdigit() and int(value) < self.min_size:
+                return False
+            if lname == 'content-type':
+                content_type = value.split(';', 1)[0].strip().lower()
+        return content_type in COMPRESSIBLE_TYPES
+
+    def _respond(self, body, captured, buffered_writes, start_response):
+        try:
+            chunks = iter(body)
+
+            # start_response is usually called before the first chunk, but a
+            # generator-based app may only call it while producing that chunk.
+            first = [] if captured else [next(chunks, b'')]
+            status, headers, exc_info = captured
+            pending = buffered_writes + first
+
+            if not self._should_compress(status, headers):
+                start_response(status, headers, exc_info)
+                yield from pending
+                yield from chunks
+                return
+
+            # Buffer up to min_size before committing to compression.
+            size = sum(len(c) for c in pending)
+            exhausted = False
+            while size < self.min_size:
+                chunk = next(chunks, None)
+                if chunk is None:
+                    exhausted = True
+                    break
+                pending.append(chunk)
+                size += len(chunk)
+
+            if exhausted:
+                start_response(status, headers, exc_info)
+                yield b''.join(pending)
+                return
+
+            start_response(status, self._compressed_headers(headers), exc_info)
+            compressor = zlib.compressobj(self.level, zlib.DEFLATED, 31)  # 31 = gzip container
+            yield compressor.compress(b''.join(pending)) + compressor.flush(zlib.Z_SYNC_FLUSH)
+            for chunk in chunks:
+                if chunk:
+                    yield compressor.compress(chunk) + compressor.flush(zlib.Z_SYNC_FLUSH)
+            yield compressor.flush()
+        finally:
+            if hasattr(body, 'close'):
+                body.close()
+
+    @staticmethod
+    def _compressed_headers(headers):
+        out = []
+        vary = None
+        for name, value in headers:
+            lname = name.lower()
+            if lname == 'content-length':
+                continue
+            if lname == 'etag' and not value.startswith('W/'):
+                value = 'W/' + value
+            if lname == 'vary':
+                vary = value
+                continue
+            out.append((name, value))
+        if vary is None:
+            vary = 'Accept-Encoding'
+        elif 'accept-encoding' not in vary.lower():
+            vary += ', Accept-Encoding'
+        out.append(('Vary', vary))
+        out.append(('Content-Encoding', 'gzip'))
+        return out
+
+
+# ------------------------------------------------------------------------------------
+# Conditional GET
+# ------------------------------------------------------------------------------------
+def conditional(validator):
+    """
+    Decorate a view with a cheap validator so unchanged pages return 304.
+
+    validator(*view_args, **view_kwargs) returns a repr()-able token that changes
+    whenever the rendered page would (or None to skip validation for this
+    request). The ETag also covers the endpoint, query string, the viewer's uid
+    (pages show owner-only controls) and app.config['ETAG_SALT'] (e.g. the
+    static asset manifest, so a deploy with new CSS invalidates old pages).
+
+    Only GET requests without pending flash messages are validated.
+    """
+    def decorator(view):
+        @functools.wraps(view)
+        def wrapped(*args, **kwargs):
+            if request.method != 'GET' or '_flashes' in session:
+                return view(*args, **kwargs)
+
+            token = validator(*args, **kwargs)
+            if token is None:
+                return view(*args, **kwargs)
+
+            parts = (
+                request.endpoint, request.query_string, session.get('uid'),
+                current_app.config.get('ETAG_SALT'), token,
+            )
+            etag = hashlib.sha1(repr(parts).encode()).hexdigest()[:20]
+
+            # Weak comparison: the compression middleware weakens the ETag it sends.
+            if request.if_none_match.contains_weak(etag):
+                resp = current_app.response_class(status=304)
+            else:
+                resp = make_response(view(*args, **kwargs))
+                if resp.status_code != 200:
+                    return resp
+
+            resp.set_etag(etag)
+            resp.cache_control.private = True
+            resp.cache_control.no_cache = True  # always revalidate
+            resp.vary.add('Cookie')
+            return resp
+
+        return wrapped
+    return decorator
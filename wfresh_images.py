@@ -0,0 +1,212 @@
+"""
+wfresh_images.py
+
+Background image pipeline for dish picture uploads.
+
+Contains:
+1) validate_image: cheap header/integrity check run on the request thread
+2) make_variants: metadata-free, resized thumbnail + display copies (WebP, or
+   JPEG when Pillow lacks WebP support)
+3) schedule_variants: runs make_variants on a small background pool and
+   records the variant filenames in dish_picture
+4) is_variant_filename: which stored files are safe to serve publicly
+5) A backfill command for pictures uploaded before the pipeline existed:
+       python wfresh_images.py backfill
+
+Originals are kept on disk as uploaded (EXIF/GPS included) and, when Pillow is
+available, never served: pages show only the variants. Pillow is optional:
+without it uploads are accepted as before (extension check only) and the
+gallery keeps serving the originals.
+"""
+
+import os
+import sys
+import threading
+import logging
+from concurrent.futures import ThreadPoolExecutor
+
+try:
+    from PIL import Image, ImageOps, features
+except ImportError:  # pragma: no cover - optional dependency
+    Image = None
+
+log = logging.getLogger(__name__)
+
+# Longest edge (px) for each variant. Gallery cells are ~200-320 CSS px wide,
+# so the thumbnail covers 2x displays; "display" is for the full-size view.
+VARIANT_SIZES = {
+    'thumb': 400,
+    'display': 1280,
+}
+WEBP_QUALITY = 80
+JPEG_QUALITY = 82
+
+# Reject decompression bombs before decoding (~50 megapixels)
+MAX_PIXELS = 50_000_000
+
+ALLOWED_FORMATS = {'PNG', 'JPEG', 'GIF', 'WEBP'}
+
+_pool = None
+_pool_pid = None
+_pool_lock = threading.Lock()
+
+
+def available() -> bool:
+    """True if Pillow is installed (otherwise the pipeline is a no-op)."""
+    return Image is not None
+
+
+def _variant_ext() -> str:
+    return 'webp' if features.check('webp') else 'jpg'
+
+
+def variant_filename(filename: str, variant: str) -> str:
+    """
+    Name of a variant file, derived from the original's name.
+
+    'dish12_tofu.png' -> 'dish12_tofu.thumb.webp'
+    """
+    stem = filename.rsplit('.', 1)[0]
+    return f'{stem}.{variant}.{_variant_ext() if available() else "webp"}'
+
+
+def all_variant_filenames(filename: str) -> list[str]:
+    """Every variant name make_variants could have produced for filename (for deletion)."""
+    stem = filename.rsplit('.', 1)[0]
+    return [f'{stem}.{variant}.{ext}' for variant in VARIANT_SIZES for ext in ('webp', 'jpg')]
+
+
+def is_variant_filename(filename: str) -> bool:
+    """True if filename names a variant (as made by variant_filename), not an original."""
+    parts = filename.rsplit('.', 2)
+    return len(parts) == 3 and parts[1] in VARIANT_SIZES and parts[2] in ('webp', 'jpg')
+
+
+def validate_image(path: str) -> bool:
+    """
+    Check that path really is an image we accept (not just a renamed file).
+
+    Only reads headers and verifies the file structure; no full decode.
+    """
+    if Image is None:
+        return True
+    try:
+        with Image.open(path) as im:
+            if im.format not in ALLOWED_FORMATS:
+                return False
+            if im.width * im.height > MAX_PIXELS:
+                return False
+            im.verify()
+        return True
+    except Exception:
+        return False
+
+
+def make_variants(upload_folder: str, filename: str) -> dict:
+    """
+    Write resized, metadata-free variants of upload_folder/filename.
+
+    - EXIF orientation is applied, then all metadata (EXIF/GPS, ICC, text chunks)
+      is dropped by re-encoding only the pixels
+    - Variants never upscale
+
+    Returns:
+        {'thumb': <filename>, 'display': <filename>}
+    """
+    src = os.path.join(upload_folder, filename)
+    ext = _variant_ext()
+    out = {variant: variant_filename(filename, variant) for variant in VARIANT_SIZES}
+
+    # Deduplicated uploads share variants with the first copy.
+    if all(os.path.exists(os.path.join(upload_folder, name)) for name in out.values()):
+        return out
+
+    with Image.open(src) as im:
+        im.seek(0)  # first frame of animated GIFs
+        im = ImageOps.exif_transpose(im)
+        has_alpha = im.mode in ('RGBA', 'LA') or (im.mode == 'P' and 'transparency' in im.info)
+        im = im.convert('RGBA' if has_alpha and ext == 'webp' else 'RGB')
+
+        for variant, size in VARIANT_SIZES.items():
+            copy = im.copy()
+            copy.thumbnail((size, size), Image.LANCZOS)
+            name = out[variant]
+            tmp = os.path.join(upload_folder, f'{name}.{os.getpid()}.{threading.get_ident()}.tmp')
+            if ext == 'webp':
+                copy.save(tmp, 'WEBP', quality=WEBP_QUALITY, method=4)
+            else:
+                copy.save(tmp, 'JPEG', quality=JPEG_QUALITY, optimize=True, progressive=True)
+            os.replace(tmp, os.path.join(upload_folder, name))
+
+    return out
+
+
+# ------------------------------------------------------------------------------------
+# Background processing
+# ------------------------------------------------------------------------------------
+def _get_pool() -> ThreadPoolExecutor:
+    """Lazily create the worker pool, once per process (fork-safe)."""
+    global _pool, _pool_pid
+    if _pool_pid != os.getpid():
+        with _pool_lock:
+            if _pool_pid != os.getpid():
+                # Pillow releases the GIL while resizing/encoding, so threads suffice.
+                _pool = ThreadPoolExecutor(max_workers=2, thread_name_prefix='image-variants')
+                _pool_pid = os.getpid()
+    return _pool
+
+
+def _process(upload_folder: str, pid: int, filename: str):
+    import wfresh_helper
+    import wfresh_uploads
+
+    try:
+        variants = make_variants(upload_folder, filename)
+    except FileNotFoundError:
+        return None
+    except Exception:
+        log.exception('could not make variants for %s', filename)
+        return None
+
+    if not wfresh_helper.set_dish_picture_variants(pid, variants['thumb'], variants['display']):
+        # The picture was deleted while we worked. Its delete may have run before
+        # the variants existed, so remove them unless a deduplicated copy still
+        # uses the same original.
+        if not wfresh_helper.find_referenced_uploads([filename]):
+            wfresh_uploads.delete_stored(upload_folder, [filename] + all_variant_filenames(filename))
+        return None
+    return variants
+
+
+def schedule_variants(upload_folder: str, pid: int, filename: str):
+    """
+    Queue variant generation for a newly inserted dish_picture row.
+
+    Returns:
+        a Future (or None if Pillow is not installed)
+    """
+    if Image is None:
+        return None
+    return _get_pool().submit(_process, upload_folder, pid, filename)
+
+
+def backfill(upload_folder: str) -> int:
+    """Generate variants for every picture row that has none yet (synchronously)."""
+    import wfresh_helper
+
+    done = 0
+    for pid, filename in wfresh_helper.get_pictures_without_variants():
+        if _process(upload_folder, pid, filename):
+            done += 1
+    return done
+
+
+if __name__ == '__main__':
+    if len(sys.argv) != 2 or sys.argv[1] != 'backfill':
+        print('usage: python wfresh_images.py backfill')
+        sys.exit(2)
+    if not available():
+        print('Pillow is not installed')
+        sys.exit(1)
+    folder = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'static', 'uploads')
+    print(f'processed {backfill(folder)} pictures')
@@ -0,0 +1,595 @@
+"""
+wfresh_metrics.py
+
+Low-overhead in-process metrics with Prometheus text exposition.
+
+Contains:
+1) Counter / Gauge / Histogram: label-keyed values behind one lock each
+   (recording is a dict lookup + bisect, no allocation on the hot path)
+2) Instrumentation for DB access: InstrumentedConnection / InstrumentedCursor
+   count connections, queries, rows and query time per calling wfresh_helper
+   function (see instrument_functions)
+3) Per-worker aggregation: with WFRESH_METRICS_DIR set, every process writes a
+   snapshot of its metrics there every few seconds, and render() sums all
+   snapshots so any worker's /metrics shows the whole server. Counters and
+   histograms of exited workers are folded into one retired.json (under a file
+   lock) and their snapshots deleted, so recycled workers neither pile up
+   files nor make totals go down
+
+Without WFRESH_METRICS_DIR only the current process is reported.
+"""
+
+import atexit
+import bisect
+import fcntl
+import functools
+import inspect
+import json
+import os
+import threading
+import time
+
+DEFAULT_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+# Snapshot directory shared by all workers (None = single-process reporting)
+METRICS_DIR = os.environ.get('WFRESH_METRICS_DIR') or None
+SNAPSHOT_INTERVAL = 5.0
+
+
+# ------------------------------------------------------------------------------------
+# Metric types
+# ------------------------------------------------------------------------------------
+class _Registry:
+    def __init__(self):
+        self.metrics = {}
+
+    def register(self, metric):
+        if metric.name in self.metrics:
+            raise ValueError(f'duplicate metric {metric.name}')
+        self.metrics[metric.name] = metric
+
+    def reset(self):
+        for metric in self.metrics.values():
+            metric.reset()
+
+
+REGISTRY = _Registry()
+
+
+class _Metric:
+    type = None
+
+    def __init__(self, name: str, help: str, labelnames=()):
+        self.name = name
+        self.help = help
+        self.labelnames = tuple(labelnames)
+        self._values = {}
+        self._lock = threading.Lock()
+        REGISTRY.register(self)
+
+    def reset(self):
+        with self._lock:
+            self._values.clear()
+
+    def snapshot(self) -> list:
+        """[[labels, value], ...] (JSON-friendly copy)."""
+        with self._lock:
+            return [[list(labels), self._copy(value)] for labels, value in self._values.items()]
+
+    @staticmethod
+    def _copy(value):
+        return value
+
+
+class Counter(_Metric):
+    """Monotonic total, e.g. Counter('x_total', '...', ['endpoint']).inc('index')."""
+
+    type = 'counter'
+
+    def inc(self, *labels, amount: float = 1.0):
+        with self._lock:
+            self._values[labels] = self._values.get(labels, 0.0) + amount
+
+
+class Gauge(_Metric):
+    """Value that goes up and down (e.g. open connections)."""
+
+    type = 'gauge'
+
+    def inc(self, *labels, amount: float = 1.0):
+        with self._lock:
+            self._values[labels] = self._values.get(labels, 0.0) + amount
+
+    def dec(self, *labels, amount: float = 1.0):
+        self.inc(*labels, amount=-amount)
+
+    def set(self, value: float, *labels):
+        with self._lock:
+            self._values[labels] = float(value)
+
+
+class Histogram(_Metric):
+    """
+    Cumulative-bucket histogram.
+
+    Stored per label set as [per-bucket counts (non-cumulative, last = +Inf), sum].
+    """
+
+    type = 'histogram'
+
+    def __init__(self, name: str, help: str, labelnames=(), buckets=DEFAULT_BUCKETS):
+        super().__init__(name, help, labelnames)
+        self.buckets = tuple(sorted(buckets))
+
+    def observe(self, value: float, *labels):
+        i = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            entry = self._values.get(labels)
+            if entry is None:
+                entry = self._values[labels] = [[0] * (len(self.buckets) + 1), 0.0]
+            entry[0][i] += 1
+            entry[1] += value
+
+    def time(self, *labels):
+        """Context manager observing the elapsed wall time of its block."""
+        return _Timer(self, labels)
+
+    @staticmethod
+    def _copy(value):
+        return [list(value[0]), value[1]]
+
+
+class _Timer:
+    __slots__ = ('histogram', 'labels', 'start')
+
+    def __init__(self, histogram, labels):
+        self.histogram = histogram
+        self.labels = labels
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc):
+        self.histogram.observe(time.perf_counter() - self.start, *self.labels)
+
+
+# ------------------------------------------------------------------------------------
+# Metrics recorded by the app
+# ------------------------------------------------------------------------------------
+REQUEST_SECONDS = Histogram(
+    'wfresh_http_request_duration_seconds', 'Time to produce a response, by Flask endpoint.',
+    ['endpoint', 'method', 'status'])
+TEMPLATE_SECONDS = Histogram(
+    'wfresh_template_render_seconds', 'Jinja template render time.', ['template'])
+
+HELPER_SECONDS = Histogram(
+    'wfresh_helper_duration_seconds', 'Wall time of wfresh_helper functions.', ['function'])
+DB_QUERY_SECONDS = Histogram(
+    'wfresh_db_query_duration_seconds', 'SQL execute() time, by calling wfresh_helper function.',
+    ['function'])
+DB_ROWS = Counter(
+    'wfresh_db_rows_fetched_total', 'Rows fetched, by calling wfresh_helper function.', ['function'])
+DB_CONNECT_SECONDS = Histogram(
+    'wfresh_db_connect_duration_seconds', 'Time to open a DB connection.')
+DB_CONNECTIONS = Counter(
+    'wfresh_db_connections_opened_total', 'DB connections opened.')
+DB_CONNECTIONS_OPEN = Gauge(
+    'wfresh_db_connections_open', 'DB connections currently open.')
+
+AVI_SECONDS = Histogram(
+    'wfresh_avi_request_duration_seconds', 'AVI menu API call latency.', ['status'],
+    buckets=(0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0))
+MENU_CACHE = Counter(
+    'wfresh_menu_cache_lookups_total', 'Menu cache file lookups.', ['result'])
+
+
+# ------------------------------------------------------------------------------------
+# DB / helper instrumentation
+# ------------------------------------------------------------------------------------
+_local = threading.local()
+
+
+def _current_function() -> str:
+    stack = getattr(_local, 'stack', None)
+    return stack[-1] if stack else 'other'
+
+
+def instrument_functions(namespace: dict, module_name: str, exclude=()):
+    """
+    Wrap every public function defined in module_name (found in namespace, i.e.
+    the module's globals()) so its wall time is recorded and the SQL it runs is
+    attributed to it. Call once at the end of the module.
+    """
+    for name, fn in list(namespace.items()):
+        if (name.startswith('_') or name in exclude or not inspect.isfunction(fn)
+                or fn.__module__ != module_name):
+            continue
+        namespace[name] = _instrumented(fn)
+
+
+def _instrumented(fn):
+    name = fn.__name__
+
+    @functools.wraps(fn)
+    def wrapper(*args, **kwargs):
+        stack = getattr(_local, 'stack', None)
+        if stack is None:
+            stack = _local.stack = []
+        stack.append(name)
+        start = time.perf_counter()
+        try:
+            return fn(*args, **kwargs)
+        finally:
+            HELPER_SECONDS.observe(time.perf_counter() - start, name)
+            stack.pop()
+
+    return wrapper
+
+
+# Queries slower than this (seconds) are passed to slow_query_hook(query, args,
+# seconds, function, many) - see wfresh_profiling.SlowQueryLog. None disables.
+SLOW_QUERY_SECONDS = None
+slow_query_hook = None
+
+
+def _observe_query(query, args, elapsed: float, many: bool):
+    observe_query(_current_function(), query, args, elapsed, many)
+
+
+def observe_query(function: str, query, args, elapsed: float, many: bool = False):
+    """Record one query run on behalf of function (also used by the async driver in wfresh_async)."""
+    DB_QUERY_SECONDS.observe(elapsed, function)
+    if SLOW_QUERY_SECONDS is not None and elapsed >= SLOW_QUERY_SECONDS and slow_query_hook is not None:
+        slow_query_hook(query, args, elapsed, function, many)
+
+
+class InstrumentedCursor:
+    """Cursor proxy recording execute() time and fetched rows."""
+
+    __slots__ = ('_cur',)
+
+    def __init__(self, cur):
+        self._cur = cur
+
+    def execute(self, query, args=None):
+        start = time.perf_counter()
+        try:
+            return self._cur.execute(query, args)
+        finally:
+            _observe_query(query, args, time.perf_counter() - start, False)
+
+    def executemany(self, query, args):
+        start = time.perf_counter()
+        try:
+            return self._cur.executemany(query, args)
+        finally:
+            _observe_query(query, args, time.perf_counter() - start, True)
+
+    def fetchone(self):
+        row = self._cur.fetchone()
+        if row is not None:
+            DB_ROWS.inc(_current_function())
+        return row
+
+    def fetchmany(self, size=None):
+        rows = self._cur.fetchmany(size) if size is not None else self._cur.fetchmany()
+        DB_ROWS.inc(_current_function(), amount=len(rows))
+        return rows
+
+    def fetchall(self):
+        rows = self._cur.fetchall()
+        DB_ROWS.inc(_current_function(), amount=len(rows))
+        return rows
+
+    def __iter__(self):
+        return iter(self._cur)
+
+    def __getattr__(self, name):
+        return getattr(self._cur, name)
+
+
+class InstrumentedConnection:
+    """Connection proxy tracking open connections; its cursors are instrumented."""
+
+    __slots__ = ('_conn', '_open')
+
+    def __init__(self, conn):
+        self._conn = conn
+        self._open = True
+        DB_CONNECTIONS.inc()
+        DB_CONNECTIONS_OPEN.inc()
+
+    def cursor(self, *args, **kwargs):
+        return InstrumentedCursor(self._conn.cursor(*args, **kwargs))
+
+    def close(self):
+        if self._open:
+            self._open = False
+            DB_CONNECTIONS_OPEN.dec()
+        return self._conn.close()
+
+    def __getattr__(self, name):
+        return getattr(self._conn, name)
+
+
+def instrumented_connect(connect):
+    """Call connect() (timed) and wrap the connection."""
+    with DB_CONNECT_SECONDS.time():
+        conn = connect()
+    return InstrumentedConnection(conn)
+
+
+# ------------------------------------------------------------------------------------
+# Per-worker snapshots
+# ------------------------------------------------------------------------------------
+_exporter_pid = None
+_exporter_lock = threading.Lock()
+_snapshot_name = None  # '<pid>-<start ms>.json': a reused pid never overwrites a dead worker's file
+
+# Accumulated counters/histograms of exited workers, and the lock guarding it
+RETIRED_FILE = 'retired.json'
+LOCK_FILE = '.lock'
+
+
+def snapshot() -> dict:
+    """This process's metrics as a JSON-friendly dict."""
+    return {name: metric.snapshot() for name, metric in REGISTRY.metrics.items()}
+
+
+def _write_json(path: str, data):
+    tmp = f'{path}.{os.getpid()}.tmp'
+    with open(tmp, 'w') as f:
+        json.dump(data, f)
+    os.replace(tmp, path)
+
+
+def _write_snapshot():
+    try:
+        _write_json(os.path.join(METRICS_DIR, _snapshot_name),
+                    {'pid': os.getpid(), 'time': time.time(), 'metrics': snapshot()})
+    except OSError:
+        pass
+
+
+def _export_loop():
+    while True:
+        time.sleep(SNAPSHOT_INTERVAL)
+        _write_snapshot()
+
+
+def ensure_exporter():
+    """
+    Start this process's snapshot writer (once per pid; cheap to call per request).
+
+    A forked child starts from zero: values inherited from the parent stay in
+    the parent's own snapshot and would otherwise be counted twice.
+    """
+    global _exporter_pid, _snapshot_name
+    if METRICS_DIR is None or _exporter_pid == os.getpid():
+        return
+    with _exporter_lock:
+        if _exporter_pid == os.getpid():
+            return
+        if _exporter_pid is not None:
+            REGISTRY.reset()
+        _exporter_pid = os.getpid()
+        _snapshot_name = f'{os.getpid()}-{int(time.time() * 1000)}.json'
+        os.makedirs(METRICS_DIR, exist_ok=True)
+        threading.Thread(target=_export_loop, name='metrics-export', daemon=True).start()
+        atexit.register(_write_snapshot)
+
+
+def _pid_alive(pid: int) -> bool:
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        return True
+    return True
+
+
+def _merge(totals: dict, source: dict, monotonic_only: bool = False):
+    """Add a snapshot-format dict into totals (name -> {labels tuple: value})."""
+    for name, samples in source.items():
+        metric = REGISTRY.metrics.get(name)
+        if metric is None or (monotonic_only and metric.type == 'gauge'):
+            continue
+        merged = totals.setdefault(name, {})
+        for labels, value in samples:
+            key = tuple(labels)
+            if metric.type == 'histogram':
+                entry = merged.get(key)
+                if entry is None or len(entry[0]) != len(value[0]):
+                    merged[key] = [list(value[0]), value[1]]
+                else:
+                    entry[0] = [a + b for a, b in zip(entry[0], value[0])]
+                    entry[1] += value[1]
+            else:
+                merged[key] = merged.get(key, 0.0) + value
+
+
+def _to_snapshot(totals: dict) -> dict:
+    """Inverse of _merge: totals back to the snapshot() format."""
+    return {name: [[list(labels), value] for labels, value in samples.items()]
+            for name, samples in totals.items()}
+
+
+def _read_json(path: str):
+    try:
+        with open(path) as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return None
+
+
+def _snapshot_start(fname: str) -> int:
+    """Start time (ms) encoded in a '<pid>-<start ms>.json' name (0 if absent)."""
+    try:
+        return int(fname[:-len('.json')].split('-', 1)[1])
+    except (IndexError, ValueError):
+        return 0
+
+
+def _read_snapshots() -> list:
+    """[(file name, snapshot)] for every worker snapshot in METRICS_DIR."""
+    try:
+        names = os.listdir(METRICS_DIR)
+    except OSError:
+        return []
+    out = []
+    for fname in names:
+        if not fname.endswith('.json') or fname == RETIRED_FILE:
+            continue
+        data = _read_json(os.path.join(METRICS_DIR, fname))
+        if data is not None:
+            out.append((fname, data))
+    return out
+
+
+def _dead_snapshots(snapshots: list) -> set:
+    """Names of exited workers' snapshots: the pid is gone, or a later worker reuses it."""
+    newest = {}
+    for fname, data in snapshots:
+        pid = data.get('pid', 0)
+        newest[pid] = max(newest.get(pid, 0), _snapshot_start(fname))
+    dead = set()
+    for fname, data in snapshots:
+        if fname == _snapshot_name:
+            continue
+        pid = data.get('pid', 0)
+        if pid == os.getpid() or not _pid_alive(pid) or _snapshot_start(fname) < newest[pid]:
+            dead.add(fname)
+    return dead
+
+
+def _collect_dir(totals: dict):
+    """
+    Add every other worker's snapshot to totals, first folding exited workers'
+    counters/histograms into RETIRED_FILE and deleting their snapshots.
+
+    Runs under an exclusive lock on LOCK_FILE, so concurrent scrapes never
+    fold a file twice or see one both folded and on its own. "folded" in
+    RETIRED_FILE covers a pass that died between writing it and deleting.
+    """
+    retired_path = os.path.join(METRICS_DIR, RETIRED_FILE)
+    retired = _read_json(retired_path) or {'metrics': {}, 'folded': []}
+    folded = set(retired['folded'])
+    snapshots = [(fname, data) for fname, data in _read_snapshots() if fname not in folded]
+    dead = _dead_snapshots(snapshots)
+
+    metrics = retired['metrics']
+    if dead:
+        merged = {}
+        _merge(merged, metrics)
+        for fname, data in snapshots:
+            if fname in dead:
+                _merge(merged, data.get('metrics', {}), monotonic_only=True)
+        metrics = _to_snapshot(merged)
+        folded |= dead
+        _write_json(retired_path, {'metrics': metrics, 'folded': sorted(folded)})
+    if folded:
+        for fname in folded:
+            try:
+                os.remove(os.path.join(METRICS_DIR, fname))
+            except FileNotFoundError:
+                pass
+        _write_json(retired_path, {'metrics': metrics, 'folded': []})
+
+    _merge(totals, metrics)
+    for fname, data in snapshots:
+        if fname not in dead and fname != _snapshot_name:
+            _merge(totals, data.get('metrics', {}))
+
+
+def _collect() -> dict:
+    """name -> {labels tuple: value} summed over every worker's snapshot."""
+    totals = {}
+    _merge(totals, snapshot())
+    if METRICS_DIR is None:
+        return totals
+    try:
+        with open(os.path.join(METRICS_DIR, LOCK_FILE), 'a') as lock:
+            fcntl.flock(lock, fcntl.LOCK_EX)
+            _collect_dir(totals)
+    except OSError:
+        pass
+    return totals
+
+
+# ------------------------------------------------------------------------------------
+# Prometheus text format
+# ------------------------------------------------------------------------------------
+def _escape(value) -> str:
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+def _labels(names, values, extra=None) -> str:
+    pairs = [f'{n}="{_escape(v)}"' for n, v in zip(names, values)]
+    if extra is not None:
+        pairs.append(f'{extra[0]}="{extra[1]}"')
+    return '{' + ','.join(pairs) + '}' if pairs else ''
+
+
+def _num(value: float) -> str:
+    return repr(float(value)) if value != int(value) else str(int(value))
+
+
+def render() -> str:
+    """All metrics (summed over workers) in Prometheus text exposition format 0.0.4."""
+    totals = _collect()
+    lines = []
+    for name, metric in REGISTRY.metrics.items():
+        lines.append(f'# HELP {name} {metric.help}')
+        lines.append(f'# TYPE {name} {metric.type}')
+        for labels, value in sorted(totals.get(name, {}).items()):
+            if metric.type != 'histogram':
+                lines.append(f'{name}{_labels(metric.labelnames, labels)} {_num(value)}')
+                continue
+            counts, total = value
+            cumulative = 0
+            for bound, count in zip(metric.buckets + (float('inf'),), counts):
+                cumulative += count
+                le = '+Inf' if bound == float('inf') else repr(bound)
+                lines.append(f'{name}_bucket{_labels(metric.labelnames, labels, ("le", le))} {cumulative}')
+            lines.append(f'{name}_sum{_labels(metric.labelnames, labels)} {_num(total)}')
+            lines.append(f'{name}_count{_labels(metric.labelnames, labels)} {cumulative}')
+    return '\n'.join(lines) + '\n'
+
+
+# ------------------------------------------------------------------------------------
+# Flask wiring
+# ------------------------------------------------------------------------------------
+def init_app(app):
+    """Time every request and template render of app."""
+    from flask import before_render_template, g, request, template_rendered
+
+    @app.before_request
+    def _start_timer():
+        ensure_exporter()
+        g._metrics_start = time.perf_counter()
+
+    @app.after_request
+    def _observe_request(response):
+        start = g.pop('_metrics_start', None)
+        if start is not None:
+            REQUEST_SECONDS.observe(
+                time.perf_counter() - start,
+                request.endpoint or 'unmatched', request.method, str(response.status_code)
+            )
+        return response
+
+    def _before_render(sender, template, context, **extra):
+        stack = getattr(_local, 'templates', None)
+        if stack is None:
+            stack = _local.templates = []
+        stack.append(time.perf_counter())
+
+    def _rendered(sender, template, context, **extra):
+        stack = getattr(_local, 'templates', None)
+        if stack:
+            TEMPLATE_SECONDS.observe(time.perf_counter() - stack.pop(), template.name or 'string')
+
+    before_render_template.connect(_before_render, app, weak=False)
+    template_rendered.connect(_rendered, app, weak=False)
@@ -0,0 +1,152 @@
+"""
+wfresh_passwords.py
+
+Password hashing/verification off the request thread.
+
+bcrypt is deliberately slow (~250ms at cost 12), so running it on Flask's request
+threads lets a burst of sign-ups/logins tie up every worker. This module sends
+the work to a small process pool instead:
+
+- The pool is bounded: at most max_workers hashes run at once, and at most
+  max_queue more may wait. Beyond that callers get PasswordPoolBusy immediately
+  instead of piling up; a hash that takes longer than TIMEOUT also raises it.
+- Every server worker process has its own pool, so the default size divides
+  half the CPUs among WFRESH_WORKERS processes (set by gunicorn.conf.py).
+- Children are started by a forkserver (spawn where that is unavailable), never
+  forked from the server process: by the time the pool is created its other
+  threads may hold locks a forked child would inherit locked.
+- The work factor comes from WFRESH_BCRYPT_ROUNDS (default 12); needs_rehash()
+  tells login code when a stored hash was made with a different cost.
+"""
+
+import multiprocessing
+import os
+import threading
+from concurrent.futures import ProcessPoolExecutor, TimeoutError as FutureTimeout
+
+import bcrypt
+
+# bcrypt work factor for new hashes
+BCRYPT_ROUNDS = int(os.environ.get('WFRESH_BCRYPT_ROUNDS', 12))
+
+# Pool sizing: running hashes + hashes allowed to wait. Per server process, so
+# half the CPUs are shared out over the WFRESH_WORKERS processes.
+_SERVER_WORKERS = max(1, int(os.environ.get('WFRESH_WORKERS', 1)))
+MAX_WORKERS = int(os.environ.get('WFRESH_BCRYPT_WORKERS',
+                                 max(1, (os.cpu_count() or 2) // 2 // _SERVER_WORKERS)))
+MAX_QUEUE = int(os.environ.get('WFRESH_BCRYPT_QUEUE', MAX_WORKERS * 4))
+
+# Upper bound on how long a request waits for its hash
+TIMEOUT = 10
+
+
+class PasswordPoolBusy(Exception):
+    """Raised when the hashing pool is saturated; callers should ask the user to retry."""
+
+
+# ------------------------------------------------------------------------------------
+# Work functions (run in the pool's child processes; must be top-level to pickle)
+# ------------------------------------------------------------------------------------
+def _hash(password: bytes, rounds: int) -> bytes:
+    return bcrypt.hashpw(password, bcrypt.gensalt(rounds))
+
+
+def _check(password: bytes, hashed: bytes) -> bool:
+    try:
+        return bcrypt.checkpw(password, hashed)
+    except ValueError:
+        # malformed stored hash (e.g. legacy plaintext rows)
+        return False
+
+
+# ------------------------------------------------------------------------------------
+# Bounded pool
+# ------------------------------------------------------------------------------------
+_lock = threading.Lock()
+_pool = None
+_pool_pid = None
+_in_flight = 0
+_rejected = 0
+
+
+def _mp_context():
+    methods = multiprocessing.get_all_start_methods()
+    return multiprocessing.get_context('forkserver' if 'forkserver' in methods else 'spawn')
+
+
+def _get_pool() -> ProcessPoolExecutor:
+    """Create the pool lazily, once per process (a pool inherited over fork is unusable)."""
+    global _pool, _pool_pid, _in_flight
+    if _pool_pid == os.getpid():
+        return _pool
+    with _lock:
+        if _pool_pid != os.getpid():
+            _pool = ProcessPoolExecutor(max_workers=MAX_WORKERS, mp_context=_mp_context())
+            _pool_pid = os.getpid()
+            _in_flight = 0
+    return _pool
+
+
+def _release(_future):
+    global _in_flight
+    with _lock:
+        _in_flight -= 1
+
+
+def _run(fn, *args):
+    """Run fn in the pool, rejecting immediately if running + waiting work is at the limit."""
+    global _in_flight, _rejected
+    pool = _get_pool()
+    with _lock:
+        if _in_flight >= MAX_WORKERS + MAX_QUEUE:
+            _rejected += 1
+            raise PasswordPoolBusy()
+        _in_flight += 1
+    try:
+        future = pool.submit(fn, *args)
+    except Exception:
+        _release(None)
+        raise
+    future.add_done_callback(_release)
+    try:
+        return future.result(timeout=TIMEOUT)
+    except FutureTimeout:
+        future.cancel()  # still queued: drop it; running: it finishes and is released
+        with _lock:
+            _rejected += 1
+        raise PasswordPoolBusy()
+
+
+def hash_password(password: str, rounds: int = None) -> str:
+    """Return a bcrypt hash of password (as str) at the configured cost."""
+    hashed = _run(_hash, password.encode('utf-8'), rounds or BCRYPT_ROUNDS)
+    return hashed.decode('utf-8')
+
+
+def check_password(password: str, hashed: str) -> bool:
+    """Constant-time check of password against a stored bcrypt hash."""
+    return _run(_check, password.encode('utf-8'), hashed.encode('utf-8'))
+
+
+def needs_rehash(hashed: str, rounds: int = None) -> bool:
+    """
+    True if hashed was made with a different cost than the configured one.
+
+    bcrypt hashes look like $2b$12$<salt+hash>; the second field is the cost.
+    """
+    parts = hashed.split('$')
+    if len(parts) < 4 or not parts[2].isdigit():
+        return True
+    return int(parts[2]) != (rounds or BCRYPT_ROUNDS)
+
+
+def pool_stats() -> dict:
+    """Configured limits, current load and how many requests were turned away."""
+    with _lock:
+        return {
+            'rounds': BCRYPT_ROUNDS,
+            'workers': MAX_WORKERS,
+            'queue': MAX_QUEUE,
+            'in_flight': _in_flight,
+            'rejected': _rejected,
+        }
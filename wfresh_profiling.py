@@ -0,0 +1,290 @@
+"""
+wfresh_profiling.py
+
+Opt-in production profiling: per-request stack sampling and a slow-query log.
+
+Contains:
+1) StackSampler: samples one thread's Python stack every few milliseconds and
+   writes the result in collapsed-stack format ("a;b;c 12" per line), ready for
+   flamegraph.pl / speedscope
+2) SlowQueryLog: receives every query slower than a threshold from the
+   instrumented cursors (wfresh_metrics) and logs its SQL, parameter shape
+   (types/lengths only - never values), duration, helper function and route
+3) init_app: decides per request whether to profile
+
+Settings (environment):
+    WFRESH_PROFILE_RATE     fraction of requests to profile (default 0)
+    WFRESH_PROFILE_SECRET   requests whose X-WFresh-Profile header equals this
+                            are always profiled (unset = header ignored)
+    WFRESH_PROFILE_DIR      where .folded files go (default /tmp/wfresh-profiles)
+    WFRESH_SLOW_QUERY_MS    slow-query threshold in ms (default 250, 0 = off)
+    WFRESH_SLOW_QUERY_LOG   file to append slow queries to (default: logging only)
+"""
+
+import hmac
+import json
+import logging
+import os
+import random
+import re
+import sys
+import threading
+import time
+from collections import Counter
+
+import wfresh_metrics
+
+log = logging.getLogger(__name__)
+slow_log = logging.getLogger('wfresh.slowquery')
+
+PROFILE_RATE = float(os.environ.get('WFRESH_PROFILE_RATE', 0))
+PROFILE_SECRET = os.environ.get('WFRESH_PROFILE_SECRET') or None
+PROFILE_DIR = os.environ.get('WFRESH_PROFILE_DIR', '/tmp/wfresh-profiles')
+PROFILE_HEADER = 'X-WFresh-Profile'
+
+# Sampling period; ~200 samples/second costs a few percent of one core
+SAMPLE_INTERVAL = 0.005
+
+# At most this many requests are profiled at once (per process)
+MAX_CONCURRENT = 4
+
+SLOW_QUERY_MS = float(os.environ.get('WFRESH_SLOW_QUERY_MS', 250))
+SLOW_QUERY_LOG = os.environ.get('WFRESH_SLOW_QUERY_LOG') or None
+
+
+# ------------------------------------------------------------------------------------
+# Stack sampling
+# ------------------------------------------------------------------------------------
+def _frame_label(code) -> str:
+    module = os.path.splitext(os.path.basename(code.co_filename))[0]
+    return f'{module}:{code.co_name}'
+
+
+class StackSampler:
+    """
+    Sample the stack of thread_id from a helper thread until stop() is called.
+
+    Sampling (rather than cProfile) keeps the profiled request close to full
+    speed and also sees time spent blocked in C calls (DB, network).
+    """
+
+    def __init__(self, thread_id: int, interval: float = SAMPLE_INTERVAL):
+        self.thread_id = thread_id
+        self.interval = interval
+        self.stacks = Counter()
+        self.samples = 0
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, name='stack-sampler', daemon=True)
+        self._started = None
+        self.elapsed = 0.0
+
+    def start(self):
+        self._started = time.perf_counter()
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self._stop.set()
+        self._thread.join()
+        self.elapsed = time.perf_counter() - self._started
+        return self
+
+    def _run(self):
+        while not self._stop.wait(self.interval):
+            frame = sys._current_frames().get(self.thread_id)
+            if frame is None:
+                break
+            labels = []
+            while frame is not None:
+                labels.append(_frame_label(frame.f_code))
+                frame = frame.f_back
+            self.stacks[';'.join(reversed(labels))] += 1
+            self.samples += 1
+
+    def collapsed(self, root: str = None) -> str:
+        """Collapsed-stack text; root (e.g. 'GET index') becomes the bottom frame."""
+        prefix = f'{root};' if root else ''
+        return ''.join(f'{prefix}{stack} {count}\n' for stack, count in self.stacks.most_common())
+
+    def write(self, directory: str, name: str, root: str = None) -> str:
+        """Write the profile as <directory>/<name>.folded and return the path."""
+        os.makedirs(directory, exist_ok=True)
+        path = os.path.join(directory, f'{name}.folded')
+        tmp = f'{path}.tmp'
+        with open(tmp, 'w') as f:
+            f.write(self.collapsed(root))
+        os.replace(tmp, path)
+        return path
+
+
+_active = 0
+_active_lock = threading.Lock()
+
+
+def _acquire_slot() -> bool:
+    global _active
+    with _active_lock:
+        if _active >= MAX_CONCURRENT:
+            return False
+        _active += 1
+        return True
+
+
+def _release_slot():
+    global _active
+    with _active_lock:
+        _active -= 1
+
+
+def secret_matches(header_value) -> bool:
+    """True if header_value is the configured profiling secret."""
+    return (PROFILE_SECRET is not None and bool(header_value)
+            and hmac.compare_digest(header_value.encode(), PROFILE_SECRET.encode()))
+
+
+def should_profile(header_value) -> bool:
+    """True if this request asked for a profile with the secret, or won the sampling draw."""
+    if secret_matches(header_value):
+        return True
+    return PROFILE_RATE > 0 and random.random() < PROFILE_RATE
+
+
+# ------------------------------------------------------------------------------------
+# Slow-query log
+# ------------------------------------------------------------------------------------
+_WS_RE = re.compile(r'\s+')
+MAX_SQL_LENGTH = 2000
+
+
+def params_shape(args) -> str:
+    """
+    Describe query parameters without their values, e.g. "(int, str[42], None)".
+
+    Keeps personal data (message text, names) out of the log while still showing
+    e.g. how long an IN list was.
+    """
+    def shape(value):
+        if value is None:
+            return 'None'
+        if isinstance(value, (str, bytes)):
+            return f'{type(value).__name__}[{len(value)}]'
+        if isinstance(value, (list, tuple)):
+            return f'{type(value).__name__}[{len(value)}]'
+        if isinstance(value, dict):
+            return '{' + ', '.join(f'{k}: {shape(v)}' for k, v in value.items()) + '}'
+        return type(value).__name__
+
+    if args is None:
+        return '()'
+    if isinstance(args, dict):
+        return shape(args)
+    if isinstance(args, (list, tuple)):
+        return '(' + ', '.join(shape(v) for v in args) + ')'
+    return shape(args)
+
+
+class SlowQueryLog:
+    """
+    Slow-query hook for wfresh_metrics' instrumented cursors.
+
+    Each slow query becomes one JSON line on the 'wfresh.slowquery' logger (and
+    in SLOW_QUERY_LOG, if set). Failures here never affect the query itself.
+    """
+
+    def __init__(self, threshold_ms: float = SLOW_QUERY_MS, path: str = SLOW_QUERY_LOG):
+        self.threshold_ms = threshold_ms
+        if path and not any(getattr(h, 'baseFilename', None) == os.path.abspath(path)
+                            for h in slow_log.handlers):
+            handler = logging.FileHandler(path)
+            handler.setFormatter(logging.Formatter('%(message)s'))
+            slow_log.addHandler(handler)
+            slow_log.setLevel(logging.INFO)
+        self.count = 0
+
+    def install(self):
+        if self.threshold_ms > 0:
+            wfresh_metrics.SLOW_QUERY_SECONDS = self.threshold_ms / 1000.0
+            wfresh_metrics.slow_query_hook = self
+        return self
+
+    def __call__(self, query, args, seconds: float, function: str, many: bool):
+        try:
+            if many:
+                args = list(args)
+                shape = f'{len(args)} x {params_shape(args[0]) if args else "()"}'
+            else:
+                shape = params_shape(args)
+            sql = _WS_RE.sub(' ', str(query)).strip()[:MAX_SQL_LENGTH]
+            self.count += 1
+            slow_log.warning(json.dumps({
+                'time': time.strftime('%Y-%m-%dT%H:%M:%S'),
+                'ms': round(seconds * 1000, 2),
+                'route': _current_route(),
+                'function': function,
+                'sql': sql,
+                'params': shape,
+                'pid': os.getpid(),
+            }))
+        except Exception:
+            log.exception('slow-query hook failed')
+
+
+def _current_route() -> str:
+    from flask import has_request_context, request
+    if has_request_context():
+        return f'{request.method} {request.endpoint or request.path}'
+    return threading.current_thread().name
+
+
+# ------------------------------------------------------------------------------------
+# Flask wiring
+# ------------------------------------------------------------------------------------
+def _profile_name(endpoint) -> str:
+    stamp = time.strftime('%Y%m%d-%H%M%S')
+    return f'{stamp}-{endpoint or "unmatched"}-{os.getpid()}-{random.getrandbits(24):06x}'
+
+
+def init_app(app):
+    """Install the slow-query log and per-request sampling for app."""
+    from flask import g, request
+
+    SlowQueryLog().install()
+
+    if PROFILE_RATE <= 0 and PROFILE_SECRET is None:
+        return
+
+    @app.before_request
+    def _maybe_start_profile():
+        header = request.headers.get(PROFILE_HEADER)
+        if not should_profile(header):
+            return
+        if not _acquire_slot():
+            return
+        # Only secret holders learn the file name; sampled requests stay silent.
+        g._profile_requested = secret_matches(header)
+        g._profiler = StackSampler(threading.get_ident()).start()
+
+    @app.after_request
+    def _tag_profile(response):
+        # The file is written at teardown; tell secret-header callers its name now.
+        sampler = g.get('_profiler')
+        if sampler is not None:
+            g._profile_name = _profile_name(request.endpoint)
+            if g.get('_profile_requested'):
+                response.headers[PROFILE_HEADER] = g._profile_name + '.folded'
+        return response
+
+    @app.teardown_request
+    def _finish_profile(exc):
+        sampler = g.pop('_profiler', None)
+        if sampler is None:
+            return
+        try:
+            sampler.stop()
+            name = g.pop('_profile_name', None) or _profile_name(request.endpoint)
+            path = sampler.write(PROFILE_DIR, name, root=f'{request.method} {request.endpoint or "unmatched"}')
+            log.info('profile %s: %d samples over %.1fms', path, sampler.samples, sampler.elapsed * 1000)
+        except Exception:
+            log.exception('could not write profile')
+        finally:
+            _release_slot()
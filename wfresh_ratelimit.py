@@ -0,0 +1,101 @@
+"""
+wfresh_ratelimit.py
+
+In-memory token-bucket admission control for mutating routes.
+
+Each (route, client) pair gets a bucket that refills at `rate` tokens/second up
+to `burst`. A request spends one token; with none left it is rejected before any
+DB/disk work happens.
+
+Storage is deliberately compact: one dict entry per active key holding a
+3-item list [tokens, last_refill, budget]. Buckets that have refilled completely carry no
+information, so a periodic sweep drops them and memory stays proportional to
+the number of recently active clients.
+"""
+
+import threading
+import time
+
+
+class Budget:
+    """Refill rate (tokens/second) and burst size for one route."""
+
+    __slots__ = ('rate', 'burst')
+
+    def __init__(self, per_minute: float, burst: int):
+        self.rate = per_minute / 60.0
+        self.burst = float(burst)
+
+
+class TokenBucketLimiter:
+    """
+    Keyed token buckets with periodic eviction.
+
+    Thread safe: one lock around the (O(1)) bucket update; the eviction sweep runs
+    inline at most once every sweep_interval seconds.
+    """
+
+    def __init__(self, sweep_interval: float = 60.0, max_keys: int = 100_000):
+        self.sweep_interval = sweep_interval
+        self.max_keys = max_keys
+        self._lock = threading.Lock()
+        self._buckets = {}
+        self._next_sweep = time.monotonic() + sweep_interval
+        self.allowed = 0
+        self.rejected = 0
+
+    def allow(self, key, budget: Budget) -> float:
+        """
+        Try to spend one token from key's bucket.
+
+        Returns:
+            0.0 if allowed, otherwise the number of seconds until a token is available
+        """
+        return self.allow_all(((key, budget),))
+
+    def allow_all(self, limits) -> float:
+        """
+        Spend one token from every (key, budget) bucket in limits, or from none.
+
+        All buckets are checked before any is charged, so a request rejected by
+        one budget does not use up the others.
+
+        Returns:
+            0.0 if allowed, otherwise the seconds until every bucket has a token
+        """
+        now = time.monotonic()
+        with self._lock:
+            if now >= self._next_sweep or len(self._buckets) >= self.max_keys:
+                self._sweep(now)
+
+            buckets = []
+            for key, budget in limits:
+                bucket = self._buckets.get(key)
+                if bucket is None:
+                    bucket = self._buckets[key] = [budget.burst, now, budget]
+                else:
+                    bucket[0] = min(budget.burst, bucket[0] + (now - bucket[1]) * budget.rate)
+                    bucket[1] = now
+                buckets.append(bucket)
+
+            waits = [(1.0 - tokens) / budget.rate for tokens, _, budget in buckets if tokens < 1.0]
+            if waits:
+                self.rejected += 1
+                return max(waits)
+
+            for bucket in buckets:
+                bucket[0] -= 1.0
+            self.allowed += 1
+            return 0.0
+
+    def _sweep(self, now: float):
+        """Drop buckets that would be full by now (caller holds the lock)."""
+        for key, (tokens, last, budget) in list(self._buckets.items()):
+            if tokens + (now - last) * budget.rate >= budget.burst:
+                del self._buckets[key]
+        self._next_sweep = now + self.sweep_interval
+
+    def stats(self) -> dict:
+        """Active buckets and allow/reject counters."""
+        with self._lock:
+            return {'keys': len(self._buckets), 'allowed': self.allowed, 'rejected': self.rejected}
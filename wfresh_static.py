@@ -0,0 +1,255 @@
+"""
+wfresh_static.py
+
+Fingerprinted static assets with long-lived caching and precompression.
+
+Contains:
+1) StaticAssets: hashes every file under static/ (except uploads/) at startup
+   and makes url_for('static', filename='style.css') produce
+   /static/style.<hash>.css
+2) A replacement for Flask's static view that serves fingerprinted names with
+   Cache-Control: immutable and a strong ETag, picking a precompressed .br/.gz
+   sibling when the client accepts it
+3) A build command that writes the precompressed files:
+       python wfresh_static.py build
+
+brotli is optional: without it only .gz files are built (existing .br files are
+still served). Unfingerprinted URLs keep Flask's default behaviour, except
+that static/uploads/ is only reachable through the app's own uploads route.
+"""
+
+import gzip
+import hashlib
+import mimetypes
+import os
+import sys
+
+from flask import abort, current_app, request, send_from_directory
+
+try:
+    import brotli
+except ImportError:  # pragma: no cover - optional dependency
+    brotli = None
+
+# Directories under static/ that are not build assets
+EXCLUDE_DIRS = ('uploads',)
+
+# Only text formats are worth compressing (images are already compressed)
+COMPRESSIBLE = {'.css', '.js', '.svg', '.json', '.txt', '.html', '.map'}
+
+# Served encodings in order of preference: (Content-Encoding, file suffix)
+ENCODINGS = (('br', '.br'), ('gzip', '.gz'))
+
+HASH_LENGTH = 12
+ONE_YEAR = 365 * 24 * 3600
+
+
+def _file_digest(path: str) -> str:
+    h = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(64 * 1024), b''):
+            h.update(chunk)
+    return h.hexdigest()[:HASH_LENGTH]
+
+
+def fingerprinted_name(relname: str, digest: str) -> str:
+    """'css/style.css' -> 'css/style.<digest>.css'"""
+    head, dot, ext = relname.rpartition('.')
+    if not dot or '/' in ext:
+        return f'{relname}.{digest}'
+    return f'{head}.{digest}.{ext}'
+
+
+def _iter_assets(static_folder: str):
+    """Yield relnames of build assets (skips uploads and precompressed siblings)."""
+    for root, dirs, files in os.walk(static_folder):
+        if root == static_folder:
+            dirs[:] = [d for d in dirs if d not in EXCLUDE_DIRS]
+        for name in files:
+            if name.endswith(('.gz', '.br')):
+                continue
+            path = os.path.join(root, name)
+            yield os.path.relpath(path, static_folder).replace(os.sep, '/')
+
+
+class _Asset:
+    __slots__ = ('relname', 'hashed', 'digest', 'mtime', 'mimetype')
+
+    def __init__(self, relname: str, digest: str, mtime: float):
+        self.relname = relname
+        self.digest = digest
+        self.mtime = mtime
+        self.hashed = fingerprinted_name(relname, digest)
+        self.mimetype = mimetypes.guess_type(relname)[0] or 'application/octet-stream'
+
+
+class StaticAssets:
+    """
+    Manifest of fingerprinted static files for one Flask app.
+
+    Usage:
+        assets = StaticAssets()
+        assets.init_app(app)
+
+    With auto_reload (default: app.debug), edited files are re-hashed the next
+    time url_for() asks for them, so development does not need a restart.
+    """
+
+    def __init__(self, app=None, auto_reload: bool = None):
+        self.static_folder = None
+        self.auto_reload = auto_reload
+        self._by_name = {}
+        self._by_hashed = {}
+        self._fallback = None
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        self.static_folder = app.static_folder
+        if self.auto_reload is None:
+            self.auto_reload = app.debug
+        self.scan()
+
+        self._fallback = app.view_functions['static']
+        app.view_functions['static'] = self.serve
+        app.url_defaults(self._url_defaults)
+        app.extensions['wfresh_static'] = self
+
+    # -------------------------
+    # Manifest
+    # -------------------------
+    def scan(self):
+        """(Re)hash every asset under the static folder."""
+        by_name = {}
+        for relname in _iter_assets(self.static_folder):
+            path = os.path.join(self.static_folder, relname)
+            by_name[relname] = _Asset(relname, _file_digest(path), os.path.getmtime(path))
+        self._by_name = by_name
+        self._by_hashed = {asset.hashed: asset for asset in by_name.values()}
+
+    def manifest_digest(self) -> str:
+        """Short hash over every asset's fingerprint (changes whenever any asset does)."""
+        h = hashlib.sha256()
+        for relname in sorted(self._by_name):
+            h.update(f'{relname}={self._by_name[relname].digest};'.encode())
+        return h.hexdigest()[:HASH_LENGTH]
+
+    def _refresh(self, asset: _Asset) -> _Asset:
+        path = os.path.join(self.static_folder, asset.relname)
+        try:
+            mtime = os.path.getmtime(path)
+        except OSError:
+            return asset
+        if mtime == asset.mtime:
+            return asset
+        fresh = _Asset(asset.relname, _file_digest(path), mtime)
+        self._by_name[asset.relname] = fresh
+        self._by_hashed[fresh.hashed] = fresh
+        return fresh
+
+    def url_name(self, relname: str) -> str:
+        """Fingerprinted name for relname (unchanged if it is not a known asset)."""
+        asset = self._by_name.get(relname)
+        if asset is None:
+            return relname
+        if self.auto_reload:
+            asset = self._refresh(asset)
+        return asset.hashed
+
+    def _url_defaults(self, endpoint, values):
+        if endpoint == 'static' and 'filename' in values:
+            values['filename'] = self.url_name(values['filename'])
+
+    # -------------------------
+    # Serving
+    # -------------------------
+    def serve(self, filename):
+        """Static view: fingerprinted names get immutable caching, others fall through."""
+        asset = self._by_hashed.get(filename)
+        if asset is None:
+            # Uploads are served (and filtered) by their own route only.
+            if filename.split('/', 1)[0] in EXCLUDE_DIRS:
+                abort(404)
+            return self._fallback(filename=filename)
+
+        encoding, suffix = self._pick_encoding(asset)
+        etag = asset.digest + (f'-{encoding}' if encoding else '')
+
+        if request.if_none_match.contains(etag):
+            resp = current_app.response_class(status=304)
+        else:
+            resp = send_from_directory(
+                self.static_folder, asset.relname + suffix,
+                mimetype=asset.mimetype, conditional=False, etag=False, max_age=ONE_YEAR
+            )
+            if encoding:
+                resp.content_encoding = encoding
+                resp.headers.pop('Content-Disposition', None)  # would name the .gz/.br file
+
+        resp.set_etag(etag)
+        resp.cache_control.public = True
+        resp.cache_control.max_age = ONE_YEAR
+        resp.cache_control.immutable = True
+        if asset.relname.endswith(tuple(COMPRESSIBLE)):
+            resp.vary.add('Accept-Encoding')
+        return resp
+
+    def _pick_encoding(self, asset: _Asset):
+        """Best precompressed sibling the client accepts and that is not older than the source."""
+        accepted = request.accept_encodings
+        for encoding, suffix in ENCODINGS:
+            if not accepted[encoding]:
+                continue
+            path = os.path.join(self.static_folder, asset.relname + suffix)
+            try:
+                if os.path.getmtime(path) >= asset.mtime:
+                    return encoding, suffix
+            except OSError:
+                continue
+        return None, ''
+
+
+# ------------------------------------------------------------------------------------
+# Build step
+# ------------------------------------------------------------------------------------
+def build(static_folder: str) -> list[str]:
+    """
+    Write .gz (and .br, if brotli is installed) next to each compressible asset.
+
+    Files whose compressed form would not be smaller are skipped.
+
+    Returns:
+        list of written paths (relative to static_folder)
+    """
+    written = []
+    for relname in _iter_assets(static_folder):
+        if os.path.splitext(relname)[1] not in COMPRESSIBLE:
+            continue
+        path = os.path.join(static_folder, relname)
+        with open(path, 'rb') as f:
+            data = f.read()
+
+        outputs = {'.gz': gzip.compress(data, compresslevel=9, mtime=0)}
+        if brotli is not None:
+            outputs['.br'] = brotli.compress(data, quality=11)
+
+        for suffix, blob in outputs.items():
+            if len(blob) >= len(data):
+                continue
+            tmp = f'{path}{suffix}.{os.getpid()}.tmp'
+            with open(tmp, 'wb') as f:
+                f.write(blob)
+            os.replace(tmp, path + suffix)
+            written.append(relname + suffix)
+    return written
+
+
+if __name__ == '__main__':
+    if len(sys.argv) != 2 or sys.argv[1] != 'build':
+        print('usage: python wfresh_static.py build')
+        sys.exit(2)
+    folder = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'static')
+    for name in build(folder):
+        print(f'wrote static/{name}')
+    if brotli is None:
+        print('brotli is not installed; only gzip files were written')
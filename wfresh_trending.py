@@ -0,0 +1,391 @@
+"""
+wfresh_trending.py
+
+"Trending now": most-commented dishes today and most active DishDash threads
+this hour, without scanning comments/messages on page views.
+
+Contains:
+1) TrendingCounter: sliding window of time buckets (item -> count) with
+   exponential decay across buckets and the top-K kept up to date in memory
+   - record() is O(log K) amortized; top() is O(K)
+   - a bucket boundary drops the expired bucket and rescores the window once
+2) Checkpointing to trending_bucket (trending.sql)
+   - each process adds the counts it recorded since its last checkpoint
+     (one multi-row upsert), then reloads the window, so every worker sees
+     every worker's activity within TrendingSyncer.interval
+   - rebuild() recomputes the window from comments.created_at / messages.sent_at
+3) TrendingSyncer: background thread running the checkpoints; its first pass
+   rebuilds from history if no checkpoint covers the window (first deploy, or
+   after the app was down longer than the window)
+
+Settings (environment):
+    WFRESH_TRENDING_SYNC    seconds between checkpoints (default 30)
+"""
+
+import heapq
+import os
+import threading
+import time
+import logging
+from collections import Counter
+from datetime import datetime, timedelta
+
+import wfresh_helper
+
+log = logging.getLogger(__name__)
+
+
+class TrendingCounter:
+    """
+    Decayed activity counts per item (a did or thid) over a sliding window.
+
+    The window is nbuckets buckets of bucket seconds. An event counts with
+    weight decay**age, age being how many buckets ago it happened, so recent
+    activity ranks above an older burst of the same size.
+
+    Thread safe: every operation takes one lock.
+    """
+
+    def __init__(self, kind: str, window: timedelta, bucket: timedelta, half_life: timedelta,
+                 history_sql: str, prune_sql: str = None, k: int = 10):
+        """
+        Args:
+            kind: name of the counter (trending_bucket.kind)
+            history_sql: SELECT item, event time ... WHERE event time >= %s (for rebuild)
+            prune_sql: optional DELETE of this kind's trending_bucket rows (kind = %s)
+                       whose item no longer exists, run at every checkpoint
+            k: how many top items to keep
+        """
+        self.kind = kind
+        self.bucket = bucket.total_seconds()
+        self.nbuckets = max(1, int(window / bucket))
+        self.decay = 0.5 ** (self.bucket / half_life.total_seconds())
+        self.history_sql = history_sql
+        self.prune_sql = prune_sql
+        self.k = k
+        self._lock = threading.Lock()
+        self._buckets = {}         # bucket index -> Counter(item -> count)
+        self._unsaved = Counter()  # (bucket index, item) -> count not checkpointed yet
+        self._scores = {}          # item -> decayed count over the window
+        self._counts = Counter()   # item -> plain count over the window
+        self._top = []             # up to k items, best first
+        self._top_view = ()        # ((item, count), ...) as returned by top()
+        self._index = None         # current bucket index
+        self.loaded = False        # load() has run (from a checkpoint or history)
+
+    # -------------------------
+    # Updates
+    # -------------------------
+    def record(self, item, n: int = 1, now: float = None):
+        """Count n events for item (at time.time() unless now is given)."""
+        index = int((time.time() if now is None else now) // self.bucket)
+        item = int(item)
+        with self._lock:
+            self._advance(index)
+            age = self._index - index
+            if age >= self.nbuckets:
+                return  # already outside the window
+            self._buckets.setdefault(index, Counter())[item] += n
+            self._unsaved[(index, item)] += n
+            self._scores[item] = self._scores.get(item, 0.0) + n * self.decay ** age
+            self._counts[item] += n
+            self._promote(item)
+
+    def _promote(self, item):
+        """Fix up the top-K after item's score went up (O(K log K), K small)."""
+        top = self._top
+        if item not in top:
+            if len(top) >= self.k and self._scores[item] <= self._scores[top[-1]]:
+                return
+            top.append(item)
+        top.sort(key=self._scores.__getitem__, reverse=True)
+        del top[self.k:]
+        self._set_view()
+
+    def _advance(self, index: int):
+        """Move the window to bucket index, if that is newer than the current one."""
+        if self._index is not None and index <= self._index:
+            return
+        self._index = index
+        oldest = index - self.nbuckets + 1
+        for old in [i for i in self._buckets if i < oldest]:
+            del self._buckets[old]
+        for key in [key for key in self._unsaved if key[0] < oldest]:
+            del self._unsaved[key]
+        self._rescore()
+
+    def _rescore(self):
+        """Recompute scores, counts and the top-K from the buckets (O(items in window))."""
+        scores, counts = {}, Counter()
+        for index, bucket in self._buckets.items():
+            weight = self.decay ** (self._index - index)
+            for item, n in bucket.items():
+                scores[item] = scores.get(item, 0.0) + n * weight
+                counts[item] += n
+        self._scores, self._counts = scores, counts
+        self._top = heapq.nlargest(self.k, scores, key=scores.__getitem__)
+        self._set_view()
+
+    def _set_view(self):
+        self._top_view = tuple((item, self._counts[item]) for item in self._top)
+
+    # -------------------------
+    # Reads
+    # -------------------------
+    def top(self, now: float = None) -> tuple:
+        """
+        Best items first.
+
+        Returns:
+            tuple of (item, count in window), at most k
+        """
+        index = int((time.time() if now is None else now) // self.bucket)
+        with self._lock:
+            if self._index is None or index > self._index:
+                self._advance(index)
+            return self._top_view
+
+    # -------------------------
+    # Checkpoint support
+    # -------------------------
+    def bucket_start(self, index: int) -> datetime:
+        return datetime.fromtimestamp(index * self.bucket)
+
+    def bucket_index(self, when: datetime) -> int:
+        return int(when.timestamp() // self.bucket)
+
+    def window_start(self, now: float = None) -> datetime:
+        """Start of the oldest bucket still in the window."""
+        index = int((time.time() if now is None else now) // self.bucket)
+        return self.bucket_start(index - self.nbuckets + 1)
+
+    def take_unsaved(self) -> list:
+        """
+        Hand over the counts recorded since the last checkpoint.
+
+        Returns:
+            list of (bucket start, item, count); pass it back to restore_unsaved
+            if writing it fails
+        """
+        with self._lock:
+            rows = [(self.bucket_start(index), item, n) for (index, item), n in self._unsaved.items()]
+            self._unsaved.clear()
+        return rows
+
+    def restore_unsaved(self, rows):
+        with self._lock:
+            for start, item, n in rows:
+                self._unsaved[(self.bucket_index(start), item)] += n
+
+    def load(self, rows, now: float = None):
+        """
+        Replace the window with checkpointed counts (every process's).
+
+        Counts recorded here since the last take_unsaved() are not in rows
+        yet, so they are added back on top.
+
+        Args:
+            rows: (bucket start, item, count)
+        """
+        index = int((time.time() if now is None else now) // self.bucket)
+        with self._lock:
+            buckets = {}
+            for start, item, n in rows:
+                buckets.setdefault(self.bucket_index(start), Counter())[int(item)] += int(n)
+            for (b, item), n in self._unsaved.items():
+                buckets.setdefault(b, Counter())[item] += n
+            self._buckets = buckets
+            self._index = max(index, self._index or index)
+            oldest = self._index - self.nbuckets + 1
+            for old in [i for i in self._buckets if i < oldest]:
+                del self._buckets[old]
+            self._rescore()
+            self.loaded = True
+
+
+# ------------------------------------------------------------------------------------
+# Counters
+# ------------------------------------------------------------------------------------
+dishes = TrendingCounter(
+    'dishes', window=timedelta(hours=24), bucket=timedelta(hours=1), half_life=timedelta(hours=6),
+    history_sql='SELECT dish, created_at FROM comments WHERE created_at >= %s AND dish IS NOT NULL',
+)
+threads = TrendingCounter(
+    'threads', window=timedelta(hours=1), bucket=timedelta(minutes=5), half_life=timedelta(minutes=20),
+    history_sql='SELECT parentthread, sent_at FROM messages WHERE sent_at >= %s AND parentthread IS NOT NULL',
+    # A deleted thread would otherwise keep its place until its buckets expire.
+    prune_sql='''
+        DELETE b FROM trending_bucket b
+        LEFT JOIN threads t ON t.thid = b.item
+        WHERE b.kind = %s AND t.thid IS NULL
+    ''',
+)
+
+COUNTERS = (dishes, threads)
+
+
+# ------------------------------------------------------------------------------------
+# Checkpoints (trending_bucket)
+# ------------------------------------------------------------------------------------
+def checkpoint(counter: TrendingCounter):
+    """
+    Add this process's new counts to trending_bucket, drop expired rows (and
+    those of deleted items), and reload the window (which now includes the
+    other processes' counts).
+    """
+    # Key order, so concurrent checkpoints lock trending_bucket rows in the same order (no deadlocks).
+    rows = sorted(counter.take_unsaved())
+    since = counter.window_start()
+    conn, cur = wfresh_helper.db_connect(dict_cursor=False)
+    try:
+        try:
+            if rows:
+                cur.execute(
+                    'INSERT INTO trending_bucket (kind, bucket_start, item, n) VALUES '
+                    + ', '.join(['(%s, %s, %s, %s)'] * len(rows))
+                    + ' ON DUPLICATE KEY UPDATE n = n + VALUES(n)',
+                    [value for start, item, n in rows for value in (counter.kind, start, item, n)]
+                )
+            cur.execute('DELETE FROM trending_bucket WHERE kind = %s AND bucket_start < %s',
+                        (counter.kind, since))
+            if counter.prune_sql:
+                cur.execute(counter.prune_sql, (counter.kind,))
+            conn.commit()
+        except Exception:
+            conn.rollback()
+            counter.restore_unsaved(rows)
+            raise
+
+        cur.execute('SELECT bucket_start, item, n FROM trending_bucket WHERE kind = %s AND bucket_start >= %s',
+                    (counter.kind, since))
+        counter.load(cur.fetchall())
+    finally:
+        conn.close()
+
+
+def rebuild(counter: TrendingCounter):
+    """Recompute the checkpointed window from history, then reload it."""
+    since = counter.window_start()
+    counts = Counter()
+    # Counts recorded so far were committed before the history read below.
+    unsaved = counter.take_unsaved()
+    conn, cur = wfresh_helper.db_connect(dict_cursor=False)
+    try:
+        cur.execute(counter.history_sql, (since,))
+        for item, when in cur.fetchall():
+            counts[(counter.bucket_start(counter.bucket_index(when)), int(item))] += 1
+
+        cur.execute('DELETE FROM trending_bucket WHERE kind = %s', (counter.kind,))
+        if counts:
+            cur.execute(
+                'INSERT INTO trending_bucket (kind, bucket_start, item, n) VALUES '
+                + ', '.join(['(%s, %s, %s, %s)'] * len(counts)),
+                [value for (start, item), n in sorted(counts.items()) for value in (counter.kind, start, item, n)]
+            )
+        conn.commit()
+    except Exception:
+        conn.rollback()
+        counter.restore_unsaved(unsaved)
+        raise
+    finally:
+        conn.close()
+
+    counter.load([(start, item, n) for (start, item), n in counts.items()])
+
+
+def startup():
+    """
+    Load the counters that are not loaded yet: from their checkpoint, or
+    rebuilt from history if no checkpoint covers the window.
+    """
+    for counter in COUNTERS:
+        if counter.loaded:
+            continue
+        conn, cur = wfresh_helper.db_connect(dict_cursor=False)
+        try:
+            # A row in the oldest bucket means checkpoints ran for the whole window.
+            cur.execute('SELECT COUNT(*) FROM trending_bucket WHERE kind = %s AND bucket_start <= %s',
+                        (counter.kind, counter.window_start()))
+            covered = cur.fetchone()[0] > 0
+        finally:
+            conn.close()
+        if covered:
+            checkpoint(counter)
+        else:
+            rebuild(counter)
+
+
+# ------------------------------------------------------------------------------------
+# Background checkpoints
+# ------------------------------------------------------------------------------------
+class TrendingSyncer:
+    """
+    Background thread that loads the counters (or, if a preloading parent
+    process already did, checkpoints them at once to catch up), then
+    checkpoints them every interval seconds.
+
+    Thread/process safe:
+    - One syncer per process (start() is idempotent and fork-aware)
+    - Concurrent checkpoints from other workers only add their own counts
+    """
+
+    def __init__(self, interval: float = 30):
+        self.interval = interval
+        self._pid = None
+        self._thread = None
+        self._stop = threading.Event()
+        self._lock = threading.Lock()
+
+    def start(self):
+        """Start the syncer thread in this process if it is not already running."""
+        with self._lock:
+            if self._pid == os.getpid():
+                return
+            self._pid = os.getpid()
+            self._stop = threading.Event()
+            self._thread = threading.Thread(target=self._run, name='trending-sync', daemon=True)
+            self._thread.start()
+
+    def stop(self, timeout: float = None):
+        """
+        Ask the syncer thread to exit after its current pass.
+
+        With a timeout, also wait that long for it (e.g. before forking, so the
+        thread is not holding a counter's lock at that moment).
+        """
+        self._stop.set()
+        thread = self._thread
+        if timeout is not None and thread is not None and thread is not threading.current_thread():
+            thread.join(timeout)
+
+    def _run(self):
+        # Counters a preloading parent loaded are as old as the fork: refresh them now.
+        preloaded = [counter for counter in COUNTERS if counter.loaded]
+        try:
+            startup()
+        except Exception:
+            log.exception('trending startup load failed')
+        self._checkpoint(preloaded)
+        while not self._stop.wait(self.interval):
+            self._checkpoint(COUNTERS)
+
+    def _checkpoint(self, counters):
+        for counter in counters:
+            try:
+                checkpoint(counter)
+            except Exception:
+                log.exception('trending checkpoint failed (%s)', counter.kind)
+
+
+# Process-wide syncer (started by app.py)
+syncer = TrendingSyncer(interval=float(os.environ.get('WFRESH_TRENDING_SYNC', 30)))
+
+
+if __name__ == '__main__':
+    # python wfresh_trending.py rebuild   (e.g. after bulk-loading comments/messages)
+    import sys
+    if sys.argv[1:] != ['rebuild']:
+        sys.exit('usage: python wfresh_trending.py rebuild')
+    for c in COUNTERS:
+        rebuild(c)
+        print(c.kind, c.top())
@@ -0,0 +1,562 @@
+"""
+wfresh_uploads.py
+
+Content-addressed storage for uploaded dish pictures.
+
+Files are named by the SHA-256 of their bytes and sharded into two levels of
+subdirectories so no single directory grows huge:
+
+    static/uploads/3f/a2/3fa2...e9.png
+
+- The hash is computed while the upload is streamed to a temp file, so the
+  body is never held in memory and never read twice
+- Identical uploads map to the same path and are stored once; dish_picture rows
+  reference the shared file and delete_dish_picture's filename count acts as
+  the reference count
+- A given name always has the same bytes, so it can be served as immutable
+
+Legacy uploads (flat "dish{did}_{name}" files) keep working; they are just not
+deduplicated or cached as aggressively.
+
+Resumable uploads (used by the dish page's chunked uploader):
+- start_session: declare did + total size, get an upload id
+- append_chunk: stream one chunk to <upload id>.part at a given offset; the
+  first bytes must look like an image, and the total can't exceed the
+  declared size
+- session_offset: how much the server already has (to resume after a drop)
+- finish_session: hash + validate the completed file and move it into
+  content-addressed storage
+Session state lives on disk under .tmp/, so any worker can continue an upload;
+only the running SHA-256 state is kept in memory (and rebuilt from the part
+file when a different worker picks the upload up).
+
+Orphan garbage collection (files no dish_picture row references):
+    python wfresh_uploads.py gc [--dry-run] [--grace SECONDS] [--retention SECONDS]
+"""
+
+import os
+import re
+import json
+import time
+import uuid
+import fcntl
+import hashlib
+
+from wfresh_cache import LRUCache
+
+CHUNK_SIZE = 64 * 1024
+
+# Newly (re)referenced files are never deleted within this window: a concurrent
+# upload of the same bytes may be about to insert a row that points at them.
+DELETE_GRACE = 10 * 60
+
+# Temp files live inside the upload folder so the final rename stays on one filesystem.
+TMP_DIR = '.tmp'
+
+_CONTENT_NAME_RE = re.compile(r'^[0-9a-f]{2}/[0-9a-f]{2}/[0-9a-f]{64}(\.[a-z0-9]+)*$')
+
+
+def is_content_addressed(relname: str) -> bool:
+    """True if relname is a hash-named file (or one of its variants)."""
+    return bool(_CONTENT_NAME_RE.match(relname))
+
+
+def content_relname(digest: str, ext: str) -> str:
+    """'3fa2...e9', 'png' -> '3f/a2/3fa2...e9.png'"""
+    return f'{digest[:2]}/{digest[2:4]}/{digest}.{ext}'
+
+
+def new_temp_path(upload_folder: str) -> str:
+    """Unique temp file path inside upload_folder/.tmp/ (directory is created)."""
+    tmp_dir = os.path.join(upload_folder, TMP_DIR)
+    os.makedirs(tmp_dir, exist_ok=True)
+    return os.path.join(tmp_dir, uuid.uuid4().hex + '.part')
+
+
+def stream_to_temp(stream, upload_folder: str):
+    """
+    Copy a file-like stream to a temp file in CHUNK_SIZE pieces, hashing as it goes.
+
+    Returns:
+        (temp_path, sha256 hex digest, size in bytes)
+    """
+    tmp_path = new_temp_path(upload_folder)
+    h = hashlib.sha256()
+    size = 0
+    try:
+        with open(tmp_path, 'wb') as out:
+            while True:
+                chunk = stream.read(CHUNK_SIZE)
+                if not chunk:
+                    break
+                h.update(chunk)
+                out.write(chunk)
+                size += len(chunk)
+    except Exception:
+        discard_temp(tmp_path)
+        raise
+    return tmp_path, h.hexdigest(), size
+
+
+def commit_temp(upload_folder: str, tmp_path: str, digest: str, ext: str) -> str:
+    """
+    Move a fully written temp file to its content-addressed path.
+
+    If the same content is already stored, the temp file is discarded and the
+    existing file's mtime is refreshed (see DELETE_GRACE).
+
+    Returns:
+        path relative to upload_folder (what goes into dish_picture.filename)
+    """
+    relname = content_relname(digest, ext)
+    final = os.path.join(upload_folder, relname)
+    os.makedirs(os.path.dirname(final), exist_ok=True)
+
+    if os.path.exists(final):
+        discard_temp(tmp_path)
+        os.utime(final)
+    else:
+        os.replace(tmp_path, final)  # atomic on POSIX
+    return relname
+
+
+def discard_temp(tmp_path: str):
+    """Remove a temp file, ignoring it if it is already gone."""
+    try:
+        os.remove(tmp_path)
+    except FileNotFoundError:
+        pass
+
+
+def store_upload(file_storage, upload_folder: str, validate=None):
+    """
+    Stream an uploaded file into content-addressed storage.
+
+    The stored extension comes from the file's magic bytes (sniff_image_ext),
+    as for resumable uploads, so the same bytes always get the same name and
+    Content-Type whatever the client called the file.
+
+    Args:
+        file_storage: werkzeug FileStorage from request.files
+        validate: optional callable(temp_path) -> bool run before the file is
+                  moved into place (e.g. wfresh_images.validate_image)
+
+    Returns:
+        relative filename, or None if the file is not a supported image or
+        validate rejected it
+    """
+    tmp_path, digest, _ = stream_to_temp(file_storage.stream, upload_folder)
+    with open(tmp_path, 'rb') as f:
+        ext = sniff_image_ext(f.read(16))
+    if ext is None or (validate is not None and not validate(tmp_path)):
+        discard_temp(tmp_path)
+        return None
+    return commit_temp(upload_folder, tmp_path, digest, ext)
+
+
+def delete_stored(upload_folder: str, relnames, grace: float = DELETE_GRACE) -> bool:
+    """
+    Delete stored files that the DB says are no longer referenced.
+
+    Content-addressed files touched within the grace window are left alone (a
+    concurrent upload may be re-referencing them); the orphan GC picks them up
+    later if they really are unused.
+
+    Returns:
+        True if the files were removed, False if they were left for the GC
+    """
+    relnames = list(relnames)
+    now = time.time()
+    paths = [os.path.join(upload_folder, name) for name in relnames]
+
+    if relnames and is_content_addressed(relnames[0]):
+        try:
+            if now - os.path.getmtime(paths[0]) < grace:
+                return False
+        except FileNotFoundError:
+            pass
+
+    for path in paths:
+        try:
+            os.remove(path)
+        except FileNotFoundError:
+            pass
+    return True
+
+
+# ------------------------------------------------------------------------------------
+# Resumable (chunked) uploads
+# ------------------------------------------------------------------------------------
+# Abandoned sessions older than this are removed by the orphan GC
+SESSION_TTL = 24 * 3600
+
+_UPLOAD_ID_RE = re.compile(r'^[0-9a-f]{32}$')
+
+# upload id -> (offset, sha256 object) for uploads in progress on this worker
+_hashers = LRUCache(maxsize=256)
+
+
+class UploadError(Exception):
+    """A resumable-upload request that can't be honored (carries an HTTP status)."""
+
+    def __init__(self, message: str, status: int = 400, offset: int = None):
+        super().__init__(message)
+        self.status = status
+        self.offset = offset
+
+
+def sniff_image_ext(head: bytes):
+    """
+    Identify an image by its magic bytes.
+
+    Returns:
+        'png' | 'jpg' | 'gif' | 'webp', or None if head is not a supported image
+    """
+    if head.startswith(b'\x89PNG\r\n\x1a\n'):
+        return 'png'
+    if head.startswith(b'\xff\xd8\xff'):
+        return 'jpg'
+    if head.startswith((b'GIF87a', b'GIF89a')):
+        return 'gif'
+    if head[:4] == b'RIFF' and head[8:12] == b'WEBP':
+        return 'webp'
+    return None
+
+
+def _session_paths(upload_folder: str, upload_id: str):
+    tmp_dir = os.path.join(upload_folder, TMP_DIR)
+    return (os.path.join(tmp_dir, upload_id + '.part'),
+            os.path.join(tmp_dir, upload_id + '.json'))
+
+
+def start_session(upload_folder: str, did, owner_uid, size: int, max_size: int) -> str:
+    """
+    Create a resumable upload session for a picture of `size` bytes.
+
+    Returns:
+        upload id (32 hex chars)
+    """
+    if size <= 0 or size > max_size:
+        raise UploadError(f'File must be between 1 byte and {max_size // (1024 * 1024)}MB.', 413)
+
+    upload_id = uuid.uuid4().hex
+    part_path, meta_path = _session_paths(upload_folder, upload_id)
+    os.makedirs(os.path.dirname(part_path), exist_ok=True)
+
+    meta = {'did': str(did), 'owner': owner_uid, 'size': size, 'ext': None, 'created': time.time()}
+    with open(meta_path, 'w') as f:
+        json.dump(meta, f)
+    open(part_path, 'wb').close()
+    return upload_id
+
+
+def load_session(upload_folder: str, upload_id: str):
+    """Return the session's metadata dict, or None if it does not exist."""
+    if not _UPLOAD_ID_RE.match(upload_id or ''):
+        return None
+    _, meta_path = _session_paths(upload_folder, upload_id)
+    try:
+        with open(meta_path) as f:
+            return json.load(f)
+    except (FileNotFoundError, ValueError):
+        return None
+
+
+def session_offset(upload_folder: str, upload_id: str) -> int:
+    """Number of bytes received so far."""
+    part_path, _ = _session_paths(upload_folder, upload_id)
+    return os.path.getsize(part_path)
+
+
+def _locked_part(part_path: str):
+    """
+    Open the part file with an exclusive non-blocking lock.
+
+    The lock is an flock on the file, so it also excludes other workers; a client
+    that retries a chunk while the first attempt is still running gets a 409.
+    """
+    f = open(part_path, 'r+b')
+    try:
+        fcntl.flock(f, fcntl.LOCK_EX | fcntl.LOCK_NB)
+    except BlockingIOError:
+        f.close()
+        raise UploadError('Another chunk for this upload is still being written.', 409)
+    return f
+
+
+def _hasher_at(upload_id: str, f, offset: int):
+    """
+    Running sha256 of the first `offset` bytes of f (cached, or rebuilt from disk).
+
+    Returns a private copy: the cached state is only replaced once a chunk has
+    been written completely, so a failed chunk cannot leave bytes in the hash
+    that were truncated from the file.
+    """
+    cached = _hashers.get(upload_id)
+    if cached is not None and cached[0] == offset:
+        return cached[1].copy()
+
+    h = hashlib.sha256()
+    f.seek(0)
+    remaining = offset
+    while remaining:
+        chunk = f.read(min(CHUNK_SIZE, remaining))
+        if not chunk:
+            break
+        h.update(chunk)
+        remaining -= len(chunk)
+    return h
+
+
+def append_chunk(upload_folder: str, upload_id: str, meta: dict, offset: int, stream) -> int:
+    """
+    Append the body of one chunk request at `offset`, streaming in CHUNK_SIZE pieces.
+
+    Raises:
+        UploadError (409) if offset is not where the server's copy ends, (413) if the
+        data would exceed the declared size, (415) if the first bytes are not an image
+
+    Returns:
+        the new offset
+    """
+    part_path, meta_path = _session_paths(upload_folder, upload_id)
+    f = _locked_part(part_path)
+    try:
+        current = os.fstat(f.fileno()).st_size
+        if offset != current:
+            raise UploadError('Offset mismatch.', 409, offset=current)
+
+        h = _hasher_at(upload_id, f, current)
+        f.seek(current)
+        limit = meta['size']
+        written = current
+        first = current == 0
+
+        while True:
+            chunk = stream.read(CHUNK_SIZE)
+            if not chunk:
+                break
+            if first:
+                ext = sniff_image_ext(chunk[:16])
+                if ext is None:
+                    raise UploadError('That file is not a supported image.', 415)
+                meta['ext'] = ext
+                with open(meta_path, 'w') as mf:
+                    json.dump(meta, mf)
+                first = False
+            if written + len(chunk) > limit:
+                f.truncate(current)
+                raise UploadError('Upload is larger than declared.', 413, offset=current)
+            f.write(chunk)
+            h.update(chunk)
+            written += len(chunk)
+
+        f.flush()
+        _hashers.put(upload_id, (written, h))
+        return written
+    finally:
+        f.close()
+
+
+def finish_session(upload_folder: str, upload_id: str, meta: dict, validate=None) -> str:
+    """
+    Complete an upload: check it is whole, validate it, move it into content storage.
+
+    Returns:
+        relative filename for dish_picture.filename
+    """
+    part_path, meta_path = _session_paths(upload_folder, upload_id)
+    f = _locked_part(part_path)
+    try:
+        size = os.fstat(f.fileno()).st_size
+        if size != meta['size'] or not meta.get('ext'):
+            raise UploadError('Upload is incomplete.', 409, offset=size)
+        digest = _hasher_at(upload_id, f, size).hexdigest()
+
+        if validate is not None and not validate(part_path):
+            abort_session(upload_folder, upload_id)
+            raise UploadError('That file is not a valid image.', 415)
+
+        relname = commit_temp(upload_folder, part_path, digest, meta['ext'])
+    finally:
+        f.close()
+
+    _hashers.invalidate(upload_id)
+    discard_temp(meta_path)
+    return relname
+
+
+def abort_session(upload_folder: str, upload_id: str):
+    """Throw away a session's data and metadata."""
+    _hashers.invalidate(upload_id)
+    for path in _session_paths(upload_folder, upload_id):
+        discard_temp(path)
+
+
+# ------------------------------------------------------------------------------------
+# Orphan garbage collection
+# ------------------------------------------------------------------------------------
+QUARANTINE_DIR = '.quarantine'
+
+# Files younger than this are never touched: they may belong to an upload whose
+# dish_picture row has not been inserted yet (files are written before the row).
+GC_GRACE = 60 * 60
+
+# Quarantined files are deleted for good after this long
+QUARANTINE_RETENTION = 7 * 24 * 3600
+
+GC_BATCH_SIZE = 500
+
+
+def _iter_files(root: str, skip_dirs=(), prefix: str = ''):
+    """
+    Yield (relname, DirEntry) for every regular file under root, lazily.
+
+    Uses os.scandir recursively, so memory stays flat however many files exist.
+    """
+    try:
+        entries = os.scandir(root)
+    except FileNotFoundError:
+        return
+    with entries:
+        for entry in entries:
+            if entry.is_dir(follow_symlinks=False):
+                if not prefix and entry.name in skip_dirs:
+                    continue
+                yield from _iter_files(entry.path, skip_dirs, prefix + entry.name + '/')
+            elif entry.is_file(follow_symlinks=False):
+                yield prefix + entry.name, entry
+
+
+def _batches(iterable, size: int):
+    batch = []
+    for item in iterable:
+        batch.append(item)
+        if len(batch) == size:
+            yield batch
+            batch = []
+    if batch:
+        yield batch
+
+
+def collect_orphans(upload_folder: str, find_referenced, grace: float = GC_GRACE,
+                    retention: float = QUARANTINE_RETENTION, batch_size: int = GC_BATCH_SIZE,
+                    dry_run: bool = False) -> dict:
+    """
+    Quarantine unreferenced uploads, purge old quarantined files, drop stale temp files.
+
+    Safe to run while uploads are in flight:
+    - Files modified within `grace` seconds are skipped (deduplicated uploads
+      refresh their file's mtime, see commit_temp); the mtime is checked again
+      right before each move, after the reference query
+    - Orphans are moved to .quarantine/ rather than deleted, and a quarantined
+      file that has become referenced again is restored instead of purged
+
+    Args:
+        find_referenced: callable(list of relnames) -> set of referenced relnames
+                         (wfresh_helper.find_referenced_uploads)
+
+    Returns:
+        dict report (counts and bytes)
+    """
+    now = time.time()
+    report = {
+        'scanned': 0, 'referenced': 0, 'young': 0,
+        'quarantined': 0, 'quarantined_bytes': 0,
+        'purged': 0, 'reclaimed_bytes': 0, 'restored': 0,
+        'stale_temp': 0, 'stale_temp_bytes': 0,
+    }
+    quarantine = os.path.join(upload_folder, QUARANTINE_DIR)
+
+    # 1) Live files -> quarantine if nothing references them
+    live = _iter_files(upload_folder, skip_dirs=(TMP_DIR, QUARANTINE_DIR))
+    for batch in _batches(live, batch_size):
+        report['scanned'] += len(batch)
+        candidates = []
+        for relname, entry in batch:
+            st = entry.stat(follow_symlinks=False)
+            if now - st.st_mtime < grace:
+                report['young'] += 1
+            else:
+                candidates.append((relname, st.st_size))
+
+        referenced = find_referenced([name for name, _ in candidates])
+        for relname, size in candidates:
+            if relname in referenced:
+                report['referenced'] += 1
+                continue
+            src = os.path.join(upload_folder, relname)
+            # The reference query can take a while; a deduplicated upload may have
+            # refreshed this file (before inserting its row) since the scan.
+            try:
+                if time.time() - os.stat(src, follow_symlinks=False).st_mtime < grace:
+                    report['young'] += 1
+                    continue
+            except FileNotFoundError:
+                continue
+            report['quarantined'] += 1
+            report['quarantined_bytes'] += size
+            if not dry_run:
+                dest = os.path.join(quarantine, relname)
+                os.makedirs(os.path.dirname(dest), exist_ok=True)
+                os.replace(src, dest)
+                os.utime(dest)  # retention counts from quarantine time
+
+    # 2) Quarantined files -> restore if referenced again, else purge when old
+    for batch in _batches(_iter_files(quarantine), batch_size):
+        referenced = find_referenced([name for name, _ in batch])
+        for relname, entry in batch:
+            path = entry.path
+            if relname in referenced:
+                report['restored'] += 1
+                if not dry_run:
+                    dest = os.path.join(upload_folder, relname)
+                    os.makedirs(os.path.dirname(dest), exist_ok=True)
+                    os.replace(path, dest)
+                continue
+            st = entry.stat(follow_symlinks=False)
+            if now - st.st_mtime >= retention:
+                report['purged'] += 1
+                report['reclaimed_bytes'] += st.st_size
+                if not dry_run:
+                    discard_temp(path)
+
+    # 3) Abandoned upload temp files / resumable sessions
+    for _, entry in _iter_files(os.path.join(upload_folder, TMP_DIR)):
+        st = entry.stat(follow_symlinks=False)
+        if now - st.st_mtime >= SESSION_TTL:
+            report['stale_temp'] += 1
+            report['stale_temp_bytes'] += st.st_size
+            if not dry_run:
+                discard_temp(entry.path)
+
+    report['reclaimed_bytes'] += report['stale_temp_bytes']
+    return report
+
+
+if __name__ == '__main__':
+    import argparse
+    import wfresh_helper
+
+    parser = argparse.ArgumentParser(description='Garbage-collect unreferenced dish picture uploads.')
+    parser.add_argument('command', choices=['gc'])
+    parser.add_argument('--folder', default=os.path.join(
+        os.path.dirname(os.path.abspath(__file__)), 'static', 'uploads'))
+    parser.add_argument('--grace', type=float, default=GC_GRACE,
+                        help='skip files modified within this many seconds')
+    parser.add_argument('--retention', type=float, default=QUARANTINE_RETENTION,
+                        help='delete quarantined files older than this many seconds')
+    parser.add_argument('--batch-size', type=int, default=GC_BATCH_SIZE)
+    parser.add_argument('--dry-run', action='store_true', help='report only, move/delete nothing')
+    args = parser.parse_args()
+
+    result = collect_orphans(
+        args.folder,
+        wfresh_helper.find_referenced_uploads,
+        grace=args.grace,
+        retention=args.retention,
+        batch_size=args.batch_size,
+        dry_run=args.dry_run,
+    )
+    for key, value in result.items():
+        print(f'{key:>20}: {value}')
@@ -0,0 +1,280 @@
+"""
+wfresh_writeq.py
+
+Optional write-behind (group commit) queue for high-volume single-row INSERTs.
+
+Instead of every request opening a connection, running one INSERT and paying
+for its own commit, writes are put on a bounded in-process queue. One worker
+thread drains it in batches: every row is inserted in ONE transaction on a
+long-lived connection, and the whole batch is made durable by ONE commit.
+Rows are inserted one statement each, so every caller gets its own
+lastrowid (a multi-row INSERT's ids are not guaranteed to be consecutive
+with innodb_autoinc_lock_mode=2, the MySQL 8 default).
+
+Contains:
+1) WriteSpec: how to insert one kind of row (+ what to do in the same
+   transaction, and after it commits)
+2) PendingWrite: handle a caller can wait on for the durable result (new row id)
+3) GroupCommitQueue: the bounded queue + batching worker + metrics
+"""
+
+import os
+import queue
+import threading
+import time
+import logging
+from collections import Counter
+
+log = logging.getLogger(__name__)
+
+
+class WriteQueueFull(Exception):
+    """Raised by GroupCommitQueue.submit when the queue stays full past the timeout."""
+
+
+class WriteSpec:
+    """
+    Describes one kind of queued INSERT.
+
+    Args:
+        name: short label used in metrics
+        insert_prefix: 'INSERT INTO t (a, b) VALUES'
+        row_sql: placeholder group for one row, e.g. '(%s, %s)'
+        on_commit: optional callback(pending) run after the batch commits
+        after_insert: optional callback(cursor, params_list) run in the batch's
+            transaction right after its rows are inserted (e.g. one grouped
+            update of a derived table for the whole batch)
+    """
+
+    def __init__(self, name: str, insert_prefix: str, row_sql: str, on_commit=None, after_insert=None):
+        self.name = name
+        self.insert_prefix = insert_prefix
+        self.row_sql = row_sql
+        self.on_commit = on_commit
+        self.after_insert = after_insert
+
+
+class PendingWrite:
+    """Result handle for a queued write (like a minimal Future)."""
+
+    def __init__(self, spec: WriteSpec, params: tuple, context=None):
+        self.spec = spec
+        self.params = params
+        self.context = context
+        self.rowid = None
+        self.error = None
+        self._done = threading.Event()
+
+    def done(self) -> bool:
+        return self._done.is_set()
+
+    def wait(self, timeout: float = None):
+        """
+        Block until the row is committed.
+
+        Returns:
+            the new row's AUTO_INCREMENT id
+        Raises:
+            the INSERT's exception if it failed, TimeoutError on timeout
+        """
+        if not self._done.wait(timeout):
+            raise TimeoutError('write not committed yet')
+        if self.error is not None:
+            raise self.error
+        return self.rowid
+
+    def _finish(self, rowid=None, error=None):
+        self.rowid = rowid
+        self.error = error
+        self._done.set()
+
+
+class GroupCommitQueue:
+    """
+    Bounded queue of pending INSERTs drained by one batching worker thread.
+
+    Batching:
+    - The worker blocks for the first write, then keeps collecting until it has
+      max_batch writes or max_delay seconds have passed
+    - Writes are grouped by WriteSpec; each row is its own INSERT (for its
+      lastrowid), then the spec's after_insert hook runs once for the group
+    - One commit per batch; on failure the batch is rolled back and replayed row
+      by row, so one bad row only fails its own caller
+
+    Thread/process safe:
+    - submit() may be called from any request thread
+    - The worker (and its DB connection) is started lazily per process, so a
+      queue created before a fork works in every child
+    """
+
+    def __init__(self, connect, maxsize: int = 1000, max_batch: int = 100, max_delay: float = 0.005):
+        """
+        Args:
+            connect: zero-arg callable returning a new DB connection
+        """
+        self.connect = connect
+        self.max_batch = max_batch
+        self.max_delay = max_delay
+        self._maxsize = maxsize
+        self._queue = queue.Queue(maxsize=maxsize)
+        self._lock = threading.Lock()
+        self._pid = None
+        self._conn = None
+
+        # metrics
+        self.submitted = 0
+        self.committed = 0
+        self.failed = 0
+        self.batches = 0
+        self.max_depth = 0
+        self.batch_sizes = Counter()
+
+    # -------------------------
+    # Producer side
+    # -------------------------
+    def submit(self, spec: WriteSpec, params: tuple, context=None, timeout: float = 1.0) -> PendingWrite:
+        """
+        Queue one row for insertion.
+
+        context is passed through untouched to the spec's on_commit hook.
+
+        Raises:
+            WriteQueueFull if the queue is still full after timeout seconds
+        """
+        self._ensure_worker()
+        pending = PendingWrite(spec, tuple(params), context)
+        try:
+            self._queue.put(pending, timeout=timeout)
+        except queue.Full:
+            raise WriteQueueFull()
+        with self._lock:
+            self.submitted += 1
+            depth = self._queue.qsize()
+            if depth > self.max_depth:
+                self.max_depth = depth
+        return pending
+
+    def _ensure_worker(self):
+        if self._pid == os.getpid():
+            return
+        with self._lock:
+            if self._pid == os.getpid():
+                return
+            # After a fork the parent's queue contents and connection are not ours.
+            self._queue = queue.Queue(maxsize=self._maxsize)
+            self._conn = None
+            self._pid = os.getpid()
+            threading.Thread(target=self._run, name='write-behind', daemon=True).start()
+
+    # -------------------------
+    # Worker side
+    # -------------------------
+    def _run(self):
+        while True:
+            batch = [self._queue.get()]
+            deadline = time.monotonic() + self.max_delay
+            while len(batch) < self.max_batch:
+                remaining = deadline - time.monotonic()
+                try:
+                    batch.append(self._queue.get(timeout=max(remaining, 0)) if remaining > 0
+                                 else self._queue.get_nowait())
+                except queue.Empty:
+                    break
+            try:
+                self._flush(batch)
+            except Exception as err:
+                log.exception('write-behind batch failed')
+                for pending in batch:
+                    if not pending.done():
+                        pending._finish(error=err)
+
+    def _connection(self):
+        if self._conn is not None:
+            try:
+                self._conn.ping(reconnect=True)
+                return self._conn
+            except Exception:
+                self._conn = None
+        self._conn = self.connect()
+        return self._conn
+
+    def _flush(self, batch):
+        by_spec = {}
+        for pending in batch:
+            by_spec.setdefault(pending.spec, []).append(pending)
+
+        conn = self._connection()
+        cur = conn.cursor()
+        results = []
+        try:
+            for spec, items in by_spec.items():
+                sql = spec.insert_prefix + ' ' + spec.row_sql
+                for item in items:
+                    cur.execute(sql, item.params)
+                    results.append((item, cur.lastrowid))
+                if spec.after_insert is not None:
+                    spec.after_insert(cur, [item.params for item in items])
+            conn.commit()
+        except Exception:
+            conn.rollback()
+            self._flush_one_by_one(batch)
+            return
+
+        self._record_batch(len(batch), len(batch), 0)
+        for pending, rowid in results:
+            self._complete(pending, rowid)
+
+    def _flush_one_by_one(self, batch):
+        conn = self._connection()
+        cur = conn.cursor()
+        ok = 0
+        for pending in batch:
+            try:
+                cur.execute(pending.spec.insert_prefix + ' ' + pending.spec.row_sql, pending.params)
+                rowid = cur.lastrowid
+                if pending.spec.after_insert is not None:
+                    pending.spec.after_insert(cur, [pending.params])
+                conn.commit()
+            except Exception as err:
+                conn.rollback()
+                pending._finish(error=err)
+                continue
+            ok += 1
+            self._complete(pending, rowid)
+        self._record_batch(len(batch), ok, len(batch) - ok)
+
+    def _complete(self, pending, rowid):
+        # Hooks (cache invalidation, events) run before the caller wakes up, so a
+        # request that waited for its write then reads its own write.
+        pending.rowid = rowid
+        if pending.spec.on_commit is not None:
+            try:
+                pending.spec.on_commit(pending)
+            except Exception:
+                log.exception('write-behind on_commit hook failed')
+        pending._finish(rowid=rowid)
+
+    def _record_batch(self, size, ok, failed):
+        with self._lock:
+            self.batches += 1
+            self.committed += ok
+            self.failed += failed
+            self.batch_sizes[size] += 1
+
+    # -------------------------
+    # Metrics
+    # -------------------------
+    def stats(self) -> dict:
+        """Queue depth, throughput counters and the batch-size distribution."""
+        with self._lock:
+            return {
+                'depth': self._queue.qsize(),
+                'max_depth': self.max_depth,
+                'capacity': self._maxsize,
+                'submitted': self.submitted,
+                'committed': self.committed,
+                'failed': self.failed,
+                'batches': self.batches,
+                'avg_batch': (self.committed + self.failed) / self.batches if self.batches else 0.0,
+                'batch_sizes': dict(sorted(self.batch_sizes.items())),
+            }
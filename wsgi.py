@@ -0,0 +1,70 @@
+"""
+wsgi.py
+
+Production entry point: gunicorn -c gunicorn.conf.py (see that file for workers,
+threads and recycling).
+
+Contains:
+1) application: the Flask app
+2) preload(): runs once in the gunicorn master before workers are forked
+   - refuses to start without a persistent secret key (WFRESH_SECRET_KEY,
+     WFRESH_SECRET_KEY_FILE or SECRET_KEY in WFRESH_CONFIG), since per-worker
+     random keys log users out whenever a request lands on another worker
+   - switches the thread version counters to shared memory, so a reply posted
+     through one worker invalidates the caches of all of them
+   - refreshes the menu cache file, so workers start warm instead of all
+     fetching the week from AVI on their first request
+   - loads the trending counters once (rebuilding them from history if needed)
+     instead of once per worker
+   - freezes the objects allocated so far out of the garbage collector, so
+     workers keep sharing those memory pages copy-on-write
+3) post_fork(): per-worker startup (background threads do not survive fork).
+   This is where they start: importing app starts no threads, so tools and
+   benchmarks that import it don't poll the database, and the master forks
+   with no threads that could hold a lock
+"""
+
+import gc
+import logging
+from datetime import date
+
+import app as wfresh_app
+import wfresh_feasts
+import wfresh_helper
+import wfresh_metrics
+import wfresh_trending
+
+log = logging.getLogger(__name__)
+
+application = wfresh_app.app
+
+
+def preload():
+    """Prepare shared state in the master process (call before forking)."""
+    if not application.config['SECRET_KEY_PERSISTENT']:
+        raise RuntimeError('no secret key configured: set WFRESH_SECRET_KEY or WFRESH_SECRET_KEY_FILE '
+                           '(e.g. python -c "import secrets; print(secrets.token_hex())")')
+
+    wfresh_helper.thread_versions.enable_shared()
+
+    try:
+        wfresh_helper.fetch_week_menu(date.today())
+    except Exception:
+        log.exception('menu warm-up failed; workers will fetch it on first use')
+
+    try:
+        wfresh_trending.startup()
+    except Exception:
+        log.exception('trending load failed; each worker will retry')
+
+    # Forked workers inherit these values; don't count the warm-up once per worker.
+    wfresh_metrics.REGISTRY.reset()
+
+    gc.collect()
+    gc.freeze()
+
+
+def post_fork():
+    """Start this worker's background threads (idempotent per process)."""
+    wfresh_feasts.sweeper.start()
+    wfresh_trending.syncer.start()